@@ -0,0 +1,234 @@
+"""
+分析処理のベンチマーク
+
+1日・1週間・1ヶ月分のデータで主要な関数の実行時間とピークメモリを計測し、
+保存したベースラインと比較する
+
+python -m benchmarks.bench_analytics --save     # ベースラインを保存する
+python -m benchmarks.bench_analytics            # ベースラインと比較する
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+import datetime as dt
+from typing import Callable, NamedTuple
+
+import numpy as np
+import pandas as pd
+
+import src.analytics as a1
+import src.analytics2 as a
+import src.constants as c
+import src.definitions as d
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+# 10月はすべての日のファイルがそろっている
+DATE_FROM = dt.date(2022, 10, 3)
+SCALES = {"day": 1, "week": 7, "month": 28}
+LOBBY = d.Lobby.BANKARA_CHALLENGE
+COLOR_DETAILS_PATH = f"{c.DATA_DIR}/details_xmatch_221201_221207.csv"
+
+
+class Benchmark(NamedTuple):
+    """
+    name: ベンチマーク名
+    setup: 計測対象の関数の引数を作成する関数 (計測しない)
+    run: 計測対象の関数
+    """
+
+    name: str
+    setup: Callable[[int], tuple]
+    run: Callable
+
+
+_cache = {}
+
+
+def _details(days: int) -> pd.DataFrame:
+    if ("details", days) not in _cache:
+        date_to = DATE_FROM + dt.timedelta(days=days)
+        _cache[("details", days)] = a.read_details_from_to(DATE_FROM, date_to, LOBBY)
+    return _cache[("details", days)]
+
+
+def _players(days: int) -> pd.DataFrame:
+    if ("players", days) not in _cache:
+        _cache[("players", days)] = a.details_to_players(_details(days))
+    return _cache[("players", days)]
+
+
+# インクカラーの組 (同梱のバトル詳細にはカラーがないので割り当てる)
+COLOR_PAIRS = [
+    ("#d2e62b", "#6e3ac6"),
+    ("#df6624", "#343bc4"),
+    ("#c0358c", "#1bbe6e"),
+    ("#ceb121", "#3f2fc4"),
+    ("#e06b31", "#1a9fc3"),
+]
+
+
+def _color_details(days: int) -> pd.DataFrame:
+    # 1週間分のバトル詳細を日数に合わせて復元抽出する
+    details = a1.load_details(COLOR_DETAILS_PATH)
+    n = round(len(details.index) * days / 7)
+    details = details.sample(n, replace=True, random_state=0).reset_index(drop=True)
+    rng = np.random.default_rng(0)
+    pairs = rng.integers(len(COLOR_PAIRS), size=n)
+    swap = rng.integers(2, size=n)
+    colors = np.array(COLOR_PAIRS)[pairs]
+    details["A Color"] = colors[np.arange(n), swap]
+    details["B Color"] = colors[np.arange(n), 1 - swap]
+    return details
+
+
+BENCHMARKS = [
+    Benchmark(
+        "read_details_from_to",
+        lambda days: (DATE_FROM, DATE_FROM + dt.timedelta(days=days), LOBBY),
+        a.read_details_from_to,
+    ),
+    Benchmark(
+        "details_to_players",
+        lambda days: (_details(days),),
+        a.details_to_players,
+    ),
+    Benchmark(
+        "add_orchestration_columns",
+        lambda days: (_details(days).copy(),),
+        a.add_orchestration_columns,
+    ),
+    Benchmark(
+        "players_group_by_mode_and",
+        lambda days: ("weapon", _players(days)),
+        a.players_group_by_mode_and,
+    ),
+    Benchmark(
+        "aggregate_index_per_subject",
+        lambda days: (_players(days), "weapon", "usage-rate"),
+        a.aggregate_index_per_subject,
+    ),
+    Benchmark(
+        "aggregate_index_per_subjects",
+        lambda days: (
+            _players(days),
+            ["weapon", "weapon-sub", "weapon-special", "weapon-type"],
+            ["usage-rate", "win-rate", "kill"],
+        ),
+        a.aggregate_index_per_subjects,
+    ),
+    Benchmark(
+        "add_color_pair_column",
+        lambda days: (_color_details(days),),
+        a1.add_color_pair_column,
+    ),
+]
+
+
+def measure(benchmark: Benchmark, days: int, repeat: int) -> dict:
+    """
+    実行時間 (repeat 回の最小値) とピークメモリを計測する
+    ピークメモリは tracemalloc の計測のオーバーヘッドを避けるため別に1回実行して測る
+    """
+    times = []
+    for _ in range(repeat):
+        args = benchmark.setup(days)
+        start = time.perf_counter()
+        benchmark.run(*args)
+        times.append(time.perf_counter() - start)
+
+    args = benchmark.setup(days)
+    tracemalloc.start()
+    benchmark.run(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {"time": min(times), "peak_memory": peak}
+
+
+def run_benchmarks(
+    names: list[str], scales: list[str], repeat: int
+) -> dict[str, dict[str, dict]]:
+    results = {}
+    for benchmark in BENCHMARKS:
+        if names and benchmark.name not in names:
+            continue
+        for scale in scales:
+            key = f"{benchmark.name}[{scale}]"
+            result = measure(benchmark, SCALES[scale], repeat)
+            print(
+                f"{key:<40}{result['time']:>10.3f} s"
+                f"{result['peak_memory'] / 2**20:>10.1f} MiB"
+            )
+            results[key] = result
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> pd.DataFrame:
+    """
+    ベースラインとの比 (今回 / ベースライン) を計算する
+    threshold を超えたものを regression とする
+    """
+    rows = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        time_ratio = result["time"] / baseline[key]["time"]
+        memory_ratio = result["peak_memory"] / max(baseline[key]["peak_memory"], 1)
+        rows.append(
+            {
+                "benchmark": key,
+                "time": result["time"],
+                "time-ratio": time_ratio,
+                "peak-memory": result["peak_memory"],
+                "memory-ratio": memory_ratio,
+                "regression": time_ratio > threshold or memory_ratio > threshold,
+            }
+        )
+    return pd.DataFrame(rows)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="分析処理のベンチマーク")
+    parser.add_argument("names", nargs="*", help="実行するベンチマーク名")
+    parser.add_argument("--scale", nargs="+", default=list(SCALES), choices=SCALES)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--save", action="store_true", help="ベースラインを保存する")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--threshold", type=float, default=1.2, help="regression とみなす比")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.names, args.scale, args.repeat)
+
+    if args.save:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2)
+        print(f"saved baseline to {args.baseline}")
+        return 0
+
+    # ベースラインがないと比較できず regression を見逃すので失敗にする
+    if not os.path.exists(args.baseline):
+        print(f"baseline not found: {args.baseline}. run with --save first")
+        return 2
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    missing = [x for x in results if x not in baseline]
+    if len(missing) > 0:
+        print(f"not in baseline: {', '.join(missing)}. run with --save first")
+        return 2
+    comparison = compare(results, baseline, args.threshold)
+    print(comparison.to_string(index=False))
+    return 1 if comparison["regression"].any() else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,8 +4,10 @@ import pandas as pd
 import src.statink as s
 import src.constants as c
 import src.utils as u
+import src.instrument as ins
 
 
+@ins.instrument
 def load_details(details_path: str, use_deny: bool = False) -> pd.DataFrame:
     """
     csv からバトル詳細をロードする
@@ -19,6 +21,7 @@ def load_details(details_path: str, use_deny: bool = False) -> pd.DataFrame:
     return details
 
 
+@ins.instrument
 def add_color_pair_column(details: pd.DataFrame) -> pd.DataFrame:
     def cmp(a: str, b: str) -> int:
         ah = u.color_code_to_hsl(a)[0]
@@ -169,6 +172,7 @@ def _split_player_info(players: pd.DataFrame) -> pd.DataFrame:
     return players.drop(columns="Player")
 
 
+@ins.instrument
 def get_unique_user_num(details: pd.DataFrame):
     """
     ユニークユーザー数を取得する
@@ -204,6 +208,7 @@ def _detail_to_team_stat(detail: pd.Series, team: str) -> dict:
     return team_stat
 
 
+@ins.instrument
 def details_to_teams(details: pd.DataFrame) -> pd.DataFrame:
     """
     バトル詳細をチーム単位に整形する
@@ -226,6 +231,7 @@ def details_to_teams(details: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
+@ins.instrument
 def details_to_players(
     details: pd.DataFrame, use_heroshooter: bool = False
 ) -> pd.DataFrame:
@@ -251,6 +257,7 @@ def details_to_players(
     return p
 
 
+@ins.instrument
 def players_group_by_rule_and(groupby_key: str, players: pd.DataFrame) -> pd.DataFrame:
     """
     プレイヤーをルールとその他の key でグルーピングして
@@ -274,6 +281,7 @@ def players_group_by_rule_and(groupby_key: str, players: pd.DataFrame) -> pd.Dat
     return weapons
 
 
+@ins.instrument
 def aggregate_index_per_subject(
     players: pd.DataFrame, subject: str, target: str
 ) -> pd.DataFrame:
@@ -1,37 +1,144 @@
+import os
+import re
 import datetime as dt
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import Callable, Iterable, Iterator, NamedTuple, Optional
 import numpy as np
 import pandas as pd
+from scipy import sparse, stats
 import src.constants as c
 import src.utils as u
 import src.definitions as d
+import src.instrument as ins
+import src.cache as ca
+import src.schema as sc
 
 
-def read_details_on(date: dt.date, lobby: d.Lobby = d.Lobby.XMATCH) -> pd.DataFrame:
+# 戦績データの csv ファイルの拡張子 (圧縮していないもの、gzip, zstd)
+DETAILS_SUFFIXES = [".csv", *map(lambda x: f".csv{x}", u.COMPRESSION_SUFFIXES.values())]
+
+
+@ins.instrument
+def get_details_path(date: dt.date) -> str:
+    """
+    日付を指定して戦績データの csv ファイルのパスを取得する
+    圧縮したファイル (.csv.gz, .csv.zst) しかない場合はそのパスを返す
+    どのファイルもない場合は .csv のパスを返す
+    """
+    filepath = f"{c.STATINK_CSV_DIR}/{date}"
+    for suffix in DETAILS_SUFFIXES:
+        if os.path.exists(filepath + suffix):
+            return filepath + suffix
+    return filepath + ".csv"
+
+
+@ins.instrument
+def read_details_on(
+    date: dt.date, lobby: Optional[d.Lobby] = d.Lobby.XMATCH
+) -> pd.DataFrame:
     """
     日付を指定して戦績データを取得する
+    index は csv ファイル内の行番号
+    lobby が None の場合はすべてのロビーの戦績データを返す
+    圧縮したファイルは拡張子から形式を判定して展開する
+    カラムの型は schema.BATTLE_COLUMNS に合わせ、スキーマとの差分があれば表示する
     """
-    filename = str(date) + ".csv"
-    filepath = f"{c.STATINK_CSV_DIR}/{filename}"
-    details = pd.read_csv(filepath)
-    details = details[details["lobby"] == lobby.value]
+    filepath = get_details_path(date)
+    details, drifts = sc.read_csv(filepath)
+    sc.report(drifts)
+    if lobby is not None:
+        details = details[details["lobby"] == lobby.value]
     details.insert(2, "date", str(date))
-    details["period"] = pd.to_datetime(details["period"])
     details["date"] = pd.to_datetime(details["date"])
-    details["knockout"] = details["knockout"].astype("bool")
     return details
 
 
+@ins.instrument
+def battle_fingerprint(details: pd.DataFrame) -> pd.Series:
+    """
+    戦績データの各試合のフィンガープリントを計算する
+    同じ試合を別のプレイヤーが投稿した場合 (チームの入れ替えや win の反転を含む) も
+    同じ値になるように、各チームをプレイヤー (ブキと成績) の多重集合として扱う
+    """
+    stat_items = ["weapon", "kill", "assist", "death", "special", "inked"]
+
+    def team_hash(team: str) -> np.ndarray:
+        player_hashes = []
+        for i in range(4):
+            cols = list(map(lambda x: f"{team}{i+1}-{x}", stat_items))
+            player = details[cols].set_axis(stat_items, axis=1)
+            player_hashes.append(pd.util.hash_pandas_object(player, index=False))
+        # 順不同にするためソートしてから結合する
+        sorted_hashes = np.sort(np.stack(player_hashes, axis=1), axis=1)
+        return pd.util.hash_pandas_object(
+            pd.DataFrame(sorted_hashes), index=False
+        ).to_numpy()
+
+    a_hash = team_hash("A")
+    b_hash = team_hash("B")
+    a_win = (details["win"] == "alpha").to_numpy()
+    b_win = (details["win"] == "bravo").to_numpy()
+    swap = a_hash > b_hash
+    battle = pd.DataFrame(
+        {
+            "period": details["period"].to_numpy(),
+            "stage": details["stage"].to_numpy(),
+            "mode": details["mode"].to_numpy(),
+            "time": details["time"].to_numpy(),
+            "team1": np.where(swap, b_hash, a_hash),
+            "team2": np.where(swap, a_hash, b_hash),
+            "team1-win": np.where(swap, b_win, a_win),
+            "team2-win": np.where(swap, a_win, b_win),
+        }
+    )
+    return pd.Series(
+        pd.util.hash_pandas_object(battle, index=False).to_numpy(),
+        index=details.index,
+    )
+
+
+@ins.instrument
+def drop_duplicate_battles(details: pd.DataFrame) -> pd.DataFrame:
+    """
+    複数のプレイヤーが投稿した同じ試合を1つにする
+    最初に現れたものを残し、日付ごとに除外した件数を表示する
+    """
+    duplicated = battle_fingerprint(details).duplicated()
+    removed = details.loc[duplicated, "date"].dt.date.value_counts().sort_index()
+    for date, count in removed.items():
+        print(f"{date}: removed {count} duplicate battles")
+    return details[~duplicated]
+
+
+@ins.instrument
 def read_details_from_to(
-    date_from: dt.date, date_to: dt.date, lobby: d.Lobby = d.Lobby.XMATCH
+    date_from: dt.date,
+    date_to: dt.date,
+    lobby: d.Lobby = d.Lobby.XMATCH,
+    drop_duplicates: bool = False,
+    processes: Optional[int] = 1,
 ) -> pd.DataFrame:
     """
     日付の期間を指定して戦績データを取得する
+
+    drop_duplicates: 複数のプレイヤーが投稿した同じ試合を1つにする
+    processes: 読み込み (圧縮したファイルの展開とパース) に使うプロセス数
+        None の場合は CPU 数
     """
     date_list = list(u.date_range(date_from, date_to))
-    details_list = list(map(lambda x: read_details_on(x, lobby), date_list))
-    return pd.concat(details_list, ignore_index=True)
+    if processes == 1:
+        details_list = list(map(read_details_on, date_list, repeat(lobby)))
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            details_list = list(executor.map(read_details_on, date_list, repeat(lobby)))
+    details = pd.concat(details_list, ignore_index=True)
+    if drop_duplicates:
+        details = drop_duplicate_battles(details)
+    return details
 
 
+@ins.instrument
 def add_orchestration_columns(details: pd.DataFrame) -> pd.DataFrame:
     """
     戦績データにブキ編成のカラムを追加する
@@ -130,12 +237,74 @@ def add_orchestration_columns(details: pd.DataFrame) -> pd.DataFrame:
     return details
 
 
+ABILITIES = d.STANDARD_ABILITIES + [
+    ability for part in d.EXCLUSIVE_ABILITIES.values() for ability in part
+]
+
+
+@ins.instrument
+def parse_abilities(abilities: pd.Series) -> pd.DataFrame:
+    """
+    ギアパワーの文字列をギアパワーごとの数の配列に変換する
+    数は 0.1 GP 単位 (メイン 1 つで 10, サブ 1 つで 3) の uint8
+    メイン専用のギアパワー (true) は 10 とする
+    e.g. {"swim_speed_up":1.3,"stealth_jump":true} => swim_speed_up: 13, stealth_jump: 10
+
+    同じ文字列は 1 度だけ、すべての文字列をまとめて正規表現で分解する
+    文字列が欠損している行はすべて 0
+
+    abilities: stat.ink の "<player>-abilities" 形式の Series
+    返り値: カラムが "ability-<ギアパワー>" の DataFrame (index は abilities と同じ)
+    """
+    codes, uniques = pd.factorize(abilities)
+    text = "\n".join(uniques) + "\n"
+    tokens = re.findall(r'[a-z_]+":(?:[0-9.]+|true)|\n', text)
+    token_codes, token_uniques = pd.factorize(np.array(tokens, dtype=object))
+
+    # 種類の少ないトークン (e.g. 'swim_speed_up":1.3') ごとにカラムと値を求める
+    ability_index = {ability: i for i, ability in enumerate(ABILITIES)}
+    token_col = np.full(len(token_uniques), -1)
+    token_value = np.zeros(len(token_uniques), dtype="uint8")
+    for i, token in enumerate(token_uniques):
+        if token == "\n":
+            continue
+        ability, value = token.split('":')
+        token_col[i] = ability_index.get(ability, -1)
+        token_value[i] = 10 if value == "true" else round(float(value) * 10)
+
+    separator = token_uniques == "\n"
+    row = np.cumsum(separator[token_codes])
+    col = token_col[token_codes]
+    known = col >= 0
+    # 最後の行は欠損 (codes が -1) 用
+    counts = np.zeros((len(uniques) + 1, len(ABILITIES)), dtype="uint8")
+    counts[row[known], col[known]] = token_value[token_codes[known]]
+    return pd.DataFrame(
+        counts[codes],
+        index=abilities.index,
+        columns=[f"ability-{x}" for x in ABILITIES],
+    )
+
+
+@ins.instrument
 def details_to_players(
     details: pd.DataFrame,
     additional_columns: list[str] = [],
     use_uploader: bool = False,
     use_heroshooter: bool = False,
+    use_abilities: bool = False,
 ) -> pd.DataFrame:
+    """
+    戦績データを 1 行 1 プレイヤーの DataFrame に変換する
+
+    details: 戦績データの DataFrame
+    additional_columns: 共通項として追加するカラム
+    use_uploader: 投稿者のデータを含める
+    use_heroshooter: ヒーローシューターレプリカをスプラシューターと合算しない
+    use_abilities: ギアパワーの文字列 "abilities" の代わりに
+        parse_abilities の "ability-<ギアパワー>" カラムと
+        ギアパワーのデータがあるかを表す "has-abilities" カラムを追加する
+    """
     use_cols = [
         "# season",
         "period",
@@ -160,86 +329,39 @@ def details_to_players(
         "inked",
         "abilities",
     ]
-    player_cols = []
-    for player_name in player_names:
-        cols = list(map(lambda item: f"{player_name}-{item}", items))
-        player_cols.extend(cols)
-
-    # details を共通項とプレイヤー項に分離する
-    common = details[use_cols].copy()
-    player = details[player_cols].copy().fillna("nan")
 
-    # 各プレイヤー情報を1つの列に結合する
+    # 共通項を繰り返し、プレイヤー項を A1, A2, ..., B4 の順に縦に並べる
+    common = details[use_cols]
+    common = pd.concat([common] * len(player_names), ignore_index=True)
+    player_list = []
     for player_name in player_names:
-        player[player_name] = (
-            player[f"{player_name}-weapon"]
-            + "/"
-            + player[f"{player_name}-kill-assist"].astype(str)
-            + "/"
-            + player[f"{player_name}-kill"].astype(str)
-            + "/"
-            + player[f"{player_name}-assist"].astype(str)
-            + "/"
-            + player[f"{player_name}-death"].astype(str)
-            + "/"
-            + player[f"{player_name}-special"].astype(str)
-            + "/"
-            + player[f"{player_name}-inked"].astype(str)
-            + "/"
-            + player[f"{player_name}-abilities"]
-        )
-    player = player.drop(columns=player_cols)
-
-    # 共通項とプレイヤー項を結合し melt する
-    df = pd.concat([common, player], axis=1)
-    players = df.melt(id_vars=use_cols, value_name="player")
+        player = details[list(map(lambda item: f"{player_name}-{item}", items))]
+        player_list.append(player.set_axis(items, axis="columns"))
+    split = pd.concat(player_list, ignore_index=True)
 
     # team 列を追加したり、win 列を boolean に置き換える
-    player_name_to_team_map = {}
-    for player_name in player_names:
-        player_name_to_team_map[player_name] = (
-            "alpha" if player_name[0] == "A" else "bravo"
-        )
-    team = players["variable"].map(player_name_to_team_map)
-    players.insert(8, "team", team)
-
-    uploader = players["variable"] == "A1"
-    players.insert(12, "uploader", uploader)
-
-    players["win"] = players["win"] == players["team"]
-    players = players.drop(columns="variable")
+    n = len(details.index)
+    team = np.repeat(np.array(["alpha"] * 4 + ["bravo"] * 4, dtype=object), n)
+    common.insert(8, "team", team)
+    uploader = np.zeros(len(common.index), dtype=bool)
+    uploader[:n] = True
+    common.insert(12, "uploader", uploader)
+    common["win"] = common["win"] == common["team"]
 
     if not use_uploader:
         # 投稿者のデータを除外する
-        players = players[~players["uploader"]]
-
-    # 結合していたプレイヤー項を分離して元に戻す
-    split = (
-        players["player"]
-        .str.split("/", expand=True)
-        .replace("nan", np.nan)
-        .rename(
-            columns={
-                0: "weapon",
-                1: "kill-assist",
-                2: "kill",
-                3: "assist",
-                4: "death",
-                5: "special",
-                6: "inked",
-                7: "abilities",
-            }
-        )
-        .astype(
-            {
-                "kill-assist": "int64",
-                "kill": "int64",
-                "assist": "int64",
-                "death": "int64",
-                "special": "int64",
-                "inked": "int64",
-            }
-        )
+        common = common[~uploader]
+        split = split[~uploader]
+
+    split = split.astype(
+        {
+            "kill-assist": "int64",
+            "kill": "int64",
+            "assist": "int64",
+            "death": "int64",
+            "special": "int64",
+            "inked": "int64",
+        }
     )
 
     # ヒーローシューターレプリカを合算する
@@ -248,43 +370,285 @@ def details_to_players(
 
     # サブ・スペシャル・ブキ種を追加する
     main = pd.read_csv(c.SOURCE_MAIN_PATH, index_col="Key")
-    weapon_sub = split["weapon"].apply(lambda x: main.at[x, "Sub"])
-    weapon_special = split["weapon"].apply(lambda x: main.at[x, "Special"])
-    weapon_type = split["weapon"].apply(lambda x: main.at[x, "Type"])
-    split.insert(1, "weapon-sub", weapon_sub)
-    split.insert(2, "weapon-special", weapon_special)
-    split.insert(3, "weapon-type", weapon_type)
-
-    players = pd.concat([players, split], axis=1)
-    players = players.drop(columns="player")
+    split.insert(1, "weapon-sub", split["weapon"].map(main["Sub"]))
+    split.insert(2, "weapon-special", split["weapon"].map(main["Special"]))
+    split.insert(3, "weapon-type", split["weapon"].map(main["Type"]))
+
+    if use_abilities:
+        has_abilities = split["abilities"].notna()
+        abilities = parse_abilities(split["abilities"])
+        split = split.drop(columns="abilities")
+        split = pd.concat(
+            [split, has_abilities.rename("has-abilities"), abilities], axis=1
+        )
+
+    players = pd.concat([common, split], axis=1)
     return players
 
 
-def players_group_by_mode_and(groupby_key: str, players: pd.DataFrame) -> pd.DataFrame:
+@ins.instrument
+def wilson_interval(
+    success: np.ndarray, total: np.ndarray, confidence: float = 0.95
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    二項比率の Wilson スコア信頼区間を計算する
+    返り値は割合 (0 ~ 1) の下限と上限
+
+    success: 成功数 (e.g. 勝利数)
+    total: 試行数 (e.g. 試合数)
+    confidence: 信頼水準
+    """
+    success = np.asarray(success, dtype="float64")
+    total = np.asarray(total, dtype="float64")
+    z = stats.norm.ppf(0.5 + confidence / 2)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        p = success / total
+        denominator = 1 + z**2 / total
+        center = (p + z**2 / (2 * total)) / denominator
+        half = (
+            z * np.sqrt(p * (1 - p) / total + z**2 / (4 * total**2)) / denominator
+        )
+    return center - half, center + half
+
+
+@ins.instrument
+def jeffreys_interval(
+    success: np.ndarray, total: np.ndarray, confidence: float = 0.95
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    二項比率の Jeffreys 信頼区間を計算する
+    返り値は割合 (0 ~ 1) の下限と上限
+
+    success: 成功数 (e.g. 勝利数)
+    total: 試行数 (e.g. 試合数)
+    confidence: 信頼水準
+    """
+    success = np.asarray(success, dtype="float64")
+    total = np.asarray(total, dtype="float64")
+    alpha = 1 - confidence
+    with np.errstate(invalid="ignore"):
+        lower = stats.beta.ppf(alpha / 2, success + 0.5, total - success + 0.5)
+        upper = stats.beta.ppf(1 - alpha / 2, success + 0.5, total - success + 0.5)
+    lower = np.where(success == 0, 0, lower)
+    upper = np.where(success == total, 1, upper)
+    return lower, upper
+
+
+@ins.instrument
+def bootstrap_interval(
+    success: np.ndarray,
+    total: np.ndarray,
+    confidence: float = 0.95,
+    n_resamples: int = 1000,
+    seed: Optional[int] = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    二項比率のパーセンタイル・ブートストラップ信頼区間を計算する
+    行を復元抽出する代わりに、集計済みの件数を二項分布から再標本化する
+    返り値は割合 (0 ~ 1) の下限と上限
+
+    success: 成功数 (e.g. 勝利数)
+    total: 試行数 (e.g. 試合数)
+    confidence: 信頼水準
+    n_resamples: 再標本化の回数
+    seed: 乱数のシード
+    """
+    success = np.asarray(success, dtype="float64")
+    total = np.asarray(total, dtype="int64")
+    rng = np.random.default_rng(seed)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        p = np.nan_to_num(success / total)
+        resampled = rng.binomial(
+            total[:, np.newaxis], p[:, np.newaxis], size=(len(total), n_resamples)
+        )
+        rates = resampled / total[:, np.newaxis]
+    alpha = 1 - confidence
+    lower, upper = np.quantile(rates, [alpha / 2, 1 - alpha / 2], axis=1)
+    lower = np.where(total > 0, lower, np.nan)
+    upper = np.where(total > 0, upper, np.nan)
+    return lower, upper
+
+
+_INTERVAL_FUNCTIONS = {
+    "wilson": wilson_interval,
+    "jeffreys": jeffreys_interval,
+    "bootstrap": bootstrap_interval,
+}
+
+
+def _insert_interval_columns(
+    subject: pd.DataFrame,
+    rate_key: str,
+    success: np.ndarray,
+    total: np.ndarray,
+    interval: str,
+    confidence: float,
+) -> pd.DataFrame:
+    """
+    rate_key のカラムの直後に信頼区間の下限・上限のカラム (%) を追加する
+    """
+    if interval not in _INTERVAL_FUNCTIONS:
+        raise ValueError(f"unknown interval: {interval}")
+    lower, upper = _INTERVAL_FUNCTIONS[interval](success, total, confidence)
+    loc = subject.columns.get_loc(rate_key)
+    subject.insert(loc + 1, f"{rate_key}-lower", lower * 100)
+    subject.insert(loc + 2, f"{rate_key}-upper", upper * 100)
+    return subject
+
+
+@ins.instrument
+def players_partial_by_mode_and(
+    groupby_key: str, players: pd.DataFrame
+) -> pd.DataFrame:
     """
     プレイヤーをモードとその他の key でグルーピングして
-    勝率や使用率を計算する
+    件数と数値カラムの合計・非欠損数を集計する
+    日付ごとなどに分割したプレイヤーの集計結果は
+    merge_players_partials で足し合わせることができる
 
     groupby_key: 集計したいカラム名
     players: プレイヤーの DataFrame
+
+    返り値: index が (モード, groupby_key) で、カラムが
+        "count", "<column>-sum", "<column>-n" の DataFrame
+        モードの合計数を求めるため groupby_key が欠損の行も含む
     """
-    players_per_mode = players["mode"].value_counts()
-    group = players.groupby(["mode", groupby_key])
-    count = group["lobby"].count()
-    subject = group.mean()
+    numeric = players.select_dtypes(include=["number", "bool"]).columns
+    numeric = [x for x in numeric if x not in ["mode", groupby_key]]
+    group = players.groupby(["mode", groupby_key], dropna=False)
+    count = group["lobby"].count().rename("count")
+    sums = group[numeric].sum().add_suffix("-sum")
+    ns = group[numeric].count().add_suffix("-n")
+    partial = pd.concat([count, sums, ns], axis=1)
+    return partial.astype({x: "float64" for x in sums.columns if x != "win-sum"})
+
+
+@ins.instrument
+def merge_players_partials(partials: Iterable[pd.DataFrame]) -> pd.DataFrame:
+    """
+    players_partial_by_mode_and の集計結果を足し合わせる
+    1つずつ足し合わせるので、ジェネレーターを渡せばメモリ使用量は
+    集計結果の大きさに収まる
+
+    partials: players_partial_by_mode_and の集計結果
+    """
+    merged = None
+    for partial in partials:
+        if merged is not None:
+            partial = pd.concat([merged, partial])
+        merged = partial.groupby(level=[0, 1], dropna=False, sort=True).sum()
+    if merged is None:
+        raise ValueError("no partials to merge")
+    return merged
+
+
+@ins.instrument
+def partial_to_players_group(
+    groupby_key: str,
+    partial: pd.DataFrame,
+    interval: Optional[str] = None,
+    confidence: float = 0.95,
+) -> pd.DataFrame:
+    """
+    players_partial_by_mode_and の集計結果から勝率や使用率を計算する
+    返り値は players_group_by_mode_and と同じ形式
+
+    groupby_key: 集計したいカラム名
+    partial: players_partial_by_mode_and の集計結果
+    interval: 勝率と使用率の信頼区間の計算方法 (None の場合は計算しない)
+    confidence: 信頼水準
+    """
+    players_per_mode = partial.groupby(level="mode")["count"].sum()
+    partial = partial[partial.index.get_level_values(groupby_key).notna()]
+    partial = partial.sort_index()
+    numeric = [x[: -len("-sum")] for x in partial.columns if x.endswith("-sum")]
+    subject = pd.DataFrame(
+        {x: partial[f"{x}-sum"] / partial[f"{x}-n"] for x in numeric},
+        index=partial.index,
+    )
     win_rate = subject["win"] * 100
-    subject.insert(0, "count", count)
+    subject.insert(0, "count", partial["count"])
     subject.insert(3, "win-rate", win_rate)
     subject = subject.reset_index()
-    total_count = subject["mode"].apply(lambda x: players_per_mode[x])
+    total_count = subject["mode"].map(players_per_mode)
     subject.insert(3, "total-count", total_count)
     usage_rate = subject["count"] / subject["total-count"] * 100
     subject.insert(4, "usage-rate", usage_rate)
+    if interval is not None:
+        win_count = partial["win-sum"].to_numpy()
+        count = subject["count"].to_numpy()
+        total_count = subject["total-count"].to_numpy()
+        subject = _insert_interval_columns(
+            subject, "usage-rate", count, total_count, interval, confidence
+        )
+        subject = _insert_interval_columns(
+            subject, "win-rate", win_count, count, interval, confidence
+        )
     return subject
 
 
+@ins.instrument
+def players_group_by_mode_and(
+    groupby_key: str,
+    players: pd.DataFrame,
+    interval: Optional[str] = None,
+    confidence: float = 0.95,
+) -> pd.DataFrame:
+    """
+    プレイヤーをモードとその他の key でグルーピングして
+    勝率や使用率を計算する
+
+    groupby_key: 集計したいカラム名
+    players: プレイヤーの DataFrame
+    interval: 勝率と使用率の信頼区間の計算方法
+        "wilson", "jeffreys", "bootstrap" のいずれか
+        None の場合は信頼区間を計算しない
+    confidence: 信頼水準
+    """
+    partial = players_partial_by_mode_and(groupby_key, players)
+    return partial_to_players_group(groupby_key, partial, interval, confidence)
+
+
+# 信頼区間を計算できる指標
+INTERVAL_TARGETS = ["usage-rate", "win-rate"]
+
+
+def _check_interval_target(target: str, interval: Optional[str]):
+    if interval is not None and target not in INTERVAL_TARGETS:
+        raise ValueError(
+            f"interval only applies to usage-rate and win-rate, not {target}"
+        )
+
+
+def _pivot_index_per_mode(
+    df: pd.DataFrame, subject: str, target: str, interval: Optional[str]
+) -> pd.DataFrame:
+    modes = ["area", "yagura", "hoko", "asari"]
+    df_wide = df.pivot(index=subject, columns="mode", values=target).reindex(
+        columns=modes
+    )
+    mean = df_wide.mean(axis="columns")
+    median = df_wide.median(axis="columns")
+    df_wide["mean"] = mean
+    df_wide["median"] = median
+    if interval is not None:
+        for bound in ["lower", "upper"]:
+            df_bound = df.pivot(
+                index=subject, columns="mode", values=f"{target}-{bound}"
+            )
+            df_bound = df_bound.reindex(columns=modes)
+            for mode in modes:
+                df_wide[f"{mode}-{bound}"] = df_bound[mode]
+    return df_wide.sort_values("median", ascending=False)
+
+
+@ins.instrument
 def aggregate_index_per_subject(
-    players: pd.DataFrame, subject: str, target: str
+    players: pd.DataFrame,
+    subject: str,
+    target: str,
+    interval: Optional[str] = None,
+    confidence: float = 0.95,
 ) -> pd.DataFrame:
     """
     対象ごとに指標を集計する
@@ -293,13 +657,699 @@ def aggregate_index_per_subject(
     players: プレイヤー情報の DataFrame
     subject: 対象 (e.g. "weapon")
     target: 集計する指標 (e.g. "usage-rate")
+    interval: 指定した場合は target の信頼区間のカラムを追加する
+        (e.g. "area-lower", "area-upper")
+        target が "usage-rate" か "win-rate" のときに使える
+    confidence: 信頼水準
+    """
+    _check_interval_target(target, interval)
+    df = players_group_by_mode_and(
+        subject, players, interval=interval, confidence=confidence
+    )
+    return _pivot_index_per_mode(df, subject, target, interval)
+
+
+@ins.instrument
+def aggregate_index_per_subjects(
+    players: pd.DataFrame,
+    subjects: list[str],
+    targets: list[str],
+    interval: Optional[str] = None,
+    confidence: float = 0.95,
+) -> dict[tuple[str, str], pd.DataFrame]:
+    """
+    複数の対象と指標をまとめて集計する
+    グルーピングのキーを整数に変換し np.bincount で必要な指標だけを集計するので、
+    対象ごとに aggregate_index_per_subject を呼ぶより速い
+    e.g. aggregate_index_per_subjects(players, ["weapon", "weapon-sub"], ["usage-rate", "win-rate"])
+
+    players: プレイヤー情報の DataFrame
+    subjects: 対象のリスト (e.g. ["weapon", "weapon-sub"])
+    targets: 指標のリスト ("count", "usage-rate", "win-rate" または数値カラムの平均 e.g. "kill")
+    interval: 指定した場合は "usage-rate", "win-rate" の信頼区間のカラムを追加する
+    confidence: 信頼水準
+
+    返り値: {(対象, 指標): aggregate_index_per_subject と同じ DataFrame}
+    """
+    mode_codes, modes = pd.factorize(players["mode"])
+    mode_num = len(modes)
+    total_per_mode = np.bincount(mode_codes[mode_codes >= 0], minlength=mode_num)
+    win = players["win"].to_numpy(dtype="float64")
+    means = [x for x in targets if x not in ["count", "usage-rate", "win-rate"]]
+    values = {x: players[x].to_numpy(dtype="float64") for x in means}
+
+    results = {}
+    for subject in subjects:
+        # (モード, 対象) の組を整数のキーにする (欠損値の行は除く)
+        subject_codes, subject_values = pd.factorize(players[subject])
+        subject_num = len(subject_values)
+        size = mode_num * subject_num
+        keys = mode_codes * subject_num + subject_codes
+        valid = (mode_codes >= 0) & (subject_codes >= 0)
+        group = keys[valid]
+
+        count = np.bincount(group, minlength=size)
+        observed = np.flatnonzero(count)
+        df = pd.DataFrame(
+            {
+                "mode": modes[observed // subject_num],
+                subject: subject_values[observed % subject_num],
+                "count": count[observed],
+            }
+        )
+        total_count = total_per_mode[observed // subject_num]
+        win_count = np.bincount(group, weights=win[valid], minlength=size)[observed]
+        df["usage-rate"] = df["count"] / total_count * 100
+        df["win-rate"] = win_count / df["count"] * 100
+        if interval is not None:
+            count = df["count"].to_numpy()
+            df = _insert_interval_columns(
+                df, "usage-rate", count, total_count, interval, confidence
+            )
+            df = _insert_interval_columns(
+                df, "win-rate", win_count, count, interval, confidence
+            )
+        for key, value in values.items():
+            known = valid & ~np.isnan(value)
+            group_known = keys[known]
+            total = np.bincount(group_known, weights=value[known], minlength=size)
+            n = np.bincount(group_known, minlength=size)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                df[key] = total[observed] / n[observed]
+
+        for target in targets:
+            results[(subject, target)] = _pivot_index_per_mode(
+                df,
+                subject,
+                target,
+                interval if target in INTERVAL_TARGETS else None,
+            )
+    return results
+
+
+@ins.instrument
+def aggregate_ability_per_subject(
+    players: pd.DataFrame,
+    subject: str = "weapon",
+    target: str = "adoption-rate",
+    abilities: Optional[list[str]] = None,
+) -> dict[str, pd.DataFrame]:
+    """
+    対象ごとにギアパワーの採用率または平均 GP を集計する
+    e.g. ブキごとのステルスジャンプの採用率を集計する
+    すべてのギアパワーを 1 回のグルーピングで集計する
+
+    players: details_to_players(..., use_abilities=True) の DataFrame
+    subject: 対象 (e.g. "weapon")
+    target: "adoption-rate" (ギアパワーを付けている割合 %) または "gp" (平均 GP)
+    abilities: 集計するギアパワー (None の場合はすべて)
+
+    返り値: {ギアパワー: aggregate_index_per_subject と同じ形式の DataFrame}
+        ギアパワーのデータがないプレイヤーは除いて集計する
+    """
+    if abilities is None:
+        abilities = ABILITIES
+    known = players["has-abilities"].to_numpy()
+    df = players[["lobby", "mode", "win", subject]].copy()
+    for ability in abilities:
+        counts = players[f"ability-{ability}"].to_numpy()
+        if target == "adoption-rate":
+            values = (counts > 0) * 100.0
+        elif target == "gp":
+            values = counts / 10
+        else:
+            raise ValueError(f"unknown target: {target}")
+        df[ability] = np.where(known, values, np.nan)
+
+    grouped = players_group_by_mode_and(subject, df, interval=None)
+    return {
+        ability: _pivot_index_per_mode(grouped, subject, ability, None)
+        for ability in abilities
+    }
+
+
+@ins.instrument
+def iter_players_from_to(
+    date_from: dt.date,
+    date_to: dt.date,
+    lobby: d.Lobby = d.Lobby.XMATCH,
+    filter_details: Optional[Callable[[pd.DataFrame], pd.DataFrame]] = None,
+    **kwargs,
+) -> Iterator[pd.DataFrame]:
+    """
+    日付の期間を指定してプレイヤー情報を1日ずつ返す
+    期間全体の戦績データを一度に読み込まないのでメモリ使用量は1日分に収まる
+
+    filter_details: 戦績データを絞り込む関数
+        e.g. lambda x: x[x["game-ver"] == "2.0.1"]
+    kwargs: details_to_players に渡す引数
+    """
+    for date in u.date_range(date_from, date_to):
+        details = read_details_on(date, lobby)
+        if filter_details is not None:
+            details = filter_details(details)
+        if details.empty:
+            continue
+        yield details_to_players(details, **kwargs)
+
+
+def _players_partials_on(
+    date: dt.date,
+    lobby: d.Lobby,
+    subjects: list[str],
+    filter_details: Optional[Callable[[pd.DataFrame], pd.DataFrame]],
+    kwargs: dict,
+) -> Optional[dict[str, pd.DataFrame]]:
+    """
+    1日分のプレイヤー情報を対象ごとに集計する (プロセスプールで実行する)
+    """
+    details = read_details_on(date, lobby)
+    if filter_details is not None:
+        details = filter_details(details)
+    if details.empty:
+        return None
+    players = details_to_players(details, **kwargs)
+    return {x: players_partial_by_mode_and(x, players) for x in subjects}
+
+
+@ins.instrument
+def players_group_by_mode_and_from_to(
+    date_from: dt.date,
+    date_to: dt.date,
+    subjects: list[str],
+    lobby: d.Lobby = d.Lobby.XMATCH,
+    filter_details: Optional[Callable[[pd.DataFrame], pd.DataFrame]] = None,
+    processes: Optional[int] = None,
+    interval: Optional[str] = None,
+    confidence: float = 0.95,
+    **kwargs,
+) -> dict[str, pd.DataFrame]:
+    """
+    日付の期間を指定して、複数の対象について players_group_by_mode_and を計算する
+    日付ごとの集計をプロセスプールで並列に行い、その結果を足し合わせる
+    結果は期間全体のプレイヤー情報で players_group_by_mode_and を実行したものと同じ
+
+    subjects: 集計したいカラム名のリスト (e.g. ["weapon", "weapon-sub"])
+    filter_details: 戦績データを絞り込む関数
+        別プロセスに渡すため lambda ではなくモジュールレベルの関数にする
+    processes: プロセス数 (None の場合は CPU コア数, 1 の場合は並列化しない)
+    kwargs: details_to_players に渡す引数
+
+    返り値: 対象ごとの players_group_by_mode_and の結果の dict
+    """
+    date_list = list(u.date_range(date_from, date_to))
+    args = (lobby, subjects, filter_details, kwargs)
+
+    def merge(results: Iterable[Optional[dict[str, pd.DataFrame]]]):
+        merged = {x: None for x in subjects}
+        for result in results:
+            if result is None:
+                continue
+            for subject in subjects:
+                partials = [result[subject]]
+                if merged[subject] is not None:
+                    partials.insert(0, merged[subject])
+                merged[subject] = merge_players_partials(partials)
+        return merged
+
+    if processes == 1:
+        merged = merge(map(lambda x: _players_partials_on(x, *args), date_list))
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            repeated_args = map(lambda x: repeat(x), args)
+            merged = merge(
+                executor.map(_players_partials_on, date_list, *repeated_args)
+            )
+
+    if any(x is None for x in merged.values()):
+        raise ValueError("no players in the date range")
+    return {
+        x: partial_to_players_group(x, merged[x], interval, confidence)
+        for x in subjects
+    }
+
+
+@ins.instrument
+def aggregate_index_per_subject_from_to(
+    date_from: dt.date,
+    date_to: dt.date,
+    subject: str,
+    target: str,
+    lobby: d.Lobby = d.Lobby.XMATCH,
+    filter_details: Optional[Callable[[pd.DataFrame], pd.DataFrame]] = None,
+    interval: Optional[str] = None,
+    confidence: float = 0.95,
+    processes: Optional[int] = 1,
+    use_cache: bool = False,
+    **kwargs,
+) -> pd.DataFrame:
+    """
+    日付の期間を指定して対象ごとに指標を集計する
+    1日ずつ読み込んで集計し足し合わせるので、期間が長くても
+    メモリ使用量は1日分のデータと集計結果の大きさに収まる
+    結果は aggregate_index_per_subject と同じ
+
+    filter_details: 戦績データを絞り込む関数
+    processes: 並列に集計するプロセス数 (None の場合は CPU コア数)
+        並列化するとメモリ使用量はおよそプロセス数倍になる
+    use_cache: 引数と戦績データのファイルが同じなら AGGREGATE_CACHE_DIR に
+        保存した結果を使う
+    kwargs: details_to_players に渡す引数
+    """
+    _check_interval_target(target, interval)
+    if use_cache:
+        params = dict(
+            date_from=date_from,
+            date_to=date_to,
+            subject=subject,
+            target=target,
+            lobby=lobby,
+            filter_details=filter_details,
+            interval=interval,
+            confidence=confidence,
+            processes=processes,
+            **kwargs,
+        )
+        input_paths = list(map(get_details_path, u.date_range(date_from, date_to)))
+        return ca.cached_call(
+            aggregate_index_per_subject_from_to,
+            params,
+            input_paths,
+            ignore=["processes"],
+            # 読み込み時の型変換とブキの対応表が変わった場合も集計し直す
+            dependencies=[sc.__file__, d.__file__, u.__file__, c.SOURCE_MAIN_PATH],
+        )
+
+    grouped = players_group_by_mode_and_from_to(
+        date_from,
+        date_to,
+        [subject],
+        lobby,
+        filter_details,
+        processes=processes,
+        interval=interval,
+        confidence=confidence,
+        **kwargs,
+    )
+    return _pivot_index_per_mode(grouped[subject], subject, target, interval)
+
+
+MODES = ["area", "yagura", "hoko", "asari"]
+
+
+class SubjectTimeSeries(NamedTuple):
+    """
+    対象ごとの日別の件数の累積和
+    i 日目から j 日目の前日までの件数は count[j] - count[i] で求まる
+
+    subject: 対象のカラム名 (e.g. "weapon")
+    dates: 日付 (日数)
+    modes: モード
+    subjects: 対象の値
+    count: 件数の累積和 (日数 + 1, モード数, 対象数), 先頭は 0
+    win: 勝利数の累積和 (日数 + 1, モード数, 対象数)
+    total: モードごとの全プレイヤー数の累積和 (日数 + 1, モード数)
+    """
+
+    subject: str
+    dates: pd.DatetimeIndex
+    modes: list[str]
+    subjects: pd.Index
+    count: np.ndarray
+    win: np.ndarray
+    total: np.ndarray
+
+
+@ins.instrument
+def create_subject_time_series(
+    date_from: dt.date,
+    date_to: dt.date,
+    subject: str,
+    lobby: d.Lobby = d.Lobby.XMATCH,
+    filter_details: Optional[Callable[[pd.DataFrame], pd.DataFrame]] = None,
+    processes: Optional[int] = 1,
+    modes: list[str] = MODES,
+    **kwargs,
+) -> SubjectTimeSeries:
+    """
+    日付の期間を指定して、日ごとの件数を1度だけ集計し累積和を作成する
+    戦績データがない日は件数 0 とする
+
+    subject: 対象のカラム名 (e.g. "weapon")
+    filter_details: 戦績データを絞り込む関数
+    processes: 並列に集計するプロセス数 (None の場合は CPU コア数)
+    modes: 集計するモード (ナワバリの場合は ["nawabari"])
+    kwargs: details_to_players に渡す引数
+    """
+    date_list = [
+        x
+        for x in u.date_range(date_from, date_to)
+        if os.path.exists(get_details_path(x))
+    ]
+    args = (lobby, [subject], filter_details, kwargs)
+    if processes == 1:
+        results = list(map(lambda x: _players_partials_on(x, *args), date_list))
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            repeated_args = map(lambda x: repeat(x), args)
+            results = list(
+                executor.map(_players_partials_on, date_list, *repeated_args)
+            )
+
+    dates = pd.date_range(date_from, date_to, inclusive="left")
+    partials = {}
+    for date, result in zip(date_list, results):
+        if result is not None:
+            partials[dates.get_loc(pd.Timestamp(date))] = result[subject]
+    if len(partials) == 0:
+        raise ValueError("no players in the date range")
+
+    subject_values = pd.concat(partials.values()).index.get_level_values(subject)
+    subjects = pd.Index(subject_values.dropna().unique()).sort_values()
+    count = np.zeros((len(dates) + 1, len(modes), len(subjects)), dtype="int64")
+    win = np.zeros_like(count)
+    total = np.zeros((len(dates) + 1, len(modes)), dtype="int64")
+    for i, partial in partials.items():
+        mode_index = pd.Index(modes).get_indexer(partial.index.get_level_values(0))
+        subject_index = subjects.get_indexer(partial.index.get_level_values(1))
+        known = mode_index >= 0
+        np.add.at(total[i + 1], mode_index[known], partial["count"].to_numpy()[known])
+        known &= subject_index >= 0
+        count[i + 1, mode_index[known], subject_index[known]] = partial["count"][known]
+        win[i + 1, mode_index[known], subject_index[known]] = partial["win-sum"][known]
+
+    return SubjectTimeSeries(
+        subject,
+        dates,
+        list(modes),
+        subjects,
+        count.cumsum(axis=0),
+        win.cumsum(axis=0),
+        total.cumsum(axis=0),
+    )
+
+
+@ins.instrument
+def rolling_index_per_subject(
+    time_series: SubjectTimeSeries, window: Optional[int] = 7
+) -> pd.DataFrame:
+    """
+    累積和の差から日ごとの期間の使用率と勝率を計算する
+    e.g. window=7 で各日を最終日とする7日間の使用率
+
+    time_series: create_subject_time_series の結果
+    window: 期間の日数 (None の場合は初日からの累計)
+        期間が window 日に満たない最初の日は含めない
+
+    返り値: "date" (期間の最終日), "mode", 対象, "count", "total-count",
+        "usage-rate", "win-rate" のカラムを持つ DataFrame
+    """
+    n = len(time_series.dates)
+    end = np.arange(1, n + 1)
+    if window is None:
+        start = np.zeros_like(end)
+    else:
+        end = end[window - 1 :]
+        start = end - window
+
+    count = time_series.count[end] - time_series.count[start]
+    win = time_series.win[end] - time_series.win[start]
+    total = time_series.total[end] - time_series.total[start]
+    total = np.broadcast_to(total[:, :, np.newaxis], count.shape)
+
+    index = pd.MultiIndex.from_product(
+        [time_series.dates[end - 1], time_series.modes, time_series.subjects],
+        names=["date", "mode", time_series.subject],
+    )
+    with np.errstate(invalid="ignore", divide="ignore"):
+        usage_rate = count / total * 100
+        win_rate = win / count * 100
+    df = pd.DataFrame(
+        {
+            "count": count.reshape(-1),
+            "total-count": total.reshape(-1),
+            "usage-rate": usage_rate.reshape(-1),
+            "win-rate": win_rate.reshape(-1),
+        },
+        index=index,
+    )
+    return df.reset_index()
+
+
+@ins.instrument
+def xpower_weapon_usage_density(
+    players: pd.DataFrame,
+    mode: str,
+    top_n: int = 9,
+    bin_width: float = 5,
+    bw_adjust: float = 2,
+) -> pd.DataFrame:
+    """
+    Xパワーごとのブキ使用率の分布を計算する
+    トップブキ以外は "other" にまとめる
+    seaborn の kdeplot(multiple="fill") 相当の結果をヒストグラムと
+    FFT による畳み込みで求める
+
+    players: プレイヤー情報の DataFrame
+    mode: モード (e.g. "area")
+    top_n: 個別に扱うトップブキの数
+    bin_width: Xパワーのビン幅
+    bw_adjust: バンド幅の倍率 (Scott の方法で求めたバンド幅に掛ける)
+
+    返り値: index が Xパワー (ビンの中央)、columns がブキで、
+        各行の合計が 1 になる DataFrame (Xパワーのあるプレイヤーがいなければ空)
+    """
+    mode_players = players[(players["mode"] == mode) & players["x-power"].notna()]
+    xpower = mode_players["x-power"].to_numpy(dtype="float64")
+    weapon_counts = mode_players["weapon"].value_counts()
+    weapons = weapon_counts.index[:top_n].to_list() + ["other"]
+    if len(xpower) == 0:
+        index = pd.Index([], dtype="float64", name="x-power")
+        return pd.DataFrame(index=index, columns=weapons, dtype="float64")
+
+    # トップブキ以外は other (最後のコード) にまとめる
+    codes = pd.Categorical(mode_players["weapon"], categories=weapons[:-1]).codes
+    codes = np.where(codes < 0, len(weapons) - 1, codes)
+
+    # ブキごとのバンド幅 (Scott の方法)
+    n = np.bincount(codes, minlength=len(weapons))
+    total = np.bincount(codes, weights=xpower, minlength=len(weapons))
+    total_sq = np.bincount(codes, weights=xpower**2, minlength=len(weapons))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = total / n
+        var = total_sq / n - mean**2
+        std = np.sqrt(np.maximum(var * n / (n - 1), 0))
+        bandwidth = std * n ** (-1 / 5) * bw_adjust
+    bandwidth = np.nan_to_num(bandwidth, nan=bin_width)
+    bandwidth = np.maximum(bandwidth, bin_width / 2)
+
+    # ブキごとにヒストグラムを作成する
+    cut = 3 * bandwidth.max()
+    edges = np.arange(xpower.min() - cut, xpower.max() + cut + bin_width, bin_width)
+    bin_num = len(edges) - 1
+    bins = np.clip(np.digitize(xpower, edges) - 1, 0, bin_num - 1)
+    hist = np.bincount(codes * bin_num + bins, minlength=len(weapons) * bin_num)
+    hist = hist.reshape(len(weapons), bin_num).astype("float64")
+
+    # ガウスカーネルで平滑化する (循環しないようにゼロ埋めして FFT で畳み込む)
+    pad = int(np.ceil(4 * bandwidth.max() / bin_width))
+    fft_num = bin_num + 2 * pad
+    offsets = np.arange(fft_num)
+    offsets = np.where(offsets > fft_num // 2, offsets - fft_num, offsets)
+    sigma = bandwidth[:, np.newaxis] / bin_width
+    kernels = np.exp(-0.5 * (offsets[np.newaxis, :] / sigma) ** 2)
+    kernels /= kernels.sum(axis=1, keepdims=True)
+    smoothed = np.fft.irfft(
+        np.fft.rfft(hist, fft_num) * np.fft.rfft(kernels, fft_num), fft_num
+    )[:, :bin_num]
+    smoothed = np.maximum(smoothed, 0)
+
+    # 各 Xパワーでの割合に変換する
+    column_total = smoothed.sum(axis=0)
+    share = np.divide(
+        smoothed,
+        column_total,
+        out=np.full_like(smoothed, np.nan),
+        where=column_total > column_total.max() * 1e-9,
+    )
+
+    centers = (edges[:-1] + edges[1:]) / 2
+    return pd.DataFrame(
+        share.T, index=pd.Index(centers, name="x-power"), columns=weapons
+    )
+
+
+@ins.instrument
+def add_xpower_bracket_column(
+    details: pd.DataFrame,
+    quantiles: list[float] = [0.25, 0.5, 0.75],
+    edges: Optional[list[float]] = None,
+    bracket_key: str = "xpower-bracket",
+) -> pd.DataFrame:
+    """
+    戦績データに Xパワー帯のカラムを追加する
+    Xパワー帯は下から "G1", "G2", ... とし、各境界は下限を含む
+    e.g. quantiles=[0.25, 0.5, 0.75] => 四分位で G1 ~ G4 に分ける
+    同じ値の境界は1つにまとめる (データが少ない場合は Xパワー帯が少なくなる)
+
+    details: 戦績データの DataFrame
+    quantiles: 境界にする分位数 (edges を指定した場合は無視する)
+    edges: 境界にする Xパワー (e.g. [2000, 2200, 2400])
+    bracket_key: 追加するカラム名
+    """
+    if edges is None:
+        edges = details["x-power"].quantile(quantiles).to_list()
+    # 重複した境界があると pd.cut がエラーになる
+    edges = np.unique(np.asarray(edges, dtype="float64"))
+    edges = edges[np.isfinite(edges)]
+    bins = [-np.inf] + edges.tolist() + [np.inf]
+    labels = list(map(lambda x: f"G{x+1}", range(len(bins) - 1)))
+    details[bracket_key] = pd.cut(
+        details["x-power"], bins=bins, labels=labels, right=False
+    )
+    return details
+
+
+@ins.instrument
+def players_group_by_bracket_mode_and(
+    groupby_key: str, players: pd.DataFrame, bracket_key: str = "xpower-bracket"
+) -> pd.DataFrame:
+    """
+    プレイヤーを Xパワー帯とモードとその他の key で一度にグルーピングして
+    勝率や使用率を計算する
+
+    groupby_key: 集計したいカラム名
+    players: Xパワー帯のカラムを持つプレイヤーの DataFrame
+    bracket_key: Xパワー帯のカラム名
+
+    返り値: index が (Xパワー帯, モード, groupby_key) の DataFrame
+    """
+    group = players.groupby([bracket_key, "mode", groupby_key], observed=True)
+    subject = group["win"].agg(["count", "mean"])
+    subject.columns = ["count", "win-rate"]
+    subject["win-rate"] = subject["win-rate"] * 100
+    total_count = subject.groupby(level=[bracket_key, "mode"])["count"].transform("sum")
+    subject.insert(1, "total-count", total_count)
+    usage_rate = subject["count"] / subject["total-count"] * 100
+    subject.insert(2, "usage-rate", usage_rate)
+    return subject
+
+
+@ins.instrument
+def aggregate_index_per_bracket(
+    players: pd.DataFrame,
+    subject: str,
+    target: str,
+    bracket_key: str = "xpower-bracket",
+) -> pd.DataFrame:
+    """
+    Xパワー帯と対象ごとに指標を集計する
+    Xパワー帯ごとの aggregate_index_per_subject を1回の集計で求める
+    e.g. aggregated.loc["G1"] を show_aggregated_heatmap に渡す
+
+    players: Xパワー帯のカラムを持つプレイヤー情報の DataFrame
+    subject: 対象 (e.g. "weapon")
+    target: 集計する指標 (e.g. "usage-rate")
+    bracket_key: Xパワー帯のカラム名
     """
-    df = players_group_by_mode_and(subject, players)
-    df_wide = df.pivot(subject, "mode", target).reindex(
-        columns=["area", "yagura", "hoko", "asari"]
+    df = players_group_by_bracket_mode_and(subject, players, bracket_key)
+    df_wide = (
+        df[target].unstack("mode").reindex(columns=["area", "yagura", "hoko", "asari"])
     )
+    df_wide.columns.name = "mode"
     mean = df_wide.mean(axis="columns")
     median = df_wide.median(axis="columns")
     df_wide["mean"] = mean
     df_wide["median"] = median
-    return df_wide.sort_values("median", ascending=False)
+    return df_wide.sort_values([bracket_key, "median"], ascending=[True, False])
+
+
+def _team_weapon_matrix(
+    details: pd.DataFrame, player_names: list[str], weapons: pd.Index
+) -> sparse.csr_matrix:
+    """
+    試合 x ブキの疎行列を作成する
+    値はチーム内でそのブキを使っている人数
+    """
+    cols = list(map(lambda x: f"{x}-weapon", player_names))
+    codes = np.stack(list(map(lambda x: weapons.get_indexer(details[x]), cols)), axis=1)
+    rows = np.repeat(np.arange(len(details.index)), len(cols))
+    codes = codes.ravel()
+    valid = codes >= 0
+    return sparse.csr_matrix(
+        (np.ones(valid.sum()), (rows[valid], codes[valid])),
+        shape=(len(details.index), len(weapons)),
+    )
+
+
+@ins.instrument
+def weapon_pair_matrix(
+    details: pd.DataFrame,
+    relation: str = "opponent",
+    target: str = "win-rate",
+    use_uploader: bool = False,
+    use_heroshooter: bool = False,
+    min_count: int = 0,
+) -> pd.DataFrame:
+    """
+    ブキの組み合わせごとの試合数や勝率を集計する
+    行のブキから見た値を返すので show_aggregated_heatmap にそのまま渡せる
+    チームごとの 試合 x ブキ の疎行列の積で計算する
+
+    details: 戦績データの DataFrame
+    relation: 組み合わせの種類
+        "opponent": 行のブキと列のブキが敵同士
+        "teammate": 行のブキと列のブキが味方同士
+    target: 集計する指標
+        "count": 組み合わせの出現数 (プレイヤーの組の数)
+        "win": 行のブキのチームが勝った数
+        "win-rate": 行のブキのチームの勝率
+    use_uploader: 投稿者 (A1) を含める
+    use_heroshooter: ヒーローシューターレプリカを個別に取り扱う
+    min_count: 出現数がこれより少ない組み合わせは NaN にする
+    """
+    a_names = ["A1", "A2", "A3", "A4"] if use_uploader else ["A2", "A3", "A4"]
+    b_names = ["B1", "B2", "B3", "B4"]
+    cols = list(map(lambda x: f"{x}-weapon", a_names + b_names))
+    weapon_details = details[cols]
+    if not use_heroshooter:
+        weapon_details = weapon_details.replace("heroshooter_replica", "sshooter")
+
+    # 使用数の多い順に並べる
+    weapons = pd.Index(
+        pd.Series(weapon_details.to_numpy().ravel()).value_counts().index
+    )
+
+    a = _team_weapon_matrix(weapon_details, a_names, weapons)
+    b = _team_weapon_matrix(weapon_details, b_names, weapons)
+    a_win = sparse.diags((details["win"] == "alpha").to_numpy(dtype="float64"))
+    b_win = sparse.diags((details["win"] == "bravo").to_numpy(dtype="float64"))
+
+    if relation == "opponent":
+        count = a.T @ b + b.T @ a
+        win = a.T @ a_win @ b + b.T @ b_win @ a
+    elif relation == "teammate":
+        # 同じプレイヤー同士の組を対角成分から除く
+        count = a.T @ a + b.T @ b
+        count = count - sparse.diags(np.asarray(a.sum(axis=0) + b.sum(axis=0)).ravel())
+        win = a.T @ a_win @ a + b.T @ b_win @ b
+        win = win - sparse.diags(
+            np.asarray(a_win.sum(axis=0) @ a + b_win.sum(axis=0) @ b).ravel()
+        )
+    else:
+        raise ValueError(f"unknown relation: {relation}")
+
+    count = count.toarray()
+    win = win.toarray()
+    if target == "count":
+        values = count
+    elif target == "win":
+        values = win
+    elif target == "win-rate":
+        with np.errstate(invalid="ignore", divide="ignore"):
+            values = win / count * 100
+    else:
+        raise ValueError(f"unknown target: {target}")
+    values = np.where(count >= max(min_count, 1), values, np.nan)
+
+    return pd.DataFrame(values, index=weapons, columns=weapons)
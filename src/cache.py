@@ -0,0 +1,234 @@
+import os
+import sys
+import json
+import enum
+import types
+import hashlib
+import datetime as dt
+from typing import Callable, Optional
+
+import pandas as pd
+
+import src.constants as c
+
+# キャッシュの合計サイズの上限 (bytes)
+CACHE_SIZE_LIMIT = 256 * 2**20
+
+
+def fingerprint_files(paths: list[str]) -> list:
+    """
+    入力ファイルのフィンガープリント (ファイル名, サイズ, 更新時刻)
+    存在しないファイルは None
+    """
+    fingerprint = []
+    for path in paths:
+        if not os.path.exists(path):
+            fingerprint.append([os.path.basename(path), None])
+            continue
+        stat = os.stat(path)
+        fingerprint.append([os.path.basename(path), stat.st_size, stat.st_mtime_ns])
+    return fingerprint
+
+
+def _update_value_hash(h, value, module: str, seen: set):
+    """
+    関数が参照する値 (グローバル変数やクロージャの値) をハッシュに加える
+    同じモジュールの関数は中身をたどり、ほかのモジュールの関数やモジュールは名前を使う
+    """
+    if isinstance(value, types.ModuleType):
+        h.update(value.__name__.encode())
+    elif isinstance(value, (pd.DataFrame, pd.Series, pd.Index)):
+        # 大きい DataFrame の repr は省略されるので値のハッシュを使う
+        h.update(pd.util.hash_pandas_object(value).to_numpy().tobytes())
+    elif getattr(value, "__code__", None) is not None:
+        if getattr(value, "__module__", None) == module:
+            _update_function_hash(h, value, module, seen)
+        else:
+            h.update(f"{value.__module__}.{value.__qualname__}".encode())
+    else:
+        h.update(repr(value).encode())
+
+
+def _update_code_hash(h, code, globals_: dict, module: str, seen: set):
+    h.update(code.co_code)
+    h.update(repr(code.co_names).encode())
+    # 参照するグローバル変数の値 (ノートブックで変数を変えて再実行した場合に区別する)
+    for name in code.co_names:
+        if name in globals_:
+            h.update(name.encode())
+            _update_value_hash(h, globals_[name], module, seen)
+    for const in code.co_consts:
+        # 入れ子の関数のコードオブジェクトの repr にはアドレスが含まれるので中身を使う
+        if hasattr(const, "co_code"):
+            _update_code_hash(h, const, globals_, module, seen)
+        else:
+            h.update(repr(const).encode())
+
+
+def _update_function_hash(h, func: Callable, module: str, seen: set):
+    # 再帰呼び出しや相互参照で無限にたどらないようにする
+    if id(func) in seen:
+        h.update(func.__qualname__.encode())
+        return
+    seen.add(id(func))
+    _update_code_hash(h, func.__code__, func.__globals__, module, seen)
+    for cell in func.__closure__ or []:
+        _update_value_hash(h, cell.cell_contents, module, seen)
+
+
+def _callable_key(func: Callable) -> str:
+    """
+    関数を識別するキー (名前とバイトコード、定数、参照するグローバル変数とクロージャの値)
+    lambda でもノートブックを再実行したときに同じキーになる
+    """
+    code = getattr(func, "__code__", None)
+    if code is None:
+        return f"{func.__module__}.{getattr(func, '__qualname__', repr(func))}"
+    h = hashlib.sha1()
+    _update_function_hash(h, func, func.__module__, set())
+    return f"{func.__module__}.{func.__qualname__}:{h.hexdigest()}"
+
+
+def _module_path(func: Callable) -> Optional[str]:
+    """
+    関数が定義されたモジュールのソースのパス
+    """
+    path = getattr(sys.modules.get(func.__module__), "__file__", None)
+    if path is None or not os.path.exists(path):
+        return None
+    return path
+
+
+def hash_files(paths: list[str]) -> str:
+    """
+    ファイルの内容のハッシュ (存在しないファイルはファイル名だけを使う)
+    """
+    h = hashlib.sha1()
+    for path in paths:
+        h.update(os.path.basename(path).encode())
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                h.update(f.read())
+    return h.hexdigest()
+
+
+def _encode(value):
+    if isinstance(value, (dt.date, dt.datetime)):
+        return value.isoformat()
+    if isinstance(value, enum.Enum):
+        return value.value
+    if callable(value):
+        return _callable_key(value)
+    return repr(value)
+
+
+def make_key(
+    func: Callable,
+    params: dict,
+    input_paths: list[str],
+    dependencies: list[str] = [],
+) -> str:
+    """
+    関数、引数、入力ファイルのフィンガープリントからキャッシュのキーを作成する
+    関数のモジュールと dependencies のファイルの内容が変わったらキーも変わる
+    """
+    module_path = _module_path(func)
+    code_paths = [] if module_path is None else [module_path]
+    key = {
+        "function": f"{func.__module__}.{func.__qualname__}",
+        "module": hash_files([*code_paths, *dependencies]),
+        "params": params,
+        "inputs": fingerprint_files(input_paths),
+    }
+    text = json.dumps(key, sort_keys=True, default=_encode)
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def get_cache_path(key: str, cache_dir: str = c.AGGREGATE_CACHE_DIR) -> str:
+    return f"{cache_dir}/{key}.pkl.gz"
+
+
+def load(key: str, cache_dir: str = c.AGGREGATE_CACHE_DIR) -> Optional[pd.DataFrame]:
+    """
+    キャッシュを読み込む
+    読み込んだファイルの更新時刻を現在にして LRU の順序に使う
+    """
+    path = get_cache_path(key, cache_dir)
+    try:
+        df = pd.read_pickle(path)
+    except (FileNotFoundError, EOFError):
+        return None
+    os.utime(path)
+    return df
+
+
+def save(
+    key: str,
+    df: pd.DataFrame,
+    cache_dir: str = c.AGGREGATE_CACHE_DIR,
+    size_limit: int = CACHE_SIZE_LIMIT,
+):
+    """
+    キャッシュを gzip で圧縮した pickle として保存し、サイズの上限を超えた分を削除する
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    path = get_cache_path(key, cache_dir)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    df.to_pickle(tmp_path, compression="gzip")
+    os.replace(tmp_path, path)
+    evict(size_limit, cache_dir)
+
+
+def evict(size_limit: int = CACHE_SIZE_LIMIT, cache_dir: str = c.AGGREGATE_CACHE_DIR):
+    """
+    合計サイズが上限以下になるまで最後に使われたのが古いキャッシュから削除する
+    """
+    if not os.path.isdir(cache_dir):
+        return
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith(".pkl.gz"):
+            stat = entry.stat()
+            entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+    total = sum(x[1] for x in entries)
+    for _, size, path in sorted(entries):
+        if total <= size_limit:
+            break
+        os.remove(path)
+        total -= size
+
+
+def clear(cache_dir: str = c.AGGREGATE_CACHE_DIR):
+    """
+    すべてのキャッシュを削除する
+    """
+    evict(0, cache_dir)
+
+
+def cached_call(
+    func: Callable[..., pd.DataFrame],
+    params: dict,
+    input_paths: list[str],
+    ignore: list[str] = [],
+    dependencies: list[str] = [],
+    cache_dir: str = c.AGGREGATE_CACHE_DIR,
+    size_limit: int = CACHE_SIZE_LIMIT,
+) -> pd.DataFrame:
+    """
+    キャッシュがあれば読み込み、なければ func(**params) を実行して保存する
+
+    func: DataFrame を返す関数
+    params: func に渡す引数 (キーに含める)
+    input_paths: func が読み込むファイル (フィンガープリントをキーに含める)
+    ignore: 結果に影響しないためキーに含めない引数 (e.g. "processes")
+    dependencies: func のモジュール以外で結果に影響するソースや定義のファイル
+        (内容のハッシュをキーに含める, e.g. schema.py, sources/main.csv)
+    """
+    key_params = {k: v for k, v in params.items() if k not in ignore}
+    key = make_key(func, key_params, input_paths, dependencies)
+    df = load(key, cache_dir)
+    if df is not None:
+        return df
+    df = func(**params)
+    save(key, df, cache_dir, size_limit)
+    return df
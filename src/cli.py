@@ -0,0 +1,218 @@
+import argparse
+import datetime as dt
+from typing import Optional
+
+import src.constants as c
+import src.pipeline as p
+import src.statink as s
+
+
+def _run(args: argparse.Namespace):
+    stages = p.create_stages(details_days=args.details_days, budget=args.budget)
+    results = p.run_pipeline(
+        stages,
+        targets=args.stages or None,
+        delay=args.delay,
+        jobs=args.jobs,
+        force=args.force,
+        dry_run=args.dry_run,
+    )
+    return 1 if "failed" in results.values() else 0
+
+
+def _list(args: argparse.Namespace):
+    stages = p.create_stages(details_days=args.details_days)
+    dependencies = p.get_dependencies(stages)
+    state = p.load_state()
+    now = dt.datetime.now(dt.timezone.utc)
+    for stage in stages:
+        status = "up to date" if p.is_up_to_date(stage, state, now) else "stale"
+        deps = ", ".join(sorted(dependencies[stage.name])) or "-"
+        print(f"{stage.name:<28}{status:<12}after: {deps}")
+    return 0
+
+
+def _generate(args: argparse.Namespace):
+    import src.definitions as d
+    import src.synthetic as sy
+
+    date_from = dt.date.fromisoformat(args.date_from)
+    date_to = dt.date.fromisoformat(args.date_to)
+    if args.kind == "statink":
+        sy.write_statink_csv_files(
+            args.dst_dir, date_from, date_to, args.battles, seed=args.seed
+        )
+    else:
+        sy.write_battle_details_file(
+            args.dst_dir,
+            date_from,
+            date_to,
+            args.battles,
+            lobby=d.Lobby(args.lobby),
+            seed=args.seed,
+        )
+    return 0
+
+
+def _discover(args: argparse.Namespace):
+    import src.scraping as sc
+
+    sc.discover_users(args.min_interval, args.max_interval, args.max_polls)
+    return 0
+
+
+def _players(args: argparse.Namespace):
+    import src.players as pl
+
+    pl.update_players(
+        dt.date.fromisoformat(args.date_from) if args.date_from else None,
+        dt.date.fromisoformat(args.date_to) if args.date_to else None,
+        args.processes,
+    )
+    return 0
+
+
+def _compress(args: argparse.Namespace):
+    import src.scraping2 as s2
+
+    s2.compress_csv_files(args.compression, args.csv_dir)
+    return 0
+
+
+def _replay(args: argparse.Namespace):
+    import src.replay as r
+
+    config = r.ReplayConfig(
+        record_dir=args.record_dir,
+        csv_dir=args.csv_dir,
+        upstream=s.STATINK_URL if args.record else None,
+        csv_upstream=s.STATINK_CSV_URL if args.record else None,
+        latency=args.latency,
+        jitter=args.jitter,
+        rate_429=args.rate_429,
+        rate_error=args.rate_error,
+        max_rps=args.max_rps,
+        retry_after=args.retry_after,
+    )
+    r.serve(config, args.host, args.port)
+    return 0
+
+
+def _serve(args: argparse.Namespace):
+    import src.query as q
+
+    q.serve(
+        dt.date.fromisoformat(args.date_from),
+        dt.date.fromisoformat(args.date_to),
+        args.host,
+        args.port,
+        args.cache_size,
+        args.processes,
+    )
+    return 0
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    """
+    spla-stat のコマンドラインエントリーポイント
+    e.g. python -m src run --delay 5
+    """
+    parser = argparse.ArgumentParser(
+        prog="spla-stat", description="spla-stat のデータ更新パイプライン"
+    )
+    parser.add_argument(
+        "--details-days",
+        type=int,
+        default=7,
+        help="バトル詳細を取得する日数 (前日まで)",
+    )
+    parser.add_argument("--base-url", help="stat.ink の接続先 (e.g. リプレイサーバー)")
+    parser.add_argument("--csv-base-url", help="dl-stats.stat.ink の接続先")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="ステージを実行する")
+    run_parser.add_argument("stages", nargs="*", help="実行するステージ名 (省略時はすべて)")
+    run_parser.add_argument("--delay", type=int, default=5, help="取得間隔（秒）")
+    run_parser.add_argument("--jobs", type=int, default=4, help="同時に実行するステージ数")
+    run_parser.add_argument(
+        "--budget",
+        type=int,
+        help="バトル一覧の取得でロビーごとにリクエストするページ数の上限",
+    )
+    run_parser.add_argument("--force", action="store_true", help="最新でも実行する")
+    run_parser.add_argument("--dry-run", action="store_true", help="実行せずに判定だけ表示する")
+    run_parser.set_defaults(func=_run)
+
+    list_parser = subparsers.add_parser("list", help="ステージの一覧と状態を表示する")
+    list_parser.set_defaults(func=_list)
+
+    generate_parser = subparsers.add_parser("generate", help="合成データを作成する")
+    generate_parser.add_argument("kind", choices=["statink", "details"])
+    generate_parser.add_argument("dst_dir", help="保存先のディレクトリ")
+    generate_parser.add_argument("date_from", help="開始日 (YYYY-MM-DD)")
+    generate_parser.add_argument("date_to", help="終了日 (YYYY-MM-DD, この日を含まない)")
+    generate_parser.add_argument(
+        "--battles", type=int, default=10000, help="試合数 (statink は1日あたり)"
+    )
+    generate_parser.add_argument("--lobby", default="xmatch", help="details のロビー")
+    generate_parser.add_argument("--seed", type=int, default=0)
+    generate_parser.set_defaults(func=_generate)
+
+    discover_parser = subparsers.add_parser("discover", help="最新のバトルから新しいユーザーを探し続ける")
+    discover_parser.add_argument(
+        "--min-interval", type=float, default=30, help="取得間隔の下限（秒）"
+    )
+    discover_parser.add_argument(
+        "--max-interval", type=float, default=600, help="取得間隔の上限（秒）"
+    )
+    discover_parser.add_argument("--max-polls", type=int, help="取得回数の上限")
+    discover_parser.set_defaults(func=_discover)
+
+    players_parser = subparsers.add_parser(
+        "players", help="戦績データを 1 行 1 プレイヤーに変換して保存する"
+    )
+    players_parser.add_argument("--date-from", help="開始日 (YYYY-MM-DD)")
+    players_parser.add_argument("--date-to", help="終了日 (YYYY-MM-DD, この日を含まない)")
+    players_parser.add_argument("--processes", type=int, default=1, help="プロセス数")
+    players_parser.set_defaults(func=_players)
+
+    compress_parser = subparsers.add_parser(
+        "compress", help="保存済みの戦績データの csv ファイルを圧縮する"
+    )
+    compress_parser.add_argument(
+        "--compression", default="gzip", choices=["gzip", "zstd"]
+    )
+    compress_parser.add_argument("--csv-dir", default=c.STATINK_CSV_DIR)
+    compress_parser.set_defaults(func=_compress)
+
+    replay_parser = subparsers.add_parser("replay", help="stat.ink のリプレイサーバーを起動する")
+    replay_parser.add_argument("record_dir", help="記録したレスポンスのディレクトリ")
+    replay_parser.add_argument("--csv-dir", help="dl-stats として配信する csv のディレクトリ")
+    replay_parser.add_argument(
+        "--record", action="store_true", help="記録がなければ stat.ink から取得して記録する"
+    )
+    replay_parser.add_argument("--host", default="127.0.0.1")
+    replay_parser.add_argument("--port", type=int, default=8000)
+    replay_parser.add_argument("--latency", type=float, default=0, help="待ち時間（秒）")
+    replay_parser.add_argument("--jitter", type=float, default=0, help="待ち時間の揺らぎ（秒）")
+    replay_parser.add_argument("--rate-429", type=float, default=0, help="429 を返す確率")
+    replay_parser.add_argument("--rate-error", type=float, default=0, help="5xx を返す確率")
+    replay_parser.add_argument("--max-rps", type=float, help="1秒あたりのリクエスト数の上限")
+    replay_parser.add_argument("--retry-after", type=int, default=1)
+    replay_parser.set_defaults(func=_replay)
+
+    serve_parser = subparsers.add_parser("serve", help="集計結果を返す HTTP サーバーを起動する")
+    serve_parser.add_argument("date_from", help="開始日 (YYYY-MM-DD)")
+    serve_parser.add_argument("date_to", help="終了日 (YYYY-MM-DD, この日を含まない)")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8080)
+    serve_parser.add_argument(
+        "--cache-size", type=int, default=1024, help="キャッシュするレスポンスの数"
+    )
+    serve_parser.add_argument("--processes", type=int, help="読み込みに使うプロセス数")
+    serve_parser.set_defaults(func=_serve)
+
+    args = parser.parse_args(argv)
+    if args.base_url is not None or args.csv_base_url is not None:
+        s.set_base_url(args.base_url or s.BASE_URL, args.csv_base_url or args.base_url)
+    return args.func(args)
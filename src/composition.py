@@ -0,0 +1,235 @@
+import os
+import datetime as dt
+from typing import NamedTuple, Optional
+
+import numpy as np
+import pandas as pd
+
+import src.analytics2 as a
+import src.constants as c
+import src.definitions as d
+import src.utils as u
+
+INDEX_COLUMNS = [
+    "row",
+    "lobby",
+    "mode",
+    "game-ver",
+    "win",
+    "A-weapons",
+    "B-weapons",
+    "A-orch",
+    "B-orch",
+]
+
+
+class CompositionIndex(NamedTuple):
+    """
+    編成から試合を引くための転置インデックス
+
+    battles: 試合ごとの編成 (date, row で戦績データの行を指す)
+    postings: {"A-weapons": {編成キー: battles の位置の配列}, ...}
+    """
+
+    battles: pd.DataFrame
+    postings: dict[str, dict[str, np.ndarray]]
+
+
+def get_composition_index_path(date: dt.date) -> str:
+    return f"{c.COMPOSITION_INDEX_DIR}/{date}.csv.gz"
+
+
+def create_composition_keys(details: pd.DataFrame, team: str) -> pd.DataFrame:
+    """
+    チームの編成を表す正規化したキーを作成する
+    - "<team>-weapons": ブキをソートして "," で結合したもの (e.g. "52gal,sshooter,...")
+    - "<team>-orch": プールの記号をソートして結合したもの (e.g. "SSbs")
+
+    details: 戦績データの DataFrame
+    team: "A" or "B"
+    """
+    pool = pd.read_csv(c.SOURCE_MAIN_POOL_PATH, index_col="Key")["Pool"]
+    cols = list(map(lambda x: f"{team}{x+1}-weapon", range(4)))
+    weapons = details[cols].fillna("").to_numpy(dtype="str")
+    pools = details[cols].apply(lambda x: x.map(pool)).fillna("?")
+    pools = pools.to_numpy(dtype="str")
+
+    weapons = np.sort(weapons, axis=1)
+    pools = np.sort(pools, axis=1)
+    weapons_key = weapons[:, 0]
+    orch_key = pools[:, 0]
+    for i in range(1, 4):
+        weapons_key = np.char.add(np.char.add(weapons_key, ","), weapons[:, i])
+        orch_key = np.char.add(orch_key, pools[:, i])
+
+    return pd.DataFrame(
+        {f"{team}-weapons": weapons_key, f"{team}-orch": orch_key},
+        index=details.index,
+    )
+
+
+def build_composition_index_on(date: dt.date) -> pd.DataFrame:
+    """
+    日付を指定して戦績データの編成インデックスを作成し保存する
+    row は戦績データの csv ファイル内の行番号 (read_details_on の index)
+    """
+    details = a.read_details_on(date, None)
+    keys = [create_composition_keys(details, team) for team in ["A", "B"]]
+    index = pd.concat([details[["lobby", "mode", "game-ver", "win"]], *keys], axis=1)
+    index.insert(0, "row", details.index)
+    index = index[INDEX_COLUMNS]
+
+    os.makedirs(c.COMPOSITION_INDEX_DIR, exist_ok=True)
+    index.to_csv(get_composition_index_path(date), index=False)
+    return index
+
+
+def update_composition_index(date_from: dt.date, date_to: dt.date):
+    """
+    日付の期間を指定して編成インデックスを更新する
+    戦績データより新しいインデックスがある日はスキップする
+    """
+    for date in u.date_range(date_from, date_to):
+        details_path = a.get_details_path(date)
+        index_path = get_composition_index_path(date)
+        if not os.path.exists(details_path):
+            continue
+        if os.path.exists(index_path) and os.path.getmtime(
+            index_path
+        ) >= os.path.getmtime(details_path):
+            continue
+        print(f"build composition index for {date}")
+        build_composition_index_on(date)
+
+
+def load_composition_index(
+    date_from: dt.date, date_to: dt.date, lobby: d.Lobby = d.Lobby.XMATCH
+) -> CompositionIndex:
+    """
+    日付の期間を指定して編成インデックスを読み込む
+    インデックスがない日は作成する
+    """
+    update_composition_index(date_from, date_to)
+    index_list = []
+    for date in u.date_range(date_from, date_to):
+        index_path = get_composition_index_path(date)
+        if not os.path.exists(index_path):
+            continue
+        index = pd.read_csv(index_path, dtype={"A-orch": str, "B-orch": str})
+        index = index[index["lobby"] == lobby.value]
+        index.insert(0, "date", str(date))
+        index_list.append(index)
+
+    battles = pd.concat(index_list, ignore_index=True)
+    postings = {}
+    for key in ["A-weapons", "B-weapons", "A-orch", "B-orch"]:
+        postings[key] = battles.groupby(key).indices
+    return CompositionIndex(battles, postings)
+
+
+def _lookup(
+    index: CompositionIndex, team: str, weapons: Optional[str], orch: Optional[str]
+) -> Optional[np.ndarray]:
+    positions = None
+    empty = np.array([], dtype="int64")
+    for kind, key in [("weapons", weapons), ("orch", orch)]:
+        if key is None:
+            continue
+        hits = index.postings[f"{team}-{kind}"].get(key, empty)
+        positions = hits if positions is None else np.intersect1d(positions, hits)
+    return positions
+
+
+def _canonical_weapons(weapons: Optional[list[str]]) -> Optional[str]:
+    if weapons is None:
+        return None
+    return ",".join(sorted(weapons))
+
+
+def _canonical_orch(orch: Optional[str]) -> Optional[str]:
+    if orch is None:
+        return None
+    return "".join(sorted(orch))
+
+
+def find_battles(
+    index: CompositionIndex,
+    weapons: Optional[list[str]] = None,
+    orch: Optional[str] = None,
+    opponent_weapons: Optional[list[str]] = None,
+    opponent_orch: Optional[str] = None,
+) -> pd.DataFrame:
+    """
+    編成 X と編成 Y が対戦した試合を検索する
+    X が alpha, bravo どちらのチームでもよい
+    指定しなかった条件は問わない
+    両チームとも X で相手が Y の試合 (ミラー) は二重に数えないよう alpha 側の1行だけにする
+
+    index: load_composition_index の結果
+    weapons: X のブキのリスト (順不同)
+    orch: X のプール文字列 (順不同, e.g. "SSbs")
+    opponent_weapons: Y のブキのリスト (順不同)
+    opponent_orch: Y のプール文字列 (順不同)
+
+    返り値: インデックスの行に "team" (X のチーム) と "win" (X が勝ったか) を加えたもの
+        "date", "row" で read_indexed_battles に渡して戦績データを取得できる
+    """
+    query = (_canonical_weapons(weapons), _canonical_orch(orch))
+    opponent_query = (
+        _canonical_weapons(opponent_weapons),
+        _canonical_orch(opponent_orch),
+    )
+
+    battles_list = []
+    found = np.array([], dtype="int64")
+    for team, opponent, team_name in [("A", "B", "alpha"), ("B", "A", "bravo")]:
+        positions = _lookup(index, team, *query)
+        opponent_positions = _lookup(index, opponent, *opponent_query)
+        if positions is None and opponent_positions is None:
+            positions = np.arange(len(index.battles.index))
+        elif positions is None:
+            positions = opponent_positions
+        elif opponent_positions is not None:
+            positions = np.intersect1d(positions, opponent_positions)
+        # alpha 側で見つかった試合は除く
+        positions = np.setdiff1d(positions, found)
+        found = np.union1d(found, positions)
+        battles = index.battles.iloc[positions].copy()
+        battles.insert(2, "team", team_name)
+        battles["win"] = battles["win"] == team_name
+        battles_list.append(battles)
+
+    return pd.concat(battles_list, ignore_index=True)
+
+
+def composition_win_rate(
+    index: CompositionIndex,
+    weapons: Optional[list[str]] = None,
+    orch: Optional[str] = None,
+    opponent_weapons: Optional[list[str]] = None,
+    opponent_orch: Optional[str] = None,
+) -> pd.DataFrame:
+    """
+    編成の勝率をモードごとに集計する
+    e.g. composition_win_rate(index, orch="SSbs")
+    引数は find_battles と同じ
+    """
+    battles = find_battles(index, weapons, orch, opponent_weapons, opponent_orch)
+    group = battles.groupby("mode")["win"]
+    win_rate = group.agg(["count", "mean"])
+    win_rate.columns = ["count", "win-rate"]
+    win_rate["win-rate"] = win_rate["win-rate"] * 100
+    return win_rate
+
+
+def read_indexed_battles(
+    battles: pd.DataFrame, lobby: d.Lobby = d.Lobby.XMATCH
+) -> pd.DataFrame:
+    """
+    find_battles の結果が指す戦績データを読み込む
+    """
+    details_list = []
+    for date, rows in battles.groupby("date")["row"]:
+        details = a.read_details_on(dt.date.fromisoformat(date), lobby)
+        details_list.append(details.loc[rows.to_numpy()])
+    return pd.concat(details_list, ignore_index=True)
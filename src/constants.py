@@ -1,9 +1,18 @@
 DATA_DIR = "/workdir/data"
 STATINK_CSV_DIR = "/workdir/csv"
+# 戦績データの csv ファイルの圧縮形式 ("gzip", "zstd" または None)
+STATINK_CSV_COMPRESSION = "gzip"
 
 # ユーザー一覧
 USER_DATA_PATH = f"{DATA_DIR}/users.csv"
 
+# 集計結果のキャッシュ
+AGGREGATE_CACHE_DIR = f"{DATA_DIR}/cache"
+
+# スクレイピングのメトリクス
+METRICS_DIR = f"{DATA_DIR}/metrics"
+SCRAPER_METRICS_PATH = f"{METRICS_DIR}/scraper.prom"
+
 # バトル一覧
 BATTLE_LIST_XMATCH_PATH = f"{DATA_DIR}/battles_xmatch.csv"
 BATTLE_LIST_FEST_CHALLENGE_PATH = f"{DATA_DIR}/battles_fest_challenge.csv"
@@ -24,3 +33,9 @@ SOURCE_MAIN_POOL_PATH = f"{SOURCE_PATH}/main_pool.csv"
 IMAGES_DIR = "/workdir/images"
 
 FONTS_DIR = "/workdir/fonts"
+
+# 戦績データのインデックス
+COMPOSITION_INDEX_DIR = f"{STATINK_CSV_DIR}/composition"
+
+# 1 行 1 プレイヤーに変換した戦績データ (日付、ロビーごとの parquet)
+PLAYERS_DIR = f"{DATA_DIR}/players"
@@ -0,0 +1,161 @@
+import os
+import random
+import datetime as dt
+from typing import Optional
+
+import pandas as pd
+
+import src.constants as c
+
+STATE_COLUMNS = ["Username", "LastChecked", "LastBattle", "Rate", "Misses", "NextCheck"]
+
+# 新しいバトルがあったユーザーを次に取得するまでの間隔
+MIN_INTERVAL = dt.timedelta(hours=6)
+# 新しいバトルがないユーザーの間隔の上限 (MIN_INTERVAL * 2^連続で空振りした回数)
+MAX_INTERVAL = dt.timedelta(days=14)
+# 間隔を短くする割合の上限 (乱数)
+INTERVAL_JITTER = 0.25
+# 投稿頻度 (1日あたりのバトル数) の指数移動平均の係数
+RATE_ALPHA = 0.3
+# 状態がないユーザーの投稿頻度をバトル一覧から推定する期間
+RATE_WINDOW = dt.timedelta(days=7)
+
+
+def get_state_path(lobby: str) -> str:
+    """
+    ロビーごとの取得状態の csv ファイルのパス
+    """
+    return f"{c.DATA_DIR}/crawl_state_{lobby}.csv"
+
+
+def _estimate_state(
+    usernames: list[str], battles: pd.DataFrame, now: pd.Timestamp
+) -> pd.DataFrame:
+    """
+    バトル一覧から状態のないユーザーの最終バトル日時と投稿頻度を推定する
+    """
+    state = pd.DataFrame({"Username": usernames})
+    if battles.empty:
+        last_battle = pd.Series(dtype="datetime64[ns, UTC]")
+        recent_count = pd.Series(dtype="int64")
+    else:
+        battle_times = pd.to_datetime(battles["Datetime"], utc=True)
+        last_battle = battle_times.groupby(battles["Username"]).max()
+        recent = battle_times >= now - RATE_WINDOW
+        recent_count = battles.loc[recent, "Username"].value_counts()
+    state["LastChecked"] = pd.NaT
+    state["LastBattle"] = state["Username"].map(last_battle)
+    state["Rate"] = state["Username"].map(recent_count).fillna(0) / RATE_WINDOW.days
+    state["Misses"] = 0
+    # すぐに取得する
+    state["NextCheck"] = pd.NaT
+    return state
+
+
+def load_state(
+    usernames: list[str],
+    battles: pd.DataFrame,
+    lobby: str,
+    now: Optional[pd.Timestamp] = None,
+) -> pd.DataFrame:
+    """
+    ユーザーごとの取得状態を読み込む
+    保存された状態がないユーザーはバトル一覧から推定し、usernames にないユーザーは除く
+
+    usernames: 取得対象のユーザー名
+    battles: バトル一覧 (Datetime, Username)
+    lobby: ロビー文字列
+
+    返り値: Username を index とする STATE_COLUMNS の DataFrame
+    """
+    now = now or pd.Timestamp.now(tz="UTC")
+    path = get_state_path(lobby)
+    if os.path.exists(path):
+        saved = pd.read_csv(path)
+        for col in ["LastChecked", "LastBattle", "NextCheck"]:
+            saved[col] = pd.to_datetime(saved[col], utc=True)
+    else:
+        saved = pd.DataFrame(columns=STATE_COLUMNS)
+
+    saved = saved[saved["Username"].isin(usernames)]
+    unknown = [x for x in usernames if x not in set(saved["Username"])]
+    estimated = _estimate_state(unknown, battles, now)
+    state = pd.concat([saved, estimated], ignore_index=True)
+    for col in ["LastChecked", "LastBattle", "NextCheck"]:
+        state[col] = pd.to_datetime(state[col], utc=True)
+    state["Misses"] = state["Misses"].astype("int64")
+    state["Rate"] = state["Rate"].astype("float64")
+    return state.set_index("Username")
+
+
+def save_state(state: pd.DataFrame, lobby: str):
+    """
+    取得状態を保存する
+    """
+    path = get_state_path(lobby)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    state.reset_index()[STATE_COLUMNS].to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+def select_users(state: pd.DataFrame, now: Optional[pd.Timestamp] = None) -> list[str]:
+    """
+    取得するユーザーを優先度の高い順に選ぶ
+    次の取得日時を過ぎたユーザーのうち、一度も取得していないユーザーを投稿頻度の高い順に先にし、
+    残りは前回の取得からの期待バトル数 (投稿頻度 * 経過日数) の大きい順にする
+    """
+    now = now or pd.Timestamp.now(tz="UTC")
+    due = state["NextCheck"].isna() | (state["NextCheck"] <= now)
+    elapsed_days = (now - state["LastChecked"]).dt.total_seconds() / 86400
+    order = pd.DataFrame(
+        {
+            "checked": state["LastChecked"].notna(),
+            "priority": (state["Rate"] * elapsed_days).fillna(state["Rate"]),
+        }
+    )[due]
+    order = order.sort_values(
+        ["checked", "priority"], ascending=[True, False], kind="stable"
+    )
+    return order.index.tolist()
+
+
+def record_poll(
+    state: pd.DataFrame,
+    username: str,
+    new_battles: pd.DataFrame,
+    now: Optional[pd.Timestamp] = None,
+):
+    """
+    ユーザーを取得した結果で状態を更新する
+    新しいバトルがなければ次の取得までの間隔を倍にする
+
+    new_battles: 今回取得した新しいバトル (Datetime)
+    """
+    now = now or pd.Timestamp.now(tz="UTC")
+    row = state.loc[username]
+    new_count = len(new_battles.index)
+
+    if pd.isna(row["LastChecked"]):
+        rate = row["Rate"]
+    else:
+        elapsed_days = max((now - row["LastChecked"]).total_seconds() / 86400, 1 / 24)
+        rate = RATE_ALPHA * new_count / elapsed_days + (1 - RATE_ALPHA) * row["Rate"]
+
+    if new_count > 0:
+        misses = 0
+        last_battle = pd.to_datetime(new_battles["Datetime"], utc=True).max()
+        if pd.notna(row["LastBattle"]):
+            last_battle = max(last_battle, row["LastBattle"])
+    else:
+        misses = row["Misses"] + 1
+        last_battle = row["LastBattle"]
+    interval = min(MIN_INTERVAL * 2 ** min(misses, 16), MAX_INTERVAL)
+    # 同じ回に空振りしたユーザーの次の取得が同じ回に集中しないようにずらす
+    interval *= random.uniform(1 - INTERVAL_JITTER, 1)
+
+    state.at[username, "LastChecked"] = now
+    state.at[username, "LastBattle"] = last_battle
+    state.at[username, "Rate"] = rate
+    state.at[username, "Misses"] = misses
+    state.at[username, "NextCheck"] = now + interval
@@ -8,3 +8,35 @@ class Lobby(Enum):
     XMATCH = "xmatch"
     SPLATFEST_OPEN = "splatfest_open"
     SPLATFEST_CHALLENGE = "splatfest_challenge"
+
+
+# ギアパワー (サブにも付けられるもの)
+STANDARD_ABILITIES = [
+    "ink_saver_main",
+    "ink_saver_sub",
+    "ink_recovery_up",
+    "run_speed_up",
+    "swim_speed_up",
+    "special_charge_up",
+    "special_saver",
+    "special_power_up",
+    "quick_respawn",
+    "quick_super_jump",
+    "sub_power_up",
+    "ink_resistance_up",
+    "sub_resistance_up",
+    "intensify_action",
+]
+
+# ギアパワー (ギアの部位ごとのメイン専用のもの)
+EXCLUSIVE_ABILITIES = {
+    "head": ["opening_gambit", "last_ditch_effort", "tenacity", "comeback"],
+    "clothing": [
+        "ninja_squid",
+        "haunt",
+        "thermal_ink",
+        "respawn_punisher",
+        "ability_doubler",
+    ],
+    "shoes": ["stealth_jump", "object_shredder", "drop_roller"],
+}
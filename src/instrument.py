@@ -0,0 +1,211 @@
+import os
+import json
+import time
+import threading
+import functools
+from contextlib import contextmanager
+from typing import Callable, Iterator, NamedTuple, Optional
+
+try:
+    import resource
+except ImportError:
+    # Windows では RSS を計測しない
+    resource = None
+
+import pandas as pd
+
+# 環境変数 SPLA_STAT_INSTRUMENT=1 でも有効にできる
+_enabled = os.environ.get("SPLA_STAT_INSTRUMENT", "") not in ["", "0"]
+_records = []
+_origin = time.perf_counter()
+
+
+class Record(NamedTuple):
+    """
+    計測結果
+
+    name: 関数名 (module.function) または span の名前
+    start: 計測開始時刻 (モジュールの読み込みからの秒数)
+    wall: 経過時間（秒）
+    cpu: プロセスの CPU 時間（秒）
+    rows_in: 引数の DataFrame, Series の行数の合計
+    rows_out: 返り値の DataFrame, Series の行数
+    rss_delta: ピーク RSS の増加量 (bytes)
+    thread: スレッド ID
+    """
+
+    name: str
+    start: float
+    wall: float
+    cpu: float
+    rows_in: Optional[int]
+    rows_out: Optional[int]
+    rss_delta: Optional[int]
+    thread: int
+
+
+def enable():
+    """
+    計測を有効にする
+    """
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def reset():
+    """
+    計測結果を消去する
+    """
+    _records.clear()
+
+
+def get_records() -> list[Record]:
+    return list(_records)
+
+
+def _count_rows(values) -> Optional[int]:
+    rows = None
+    for value in values:
+        if isinstance(value, (pd.DataFrame, pd.Series)):
+            rows = (rows or 0) + len(value.index)
+    return rows
+
+
+def _max_rss() -> Optional[int]:
+    if resource is None:
+        return None
+    # Linux では KiB 単位
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+@contextmanager
+def span(name: str, rows_in: Optional[int] = None) -> Iterator[dict]:
+    """
+    with 文の区間を計測する
+    計測が無効の場合は何もしない
+    e.g.
+        with i.span("heatmap"):
+            v.show_aggregated_heatmap(...)
+
+    name: 区間の名前
+    rows_in: 入力の行数
+    返り値: rows_out を設定すると出力の行数として記録する
+    """
+    info = {"rows_out": None}
+    if not _enabled:
+        yield info
+        return
+
+    rss_before = _max_rss()
+    cpu_before = time.process_time()
+    start = time.perf_counter()
+    try:
+        yield info
+    finally:
+        wall = time.perf_counter() - start
+        cpu = time.process_time() - cpu_before
+        rss_after = _max_rss()
+        _records.append(
+            Record(
+                name,
+                start - _origin,
+                wall,
+                cpu,
+                rows_in,
+                info["rows_out"],
+                None if rss_before is None else rss_after - rss_before,
+                threading.get_ident(),
+            )
+        )
+
+
+def instrument(func: Callable) -> Callable:
+    """
+    関数の実行時間、CPU 時間、入出力の行数、ピーク RSS の増加量を計測するデコレータ
+    計測が無効の場合はそのまま呼び出す
+    """
+    name = f"{func.__module__.split('.')[-1]}.{func.__name__}"
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return func(*args, **kwargs)
+        rows_in = _count_rows([*args, *kwargs.values()])
+        with span(name, rows_in) as info:
+            result = func(*args, **kwargs)
+            info["rows_out"] = _count_rows([result])
+        return result
+
+    return wrapper
+
+
+def summary(records: Optional[list[Record]] = None) -> pd.DataFrame:
+    """
+    計測結果を名前ごとに集計する
+    入れ子になった呼び出しの時間は呼び出し元の時間にも含まれる
+    """
+    if records is None:
+        records = _records
+    columns = ["calls", "wall", "wall-mean", "cpu", "rows-in", "rows-out", "rss-delta"]
+    if len(records) == 0:
+        return pd.DataFrame(columns=columns)
+    df = pd.DataFrame(records, columns=Record._fields)
+    group = df.groupby("name")
+    table = pd.DataFrame(
+        {
+            "calls": group.size(),
+            "wall": group["wall"].sum(),
+            "wall-mean": group["wall"].mean(),
+            "cpu": group["cpu"].sum(),
+            "rows-in": group["rows_in"].sum(min_count=1),
+            "rows-out": group["rows_out"].sum(min_count=1),
+            "rss-delta": group["rss_delta"].max(),
+        }
+    )
+    return table.sort_values("wall", ascending=False)
+
+
+def to_chrome_trace(records: Optional[list[Record]] = None) -> dict:
+    """
+    計測結果を Chrome のトレース形式 (chrome://tracing, Perfetto で表示できる) に変換する
+    """
+    if records is None:
+        records = _records
+    pid = os.getpid()
+    events = []
+    for record in records:
+        events.append(
+            {
+                "name": record.name,
+                "cat": record.name.split(".")[0],
+                "ph": "X",
+                "ts": record.start * 1e6,
+                "dur": record.wall * 1e6,
+                "pid": pid,
+                "tid": record.thread,
+                "args": {
+                    "cpu": record.cpu,
+                    "rows_in": record.rows_in,
+                    "rows_out": record.rows_out,
+                    "rss_delta": record.rss_delta,
+                },
+            }
+        )
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def export_chrome_trace(path: str, records: Optional[list[Record]] = None):
+    """
+    計測結果を Chrome のトレース形式の json ファイルに保存する
+    """
+    with open(path, "w") as f:
+        json.dump(to_chrome_trace(records), f)
@@ -0,0 +1,270 @@
+import os
+import json
+import time
+import bisect
+import threading
+import contextvars
+import datetime as dt
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+import requests
+
+import src.constants as c
+
+PREFIX = "spla_stat_scraper"
+
+# ヒストグラムのバケットの上限
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+BYTES_BUCKETS = [1e3, 1e4, 5e4, 1e5, 2.5e5, 5e5, 1e6, 5e6, 5e7]
+PARSE_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5]
+
+HISTOGRAMS = {
+    "request_seconds": ("リクエストのレイテンシ（秒）", LATENCY_BUCKETS),
+    "response_bytes": ("レスポンスのサイズ (bytes)", BYTES_BUCKETS),
+    "parse_seconds": ("レスポンスのパース時間（秒）", PARSE_BUCKETS),
+}
+COUNTERS = {
+    "requests_total": "ステータスごとのレスポンス数",
+    "request_errors_total": "レスポンスを受け取れなかったリクエスト数",
+    "retries_total": "リトライ回数",
+}
+
+# リトライするステータスコード
+RETRY_STATUS = [429, 500, 502, 503, 504]
+
+_lock = threading.Lock()
+# {(name, labels): 値}
+_counters = {}
+# {(name, labels): [バケットごとの件数 (最後は +Inf), 合計, 件数]}
+_histograms = {}
+_job = contextvars.ContextVar("job", default="")
+
+
+def reset():
+    """
+    すべてのメトリクスを消去する
+    """
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def _labels(kind: str, **labels) -> tuple:
+    return tuple(sorted({"job": _job.get(), "kind": kind, **labels}.items()))
+
+
+def inc(name: str, kind: str, value: float = 1, **labels):
+    key = (name, _labels(kind, **labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name: str, kind: str, value: float):
+    buckets = HISTOGRAMS[name][1]
+    key = (name, _labels(kind))
+    with _lock:
+        histogram = _histograms.setdefault(key, [[0] * (len(buckets) + 1), 0.0, 0])
+        histogram[0][bisect.bisect_left(buckets, value)] += 1
+        histogram[1] += value
+        histogram[2] += 1
+
+
+def get(
+    url: str,
+    kind: str,
+    retries: int = 3,
+    backoff: float = 1,
+    timeout: float = 30,
+    session: Optional[requests.Session] = None,
+    headers: Optional[dict] = None,
+) -> requests.Response:
+    """
+    レイテンシ、サイズ、ステータスを記録しながら GET リクエストする
+    429, 5xx と接続エラーは backoff * 2^n 秒 (Retry-After があればその秒数) 待ってリトライする
+
+    url: リクエストする URL
+    kind: リクエストの種類 (メトリクスのラベル, e.g. "battle_detail")
+    retries: リトライの最大回数
+    backoff: リトライ間隔の基準（秒）
+    timeout: タイムアウト（秒）
+    session: 使用するセッション (None の場合は requests.get)
+    headers: リクエストヘッダー (e.g. {"If-None-Match": etag})
+    """
+    client = session or requests
+    for attempt in range(retries + 1):
+        if attempt > 0:
+            inc("retries_total", kind)
+        start = time.perf_counter()
+        try:
+            r = client.get(url, timeout=timeout, headers=headers)
+        except (requests.ConnectionError, requests.Timeout):
+            inc("request_errors_total", kind)
+            if attempt == retries:
+                raise
+            time.sleep(backoff * 2**attempt)
+            continue
+        observe("request_seconds", kind, time.perf_counter() - start)
+        observe("response_bytes", kind, len(r.content))
+        inc("requests_total", kind, status=str(r.status_code))
+        if r.status_code not in RETRY_STATUS or attempt == retries:
+            return r
+        retry_after = r.headers.get("Retry-After", "")
+        wait = float(retry_after) if retry_after.isdigit() else backoff * 2**attempt
+        print(f"status {r.status_code}, retry after {wait} s: {url}")
+        time.sleep(wait)
+
+
+@contextmanager
+def parse(kind: str) -> Iterator[None]:
+    """
+    with 文の区間をパース時間として記録する
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe("parse_seconds", kind, time.perf_counter() - start)
+
+
+def _format_labels(labels: tuple, **extra) -> str:
+    items = [*labels, *extra.items()]
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+def to_prometheus_text() -> str:
+    """
+    メトリクスを Prometheus のテキスト形式に変換する
+    """
+    with _lock:
+        counters = dict(_counters)
+        histograms = {k: [list(v[0]), v[1], v[2]] for k, v in _histograms.items()}
+
+    lines = []
+    for name, help_text in COUNTERS.items():
+        lines.append(f"# HELP {PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {PREFIX}_{name} counter")
+        for (key, labels), value in sorted(counters.items()):
+            if key == name:
+                lines.append(f"{PREFIX}_{name}{_format_labels(labels)} {value}")
+    for name, (help_text, buckets) in HISTOGRAMS.items():
+        lines.append(f"# HELP {PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {PREFIX}_{name} histogram")
+        for (key, labels), (counts, total, count) in sorted(histograms.items()):
+            if key != name:
+                continue
+            cumulative = 0
+            for le, n in zip([*map(str, buckets), "+Inf"], counts):
+                cumulative += n
+                label_text = _format_labels(labels, le=le)
+                lines.append(f"{PREFIX}_{name}_bucket{label_text} {cumulative}")
+            lines.append(f"{PREFIX}_{name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{PREFIX}_{name}_count{_format_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(path: str = c.SCRAPER_METRICS_PATH):
+    """
+    Prometheus のテキスト形式で保存する (node_exporter の textfile collector 用)
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(to_prometheus_text())
+    os.replace(tmp_path, path)
+
+
+def _snapshot(job: str) -> tuple[dict, dict]:
+    with _lock:
+        counters = {k: v for k, v in _counters.items() if dict(k[1])["job"] == job}
+        histograms = {
+            k: [list(v[0]), v[1], v[2]]
+            for k, v in _histograms.items()
+            if dict(k[1])["job"] == job
+        }
+    return counters, histograms
+
+
+def _quantile(buckets: list[float], counts: list[int], q: float) -> Optional[float]:
+    """
+    ヒストグラムから分位数を推定する (バケットの上限を返す)
+    """
+    total = sum(counts)
+    if total == 0:
+        return None
+    cumulative = 0
+    for le, n in zip([*buckets, float("inf")], counts):
+        cumulative += n
+        if cumulative >= q * total:
+            return le
+    return float("inf")
+
+
+def summarize(before: tuple[dict, dict], after: tuple[dict, dict]) -> dict:
+    """
+    2つのスナップショットの差分から種類ごとの集計を作成する
+    """
+    summary = {}
+    counters_before, histograms_before = before
+    counters_after, histograms_after = after
+
+    for (name, labels), value in counters_after.items():
+        label_dict = dict(labels)
+        item = summary.setdefault(label_dict["kind"], {})
+        diff = value - counters_before.get((name, labels), 0)
+        if name == "requests_total":
+            item.setdefault("status", {})[label_dict["status"]] = diff
+        else:
+            item[name] = diff
+
+    for (name, labels), (counts, total, count) in histograms_after.items():
+        before_counts, before_total, before_count = histograms_before.get(
+            (name, labels), [[0] * len(counts), 0.0, 0]
+        )
+        counts = [x - y for x, y in zip(counts, before_counts)]
+        total -= before_total
+        count -= before_count
+        buckets = HISTOGRAMS[name][1]
+        item = summary.setdefault(dict(labels)["kind"], {})
+        item[name] = {
+            "count": count,
+            "sum": total,
+            "mean": total / count if count > 0 else None,
+            "p50": _quantile(buckets, counts, 0.5),
+            "p95": _quantile(buckets, counts, 0.95),
+        }
+    return summary
+
+
+@contextmanager
+def run(job: str, textfile_path: str = c.SCRAPER_METRICS_PATH) -> Iterator[None]:
+    """
+    with 文の中のリクエストに job ラベルを付けて記録する
+    終了時 (例外で終了した場合も) に Prometheus のテキストファイルと
+    実行ごとの集計の json (METRICS_DIR/runs/<job>_<開始時刻>.json) を保存する
+
+    job: ジョブ名 (e.g. "battle_list_xmatch")
+    """
+    token = _job.set(job)
+    started_at = dt.datetime.now(dt.timezone.utc)
+    before = _snapshot(job)
+    try:
+        yield
+    finally:
+        _job.reset(token)
+        finished_at = dt.datetime.now(dt.timezone.utc)
+        summary = {
+            "job": job,
+            "started_at": started_at.isoformat(),
+            "finished_at": finished_at.isoformat(),
+            "elapsed": (finished_at - started_at).total_seconds(),
+            "kinds": summarize(before, _snapshot(job)),
+        }
+        if len(summary["kinds"]) == 0:
+            # 別スレッドでのリクエストは contextvars をコピーしないと job が付かない
+            print(f"no metrics recorded for job {job}")
+        runs_dir = f"{os.path.dirname(textfile_path)}/runs"
+        os.makedirs(runs_dir, exist_ok=True)
+        with open(f"{runs_dir}/{job}_{started_at:%Y%m%dT%H%M%S}.json", "w") as f:
+            json.dump(summary, f, indent=2)
+        write_textfile(textfile_path)
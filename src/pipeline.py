@@ -0,0 +1,392 @@
+import os
+import json
+import hashlib
+import datetime as dt
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, NamedTuple, Optional
+
+import src.constants as c
+
+PIPELINE_STATE_PATH = f"{c.DATA_DIR}/pipeline_state.json"
+# stat.ink にリクエストするステージの lane
+STATINK_LANE = "statink"
+
+
+class Stage(NamedTuple):
+    """
+    パイプラインのステージ
+
+    name: ステージ名
+    run: 実行する関数 (引数は delay)
+    inputs: 入力ファイルのパス
+    outputs: 出力ファイル・ディレクトリのパス
+    interval: 入力が変わらなくても再実行するまでの間隔
+        None の場合は入力が変わったときだけ実行する
+    lane: 同じ lane のステージは同時に実行しない
+        (stat.ink にリクエストするステージを順番に実行し、取得間隔を保つ)
+    """
+
+    name: str
+    run: Callable[[int], None]
+    inputs: list[str]
+    outputs: list[str]
+    interval: Optional[dt.timedelta] = None
+    lane: Optional[str] = None
+
+
+# 各ステージの処理は起動を速くするため実行時に import する
+def _run_update_source(delay: int):
+    import src.scraping as s
+
+    s.update_source_weapons()
+    s.update_source_stages()
+    s.update_source_rules()
+    s.update_source_lobbies()
+
+
+def _run_update_source_images(delay: int):
+    import src.scraping as s
+
+    # delay はすべてのワーカーで共有するリクエストの開始間隔
+    s.update_source_images(delay, workers=8)
+
+
+def _run_update_user_list(delay: int):
+    import src.scraping as s
+
+    s.update_user_list()
+
+
+def _create_update_battle_list(
+    battle_list_path: str, lobby: str, budget: Optional[int] = None
+):
+    def run(delay: int):
+        import src.scraping as s
+
+        s.update_battle_list(battle_list_path, lobby, delay, budget=budget)
+
+    return run
+
+
+# src.utils は requests を読み込み起動が遅くなるので JST はここで定義する
+_TZ_JST = dt.timezone(dt.timedelta(hours=9))
+
+
+def _get_details_date_range(days: int) -> tuple[dt.datetime, dt.datetime]:
+    end_date = dt.datetime.now(_TZ_JST).replace(
+        hour=0, minute=0, second=0, microsecond=0
+    )
+    return end_date - dt.timedelta(days=days), end_date
+
+
+def _get_details_xmatch_path(days: int) -> str:
+    start_date, end_date = _get_details_date_range(days)
+    date_to = end_date - dt.timedelta(days=1)
+    return f"{c.DATA_DIR}/details_xmatch_{start_date:%y%m%d}_{date_to:%y%m%d}.csv"
+
+
+def _create_update_battle_details(days: int):
+    def run(delay: int):
+        import pandas as pd
+        import src.scraping as s
+
+        start_date, end_date = _get_details_date_range(days)
+
+        battles = pd.read_csv(c.BATTLE_LIST_XMATCH_PATH)
+        battles["Datetime"] = pd.to_datetime(battles["Datetime"])
+        battles = battles[~battles["Disconnected"]]
+        battles = battles[
+            (battles["Datetime"] >= start_date) & (battles["Datetime"] < end_date)
+        ]
+        s.update_battle_details(battles, _get_details_xmatch_path(days), delay)
+
+    return run
+
+
+def _run_update_csv_files(delay: int):
+    import src.scraping2 as s2
+
+    s2.update_csv_files(delay)
+
+
+def _run_update_players(delay: int):
+    import src.players as pl
+
+    pl.update_players()
+
+
+def create_stages(details_days: int = 7, budget: Optional[int] = None) -> list[Stage]:
+    """
+    データ更新のステージ一覧を作成する
+    ノートブック 00, 01, 02, 03, 04, 10 に対応する
+    players は戦績データの csv ファイルを 1 行 1 プレイヤーに変換して保存する
+
+    details_days: バトル詳細を取得する日数 (前日まで)
+    budget: バトル一覧のステージが1回の実行でリクエストするページ数の上限
+        (ロビーごと, None の場合は制限なし)
+    """
+    source_paths = [
+        c.SOURCE_MAIN_PATH,
+        c.SOURCE_SUB_PATH,
+        c.SOURCE_SPECIAL_PATH,
+        c.SOURCE_TYPE_PATH,
+        c.SOURCE_STAGE_PATH,
+        c.SOURCE_RULE_PATH,
+        c.SOURCE_LOBBY_PATH,
+    ]
+    always = dt.timedelta(0)
+    return [
+        Stage(
+            "source",
+            _run_update_source,
+            [],
+            source_paths,
+            dt.timedelta(days=1),
+            STATINK_LANE,
+        ),
+        Stage(
+            "images",
+            _run_update_source_images,
+            [c.SOURCE_MAIN_PATH, c.SOURCE_SUB_PATH, c.SOURCE_SPECIAL_PATH],
+            [c.IMAGES_DIR],
+            lane=STATINK_LANE,
+        ),
+        Stage(
+            "users",
+            _run_update_user_list,
+            [],
+            [c.USER_DATA_PATH],
+            always,
+            STATINK_LANE,
+        ),
+        Stage(
+            "battles-xmatch",
+            _create_update_battle_list(c.BATTLE_LIST_XMATCH_PATH, "xmatch", budget),
+            [c.USER_DATA_PATH],
+            [c.BATTLE_LIST_XMATCH_PATH],
+            always,
+            STATINK_LANE,
+        ),
+        Stage(
+            "battles-bankara-challenge",
+            _create_update_battle_list(
+                c.BATTLE_LIST_BANKARA_CHALLENGE_PATH, "bankara_challenge", budget
+            ),
+            [c.USER_DATA_PATH],
+            [c.BATTLE_LIST_BANKARA_CHALLENGE_PATH],
+            always,
+            STATINK_LANE,
+        ),
+        Stage(
+            "details-xmatch",
+            _create_update_battle_details(details_days),
+            [c.BATTLE_LIST_XMATCH_PATH],
+            [_get_details_xmatch_path(details_days)],
+            lane=STATINK_LANE,
+        ),
+        # stat.ink の一覧は手元で比較できないので、1日1ファイル増えるのに合わせて間隔で実行する
+        Stage(
+            "statink-csv",
+            _run_update_csv_files,
+            [],
+            [c.STATINK_CSV_DIR],
+            dt.timedelta(hours=12),
+            STATINK_LANE,
+        ),
+        Stage(
+            "players",
+            _run_update_players,
+            [c.STATINK_CSV_DIR, c.SOURCE_MAIN_PATH],
+            [c.PLAYERS_DIR],
+        ),
+    ]
+
+
+def get_dependencies(stages: list[Stage]) -> dict[str, set[str]]:
+    """
+    入出力のパスからステージ間の依存関係を求める
+    あるステージの入力が別のステージの出力であれば依存とみなす
+    """
+    producers = {}
+    for stage in stages:
+        for output in stage.outputs:
+            producers[output] = stage.name
+
+    dependencies = {}
+    for stage in stages:
+        deps = {producers[x] for x in stage.inputs if x in producers}
+        deps.discard(stage.name)
+        dependencies[stage.name] = deps
+    return dependencies
+
+
+def _fingerprint_dir(path: str) -> str:
+    """
+    ディレクトリ内のファイル数と最新の更新日時
+    (ファイルの追加・削除・更新で変わる)
+    """
+    file_num = 0
+    latest_mtime = 0
+    for root, _, filenames in os.walk(path):
+        for filename in filenames:
+            if filename.endswith(".tmp"):
+                continue
+            file_num += 1
+            mtime = os.stat(os.path.join(root, filename)).st_mtime_ns
+            latest_mtime = max(latest_mtime, mtime)
+    return f"{file_num}:{latest_mtime}"
+
+
+def _fingerprint(paths: list[str]) -> dict[str, Optional[str]]:
+    """
+    入力ファイルの内容のハッシュを求める
+    上流のステージが同じ内容で上書きしただけなら変更なしとみなす
+    ディレクトリはファイル数と最新の更新日時で比較する
+    """
+    fingerprint = {}
+    for path in paths:
+        if os.path.isdir(path):
+            fingerprint[path] = _fingerprint_dir(path)
+            continue
+        if not os.path.isfile(path):
+            fingerprint[path] = None
+            continue
+        h = hashlib.sha1()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        fingerprint[path] = h.hexdigest()
+    return fingerprint
+
+
+def load_state(state_path: str = PIPELINE_STATE_PATH) -> dict:
+    if not os.path.exists(state_path):
+        return {}
+    with open(state_path) as f:
+        return json.load(f)
+
+
+def save_state(state: dict, state_path: str = PIPELINE_STATE_PATH):
+    os.makedirs(os.path.dirname(state_path), exist_ok=True)
+    tmp_path = f"{state_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, state_path)
+
+
+def is_up_to_date(stage: Stage, state: dict, now: dt.datetime) -> bool:
+    """
+    ステージを実行する必要がないかを判定する
+    - 出力がすべて存在する
+    - 入力が前回実行時から変わっていない
+    - 前回実行から interval が経過していない
+    """
+    record = state.get(stage.name)
+    if record is None:
+        return False
+    if not all(map(os.path.exists, stage.outputs)):
+        return False
+    if record["inputs"] != _fingerprint(stage.inputs):
+        return False
+    if stage.interval is not None:
+        finished_at = dt.datetime.fromisoformat(record["finished_at"])
+        if now - finished_at >= stage.interval:
+            return False
+    return True
+
+
+def run_pipeline(
+    stages: list[Stage],
+    targets: Optional[list[str]] = None,
+    delay: int = 5,
+    jobs: int = 4,
+    force: bool = False,
+    dry_run: bool = False,
+    state_path: str = PIPELINE_STATE_PATH,
+) -> dict[str, str]:
+    """
+    依存関係に従ってステージを実行する
+    依存関係のないステージは並行して実行する (同じ lane のステージは1つずつ実行する)
+
+    stages: ステージ一覧
+    targets: 実行するステージ名 (依存するステージも含めて実行する)
+        None の場合はすべてのステージ
+    delay: 取得間隔（秒）
+    jobs: 同時に実行するステージの最大数
+    force: 最新であってもすべて実行する
+    dry_run: 実行せずに判定結果だけを返す
+    """
+    dependencies = get_dependencies(stages)
+    stage_map = {stage.name: stage for stage in stages}
+
+    # 対象ステージと依存するステージを集める
+    selected = set()
+    pending = list(targets) if targets else list(stage_map)
+    while pending:
+        name = pending.pop()
+        if name not in stage_map:
+            raise ValueError(f"unknown stage: {name}")
+        if name not in selected:
+            selected.add(name)
+            pending.extend(dependencies[name])
+
+    state = load_state(state_path)
+    results = {}
+    # dry run では上流を実行しないので、上流が実行される予定なら入力は変わるものとみなす
+    upstream_ran = set()
+    running = {}
+
+    def ready(name: str) -> bool:
+        return all(dep in results for dep in dependencies[name] if dep in selected)
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        while len(results) < len(selected):
+            for name in [x for x in stage_map if x in selected]:
+                if name in results or name in running.values() or not ready(name):
+                    continue
+                stage = stage_map[name]
+                if stage.lane is not None and any(
+                    stage_map[x].lane == stage.lane for x in running.values()
+                ):
+                    continue
+                deps = dependencies[name] & selected
+                if any(results[dep] == "failed" for dep in deps):
+                    results[name] = "failed"
+                    print(f"[{name}] skip (upstream failed)")
+                    continue
+                now = dt.datetime.now(dt.timezone.utc)
+                if not force and not (dry_run and deps & upstream_ran):
+                    if is_up_to_date(stage, state, now):
+                        results[name] = "skipped"
+                        print(f"[{name}] up to date")
+                        continue
+                if dry_run:
+                    results[name] = "pending"
+                    upstream_ran.add(name)
+                    print(f"[{name}] would run")
+                    continue
+                print(f"[{name}] start")
+                running[executor.submit(stage.run, delay)] = name
+
+            if not running:
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                stage = stage_map[name]
+                try:
+                    future.result()
+                except Exception as e:
+                    results[name] = "failed"
+                    print(f"[{name}] failed: {e}")
+                    continue
+                results[name] = "done"
+                state[name] = {
+                    "inputs": _fingerprint(stage.inputs),
+                    "finished_at": dt.datetime.now(dt.timezone.utc).isoformat(),
+                }
+                save_state(state, state_path)
+                print(f"[{name}] done")
+
+    return results
@@ -0,0 +1,203 @@
+import os
+import re
+import hashlib
+import inspect
+import datetime as dt
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Union
+
+import pandas as pd
+
+import src.analytics2 as a
+import src.constants as c
+import src.definitions as d
+import src.schema as sc
+import src.utils as u
+
+# parquet のメタデータに保存する作成時のバージョンのキー
+VERSION_KEY = b"spla-stat-players-version"
+
+
+def get_players_path(date: dt.date, lobby: str) -> str:
+    return f"{c.PLAYERS_DIR}/{date}/{lobby}.parquet"
+
+
+def get_players_version() -> str:
+    """
+    プレイヤー情報の作成方法のバージョン
+    スキーマのバージョンと、schema.py, ブキの対応表 (sources/main.csv),
+    details_to_players のソースのハッシュからなり、どれかが変わると作成し直す
+    """
+    h = hashlib.sha1()
+    for path in [sc.__file__, c.SOURCE_MAIN_PATH]:
+        with open(path, "rb") as f:
+            h.update(f.read())
+    h.update(inspect.getsource(inspect.unwrap(a.details_to_players)).encode())
+    return f"{sc.SCHEMA_VERSION}-{h.hexdigest()}"
+
+
+def _read_version(path: str) -> Optional[str]:
+    import pyarrow.parquet as pq
+
+    metadata = pq.read_schema(path).metadata or {}
+    version = metadata.get(VERSION_KEY)
+    return None if version is None else version.decode()
+
+
+def _is_up_to_date(date: dt.date, version: str) -> bool:
+    """
+    日付のプレイヤー情報が戦績データより新しく、同じバージョンで作成されたか
+    """
+    details_path = a.get_details_path(date)
+    players_dir = f"{c.PLAYERS_DIR}/{date}"
+    if not os.path.isdir(players_dir):
+        return False
+    paths = [x.path for x in os.scandir(players_dir) if x.name.endswith(".parquet")]
+    if len(paths) == 0:
+        return False
+    details_mtime = os.path.getmtime(details_path)
+    return all(
+        os.path.getmtime(x) >= details_mtime and _read_version(x) == version
+        for x in paths
+    )
+
+
+def build_players_on(date: dt.date) -> dict[str, pd.DataFrame]:
+    """
+    日付を指定して戦績データを 1 行 1 プレイヤーに変換し、ロビーごとに parquet で保存する
+    投稿者 ("uploader" カラム) とヒーローシューターレプリカを含め、
+    ギアパワーは文字列のまま保存する (変換は read_players で行う)
+    row は戦績データの csv ファイル内の行番号 (read_details_on の index)
+
+    作成時のバージョン (get_players_version) を parquet のメタデータに保存する
+
+    返り値: {ロビー: プレイヤー情報}
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    version = get_players_version()
+    details = a.read_details_on(date, None)
+    details["row"] = details.index
+    players_dir = f"{c.PLAYERS_DIR}/{date}"
+    os.makedirs(players_dir, exist_ok=True)
+
+    players_per_lobby = {}
+    for lobby, group in details.groupby("lobby", sort=True):
+        players = a.details_to_players(
+            group, ["row"], use_uploader=True, use_heroshooter=True
+        )
+        path = get_players_path(date, lobby)
+        table = pa.Table.from_pandas(players, preserve_index=False)
+        metadata = {**(table.schema.metadata or {}), VERSION_KEY: version.encode()}
+        tmp_path = f"{path}.tmp"
+        pq.write_table(table.replace_schema_metadata(metadata), tmp_path)
+        os.replace(tmp_path, path)
+        players_per_lobby[lobby] = players
+
+    # 戦績データからなくなったロビーのファイルを削除する
+    for entry in os.scandir(players_dir):
+        lobby = entry.name.removesuffix(".parquet")
+        if entry.name.endswith(".parquet") and lobby not in players_per_lobby:
+            os.remove(entry.path)
+    return players_per_lobby
+
+
+def _get_details_dates() -> list[dt.date]:
+    """
+    戦績データの csv ファイルがある日付の一覧
+    """
+    dates = set()
+    for filename in os.listdir(c.STATINK_CSV_DIR):
+        match = re.fullmatch(r"(\d{4}-\d{2}-\d{2})\.csv(\.gz|\.zst)?", filename)
+        if match is not None:
+            dates.add(dt.date.fromisoformat(match.group(1)))
+    return sorted(dates)
+
+
+def update_players(
+    date_from: Optional[dt.date] = None,
+    date_to: Optional[dt.date] = None,
+    processes: Optional[int] = 1,
+):
+    """
+    戦績データより古い、作成方法のバージョンが違う、またはまだないプレイヤー情報を作成する
+
+    date_from: 開始日 (None の場合は制限なし)
+    date_to: 終了日 (この日を含まない, None の場合は制限なし)
+    processes: プロセス数 (None の場合は CPU コア数)
+    """
+    dates = [
+        x
+        for x in _get_details_dates()
+        if (date_from is None or x >= date_from) and (date_to is None or x < date_to)
+    ]
+    version = get_players_version()
+    dates = [x for x in dates if not _is_up_to_date(x, version)]
+    for date in dates:
+        print(f"build players for {date}")
+    if processes == 1:
+        list(map(build_players_on, dates))
+        return
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        list(executor.map(build_players_on, dates))
+
+
+def read_players(
+    date_from: dt.date,
+    date_to: dt.date,
+    lobby: Union[d.Lobby, list[d.Lobby]] = d.Lobby.XMATCH,
+    columns: Optional[list[str]] = None,
+    filters: Optional[list[tuple]] = None,
+    use_uploader: bool = False,
+    use_heroshooter: bool = False,
+    use_abilities: bool = False,
+) -> pd.DataFrame:
+    """
+    日付の期間を指定して保存したプレイヤー情報を読み込む
+    プレイヤー情報がない、古い、またはバージョンが違う日は作成する
+    結果は iter_players_from_to の各日の結果を縦に並べ、"row" カラムを加えたもの
+    (index は 0 からの連番)
+
+    lobby: ロビー (リストの場合は複数のロビー)
+    columns: 読み込むカラム (None の場合はすべて)
+    filters: 読み込むときの条件 (pyarrow の filters)
+        e.g. [("mode", "==", "area"), ("x-power", ">=", 2000)]
+    use_uploader: 投稿者のデータを含める
+    use_heroshooter: ヒーローシューターレプリカをスプラシューターと合算しない
+    use_abilities: ギアパワーの文字列 "abilities" の代わりに
+        parse_abilities の "ability-<ギアパワー>" カラムと "has-abilities" カラムを追加する
+    """
+    update_players(date_from, date_to)
+    lobbies = lobby if isinstance(lobby, list) else [lobby]
+    filters = list(filters or [])
+    if not use_uploader:
+        filters.append(("uploader", "==", False))
+    read_columns = columns
+    if columns is not None and use_abilities and "abilities" not in columns:
+        read_columns = [*columns, "abilities"]
+
+    players_list = []
+    for date in u.date_range(date_from, date_to):
+        for target_lobby in lobbies:
+            path = get_players_path(date, target_lobby.value)
+            if not os.path.exists(path):
+                continue
+            players = pd.read_parquet(
+                path, columns=read_columns, filters=filters or None
+            )
+            players_list.append(players)
+    if len(players_list) == 0:
+        raise ValueError("no players in the date range")
+    players = pd.concat(players_list, ignore_index=True)
+
+    if not use_heroshooter and "weapon" in players.columns:
+        players["weapon"] = players["weapon"].replace("heroshooter_replica", "sshooter")
+    if use_abilities:
+        has_abilities = players["abilities"].notna()
+        abilities = a.parse_abilities(players["abilities"])
+        players = players.drop(columns="abilities")
+        players = pd.concat(
+            [players, has_abilities.rename("has-abilities"), abilities], axis=1
+        )
+    return players
@@ -0,0 +1,256 @@
+import os
+import json
+import functools
+import datetime as dt
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import repeat
+from typing import Optional
+from urllib.parse import parse_qs, urlsplit
+
+import pandas as pd
+
+import src.analytics2 as a
+import src.definitions as d
+import src.utils as u
+
+SUBJECTS = ["weapon", "weapon-sub", "weapon-special", "weapon-type", "stage"]
+LOBBIES = [
+    d.Lobby.REGULAR,
+    d.Lobby.BANKARA_OPEN,
+    d.Lobby.BANKARA_CHALLENGE,
+    d.Lobby.XMATCH,
+]
+
+
+def _day_partials(
+    date: dt.date, lobbies: list[d.Lobby], subjects: list[str]
+) -> dict[tuple[str, str], pd.DataFrame]:
+    """
+    1日分のプレイヤー情報をロビー、対象、ゲームバージョンごとに集計する
+    (プロセスプールで実行する)
+    """
+    partials = {}
+    for lobby in lobbies:
+        details = a.read_details_on(date, lobby)
+        if details.empty:
+            continue
+        players = a.details_to_players(details)
+        for subject in subjects:
+            partial_list = []
+            for game_ver, group in players.groupby("game-ver"):
+                partial = a.players_partial_by_mode_and(subject, group).reset_index()
+                partial.insert(0, "game-ver", game_ver)
+                partial_list.append(partial)
+            partial = pd.concat(partial_list, ignore_index=True)
+            partial.insert(0, "date", date)
+            partials[(lobby.value, subject)] = partial
+    return partials
+
+
+def load_partials(
+    date_from: dt.date,
+    date_to: dt.date,
+    lobbies: list[d.Lobby] = LOBBIES,
+    subjects: list[str] = SUBJECTS,
+    processes: Optional[int] = None,
+) -> dict[tuple[str, str], pd.DataFrame]:
+    """
+    日付の期間の集計結果を読み込む
+    戦績データがない日はスキップする
+
+    返り値: {(ロビー, 対象): 日付、ゲームバージョン、モード、対象ごとの
+        players_partial_by_mode_and の集計結果を縦に並べた DataFrame}
+    """
+    dates = [x for x in u.date_range(date_from, date_to) if _exists(x)]
+    if processes == 1:
+        results = map(_day_partials, dates, repeat(lobbies), repeat(subjects))
+        return _concat_partials(results)
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        results = executor.map(_day_partials, dates, repeat(lobbies), repeat(subjects))
+        return _concat_partials(results)
+
+
+def _exists(date: dt.date) -> bool:
+    return os.path.exists(a.get_details_path(date))
+
+
+def _concat_partials(results) -> dict[tuple[str, str], pd.DataFrame]:
+    partial_lists = {}
+    for partials in results:
+        for key, partial in partials.items():
+            partial_lists.setdefault(key, []).append(partial)
+    return {
+        key: pd.concat(partial_list, ignore_index=True)
+        for key, partial_list in partial_lists.items()
+    }
+
+
+def query(
+    partials: dict[tuple[str, str], pd.DataFrame],
+    lobby: str = d.Lobby.XMATCH.value,
+    subject: str = "weapon",
+    date_from: Optional[dt.date] = None,
+    date_to: Optional[dt.date] = None,
+    modes: Optional[list[str]] = None,
+    game_vers: Optional[list[str]] = None,
+    target: Optional[str] = None,
+    interval: Optional[str] = None,
+) -> pd.DataFrame:
+    """
+    読み込んだ集計結果を条件で絞り込んで足し合わせ、勝率や使用率を計算する
+
+    partials: load_partials の結果
+    lobby: ロビー
+    subject: 対象 (e.g. "weapon")
+    date_from: 開始日 (None の場合は制限なし)
+    date_to: 終了日 (この日を含まない, None の場合は制限なし)
+    modes: モード (None の場合はすべて)
+    game_vers: ゲームバージョン (None の場合はすべて)
+    target: 指定した場合は aggregate_index_per_subject と同じ形式にする
+    interval: 信頼区間の計算方法 (None の場合は計算しない)
+
+    返り値: players_group_by_mode_and と同じ形式の DataFrame
+    """
+    if target is not None:
+        a._check_interval_target(target, interval)
+    if (lobby, subject) not in partials:
+        raise KeyError(f"not loaded: lobby={lobby}, subject={subject}")
+    partial = partials[(lobby, subject)]
+    mask = pd.Series(True, index=partial.index)
+    if date_from is not None:
+        mask &= partial["date"] >= date_from
+    if date_to is not None:
+        mask &= partial["date"] < date_to
+    if modes is not None:
+        mask &= partial["mode"].isin(modes)
+    if game_vers is not None:
+        mask &= partial["game-ver"].isin(game_vers)
+    partial = partial[mask].drop(columns=["date", "game-ver"])
+    if partial.empty:
+        raise ValueError("no data matches the query")
+
+    merged = partial.groupby(["mode", subject], dropna=False, sort=True).sum()
+    df = a.partial_to_players_group(subject, merged, interval)
+    if target is None:
+        return df
+    return a._pivot_index_per_mode(df, subject, target, interval)
+
+
+def _parse_list(params: dict, name: str) -> Optional[list[str]]:
+    if name not in params:
+        return None
+    return [x for value in params[name] for x in value.split(",") if x != ""]
+
+
+def _parse_date(params: dict, name: str) -> Optional[dt.date]:
+    if name not in params:
+        return None
+    return dt.date.fromisoformat(params[name][-1])
+
+
+class QueryServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: tuple[str, int],
+        partials: dict[tuple[str, str], pd.DataFrame],
+        cache_size: int = 1024,
+    ):
+        super().__init__(address, QueryHandler)
+        self.partials = partials
+        # クエリ文字列を正規化したタプルをキーにしてレスポンスをキャッシュする
+        self.respond = functools.lru_cache(maxsize=cache_size)(self._respond)
+
+    def _respond(self, path: str, items: tuple) -> tuple[int, bytes]:
+        params = {}
+        for key, value in items:
+            params.setdefault(key, []).append(value)
+
+        if path == "/health":
+            loaded = {f"{k[0]}/{k[1]}": len(v.index) for k, v in self.partials.items()}
+            body = json.dumps({"status": "ok", "partials": loaded})
+            return 200, body.encode()
+        if path != "/aggregate":
+            return 404, json.dumps({"error": f"not found: {path}"}).encode()
+
+        try:
+            df = query(
+                self.partials,
+                lobby=params.get("lobby", [d.Lobby.XMATCH.value])[-1],
+                subject=params.get("subject", ["weapon"])[-1],
+                date_from=_parse_date(params, "from"),
+                date_to=_parse_date(params, "to"),
+                modes=_parse_list(params, "mode"),
+                game_vers=_parse_list(params, "game-ver"),
+                target=params.get("target", [None])[-1],
+                interval=params.get("interval", [None])[-1],
+            )
+        except (KeyError, ValueError) as e:
+            return 400, json.dumps({"error": str(e)}).encode()
+
+        query_json = json.dumps(
+            {k: v if len(v) > 1 else v[0] for k, v in params.items()}
+        )
+        rows = df.reset_index().to_json(orient="records", force_ascii=False)
+        return 200, f'{{"query": {query_json}, "rows": {rows}}}'.encode()
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    server: QueryServer
+    # ヘッダーと本文を別々に送るときの遅延を避ける
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = parse_qs(url.query)
+        items = tuple(sorted((k, v) for k, values in params.items() for v in values))
+        status, body = self.server.respond(url.path, items)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def create_server(
+    partials: dict[tuple[str, str], pd.DataFrame],
+    host: str = "127.0.0.1",
+    port: int = 8080,
+    cache_size: int = 1024,
+) -> QueryServer:
+    """
+    集計結果を返す HTTP サーバーを作成する
+    e.g. /aggregate?lobby=xmatch&subject=weapon&from=2022-12-01&to=2022-12-08
+            &mode=area,yagura&game-ver=2.0.0&target=usage-rate
+
+    partials: load_partials の結果
+    cache_size: キャッシュするレスポンスの数
+    """
+    return QueryServer((host, port), partials, cache_size)
+
+
+def serve(
+    date_from: dt.date,
+    date_to: dt.date,
+    host: str = "127.0.0.1",
+    port: int = 8080,
+    cache_size: int = 1024,
+    processes: Optional[int] = None,
+):
+    """
+    日付の期間の集計結果を読み込み、HTTP サーバーを起動する
+    """
+    partials = load_partials(date_from, date_to, processes=processes)
+    server = create_server(partials, host, port, cache_size)
+    print(f"query server listening on http://{host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
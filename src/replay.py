@@ -0,0 +1,243 @@
+import os
+import re
+import time
+import hashlib
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import NamedTuple, Optional
+from urllib.parse import quote, urlsplit
+
+import src.statink as s
+import src.utils as u
+
+
+class ReplayConfig(NamedTuple):
+    """
+    リプレイサーバーの設定
+
+    record_dir: 記録したレスポンスのディレクトリ
+    csv_dir: dl-stats のディレクトリツリーとして配信する戦績データの csv のディレクトリ
+        (YYYY-MM-DD.csv または圧縮した .csv.gz, .csv.zst, e.g. c.STATINK_CSV_DIR や synthetic で作成したもの)
+    upstream: 記録がないときに取得して記録する stat.ink の URL (None の場合は 404)
+    csv_upstream: 記録がないときに取得して記録する dl-stats の URL
+    latency: レスポンスを返すまでの待ち時間（秒）
+    jitter: 待ち時間に加える一様乱数の幅（秒）
+    rate_429: 429 を返す確率
+    rate_error: 500 か 503 を返す確率
+    max_rps: 1秒あたりのリクエスト数の上限 (超えた分は 429)
+    retry_after: 429 の Retry-After（秒）
+    """
+
+    record_dir: str
+    csv_dir: Optional[str] = None
+    upstream: Optional[str] = None
+    csv_upstream: Optional[str] = None
+    latency: float = 0
+    jitter: float = 0
+    rate_429: float = 0
+    rate_error: float = 0
+    max_rps: Optional[float] = None
+    retry_after: int = 1
+
+
+def get_record_path(record_dir: str, path: str) -> str:
+    """
+    リクエストのパス (クエリを含む) に対応する記録ファイルのパス
+    "/@user/spl3" と "/@user/spl3/<id>" が両立するようにパス全体を1つのファイル名にする
+    """
+    return os.path.join(record_dir, quote(path.lstrip("/"), safe=""))
+
+
+def _guess_content_type(path: str) -> str:
+    path = urlsplit(path).path
+    if path.startswith("/api/"):
+        return "application/json"
+    if path.endswith(".csv"):
+        return "text/csv; charset=utf-8"
+    if path.endswith(".png"):
+        return "image/png"
+    return "text/html; charset=utf-8"
+
+
+def _list_csv_tree(csv_dir: str, path: str) -> Optional[bytes]:
+    """
+    csv ファイルの一覧から dl-stats と同じ形式のディレクトリの一覧を作成する
+    /splatoon-3/battle-results-csv/ => 2022/, 2022/10/ => 2022-10-03.csv
+    """
+    relative = path[len(s.RESULTS_CSV_ROOT_PATH) :].strip("/")
+    depth = 0 if relative == "" else len(relative.split("/"))
+    # 圧縮したファイルは展開して配信するので .csv の名前にする
+    filenames = sorted(
+        {
+            x[:14]
+            for x in os.listdir(csv_dir)
+            if re.fullmatch(r"\d{4}-\d{2}-\d{2}\.csv(\.gz|\.zst)?", x)
+        }
+    )
+    if depth == 0:
+        names = sorted({f"{x[:4]}/" for x in filenames})
+    elif depth == 1:
+        names = sorted({f"{x[5:7]}/" for x in filenames if x[:4] == relative})
+    elif depth == 2:
+        year, month = relative.split("/")
+        names = [x for x in filenames if x[:4] == year and x[5:7] == month]
+    else:
+        return None
+    if len(names) == 0:
+        return None
+    anchors = "".join(f'<a href="{path}{x}">{x}</a>\n' for x in names)
+    return f"<html><body><pre>\n{anchors}</pre></body></html>".encode()
+
+
+def _read_csv_file(csv_dir: str, path: str) -> Optional[bytes]:
+    filepath = os.path.join(csv_dir, os.path.basename(path))
+    for suffix in ["", *u.COMPRESSION_SUFFIXES.values()]:
+        if os.path.isfile(filepath + suffix):
+            with u.open_file(filepath + suffix) as f:
+                return f.read()
+    return None
+
+
+def _fetch_upstream(config: ReplayConfig, path: str) -> Optional[bytes]:
+    import requests
+
+    is_csv = path.startswith(s.RESULTS_CSV_ROOT_PATH)
+    upstream = config.csv_upstream if is_csv else config.upstream
+    if upstream is None:
+        return None
+    print(f"record {upstream}{path}")
+    r = requests.get(f"{upstream}{path}", timeout=30)
+    if r.status_code != 200:
+        return None
+    record_path = get_record_path(config.record_dir, path)
+    os.makedirs(config.record_dir, exist_ok=True)
+    tmp_path = f"{record_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(r.content)
+    os.replace(tmp_path, record_path)
+    return r.content
+
+
+class ReplayServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], config: ReplayConfig):
+        super().__init__(address, ReplayHandler)
+        self.config = config
+        self.lock = threading.Lock()
+        # {ステータスコード: 件数}
+        self.stats = {}
+        self.window_start = time.monotonic()
+        self.window_count = 0
+
+    def is_rate_limited(self) -> bool:
+        if self.config.max_rps is None:
+            return False
+        with self.lock:
+            now = time.monotonic()
+            if now - self.window_start >= 1:
+                self.window_start = now
+                self.window_count = 0
+            self.window_count += 1
+            return self.window_count > self.config.max_rps
+
+    def count(self, status: int):
+        with self.lock:
+            self.stats[status] = self.stats.get(status, 0) + 1
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    server: ReplayServer
+    # ヘッダーと本文を別々に送るときの遅延を避ける
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(
+        self,
+        status: int,
+        body: bytes = b"",
+        content_type: str = "text/plain",
+        etag: Optional[str] = None,
+    ):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if etag is not None:
+            self.send_header("ETag", etag)
+        if status == 429:
+            self.send_header("Retry-After", str(self.server.config.retry_after))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+        self.server.count(status)
+
+    def _find_body(self) -> Optional[bytes]:
+        config = self.server.config
+        path = self.path
+        record_path = get_record_path(config.record_dir, path)
+        if os.path.isfile(record_path):
+            with open(record_path, "rb") as f:
+                return f.read()
+        if config.csv_dir is not None and path.startswith(s.RESULTS_CSV_ROOT_PATH):
+            if path.endswith("/"):
+                body = _list_csv_tree(config.csv_dir, path)
+            else:
+                body = _read_csv_file(config.csv_dir, path)
+            if body is not None:
+                return body
+        return _fetch_upstream(config, path)
+
+    def do_GET(self):
+        config = self.server.config
+        delay = config.latency + random.uniform(0, config.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+        if self.server.is_rate_limited() or random.random() < config.rate_429:
+            self._send(429, b"Too Many Requests")
+            return
+        if random.random() < config.rate_error:
+            self._send(random.choice([500, 503]), b"Server Error")
+            return
+
+        body = self._find_body()
+        if body is None:
+            self._send(404, b"Not Found")
+            return
+        # 条件付きリクエストに応答する (画像の更新の確認)
+        etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        if self.headers.get("If-None-Match") == etag:
+            self._send(304, etag=etag)
+            return
+        self._send(200, body, _guess_content_type(self.path), etag)
+
+    do_HEAD = do_GET
+
+
+def create_server(
+    config: ReplayConfig, host: str = "127.0.0.1", port: int = 8000
+) -> ReplayServer:
+    """
+    リプレイサーバーを作成する
+    serve_forever() で起動し、接続先は s.set_base_url(f"http://{host}:{port}") で切り替える
+    port に 0 を指定すると空いているポートを使う (server.server_port で取得できる)
+    """
+    return ReplayServer((host, port), config)
+
+
+def serve(config: ReplayConfig, host: str = "127.0.0.1", port: int = 8000):
+    """
+    リプレイサーバーを起動する (Ctrl+C で終了し、ステータスごとの件数を表示する)
+    """
+    server = create_server(config, host, port)
+    print(f"replay server listening on http://{host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"responses: {dict(sorted(server.stats.items()))}")
@@ -0,0 +1,231 @@
+import os
+from typing import NamedTuple, Optional
+
+import numpy as np
+import pandas as pd
+
+# stat.ink の戦績データの csv のスキーマのバージョン (カラムや型を変えたら上げる)
+SCHEMA_VERSION = 1
+
+try:
+    import pyarrow  # noqa: F401
+
+    ENGINE = "pyarrow"
+except ImportError:
+    ENGINE = "c"
+
+
+class Column(NamedTuple):
+    """
+    戦績データの csv のカラム
+
+    name: カラム名
+    dtype: 型 ("object" は文字列)
+    nullable: 欠損値があってよいか
+        False の整数のカラムに欠損値がある場合は float64 にして報告する
+    """
+
+    name: str
+    dtype: str
+    nullable: bool = True
+
+
+class Drift(NamedTuple):
+    """
+    ファイルとスキーマの差分
+
+    path: ファイルのパス
+    column: カラム名
+    kind: 差分の種類
+        "missing": スキーマにあるカラムがない (欠損値で補う)
+        "unexpected": スキーマにないカラムがある (そのまま残す)
+        "null": nullable でないカラムに欠損値がある
+        "dtype": スキーマの型に変換できない値がある
+    detail: 詳細
+    """
+
+    path: str
+    column: str
+    kind: str
+    detail: str
+
+
+def _create_player_columns() -> list[Column]:
+    columns = []
+    for team in ["A", "B"]:
+        for i in range(4):
+            player = f"{team}{i+1}"
+            columns.extend(
+                [
+                    Column(f"{player}-weapon", "object"),
+                    *[
+                        Column(f"{player}-{x}", "int64", nullable=False)
+                        for x in [
+                            "kill-assist",
+                            "kill",
+                            "assist",
+                            "death",
+                            "special",
+                            "inked",
+                        ]
+                    ],
+                    Column(f"{player}-abilities", "object"),
+                ]
+            )
+    return columns
+
+
+BATTLE_COLUMNS = [
+    Column("# season", "object", nullable=False),
+    Column("period", "datetime64[ns, UTC]", nullable=False),
+    Column("game-ver", "object", nullable=False),
+    Column("lobby", "object", nullable=False),
+    Column("mode", "object", nullable=False),
+    Column("stage", "object", nullable=False),
+    Column("time", "int64", nullable=False),
+    Column("win", "object", nullable=False),
+    # 欠損値は False にする
+    Column("knockout", "bool"),
+    Column("rank", "object"),
+    Column("x-power", "float64"),
+    *[
+        Column(f"{team}-{x}", dtype)
+        for team in ["our", "their"]
+        for x, dtype in [
+            ("inked", "float64"),
+            ("ink-percent", "float64"),
+            ("count", "float64"),
+            ("color", "object"),
+            ("theme", "object"),
+        ]
+    ],
+    *_create_player_columns(),
+]
+COLUMN_NAMES = list(map(lambda x: x.name, BATTLE_COLUMNS))
+
+# 読み込むときに型を指定するカラム (文字列のカラムを数値として推論させない)
+_READ_DTYPES = {x.name: "object" for x in BATTLE_COLUMNS if x.dtype == "object"}
+
+
+def _cast(
+    series: pd.Series, column: Column, path: str, drifts: list[Drift]
+) -> pd.Series:
+    if column.dtype == "object":
+        # 欠損値しかないカラムは数値として読み込まれる
+        if series.dtype != "object":
+            series = series.astype("object")
+        # pd.read_csv の pyarrow エンジンは空の文字列を欠損値にしない
+        empty = series.to_numpy() == ""
+        return series.mask(empty, np.nan) if empty.any() else series
+    if series.dtype == column.dtype:
+        return series
+    if column.dtype == "bool":
+        values = series.map({True: True, False: False, "TRUE": True, "FALSE": False})
+        unknown = series.notna() & values.isna()
+        if unknown.any():
+            drifts.append(
+                Drift(path, column.name, "dtype", f"{unknown.sum()} non-bool values")
+            )
+        return values.fillna(False).astype("bool")
+    if column.dtype.startswith("datetime64"):
+        return pd.to_datetime(series, utc=True)
+
+    values = pd.to_numeric(series, errors="coerce")
+    invalid = series.notna() & values.isna()
+    if invalid.any():
+        drifts.append(
+            Drift(path, column.name, "dtype", f"{invalid.sum()} non-numeric values")
+        )
+    if values.isna().any():
+        if not column.nullable:
+            drifts.append(
+                Drift(path, column.name, "null", f"{values.isna().sum()} null values")
+            )
+        return values.astype("float64")
+    return values.astype(column.dtype)
+
+
+def apply_schema(df: pd.DataFrame, path: str = "") -> tuple[pd.DataFrame, list[Drift]]:
+    """
+    読み込んだ戦績データをスキーマの型に変換する
+    スキーマにないカラムは末尾に残し、スキーマにあってファイルにないカラムは欠損値で補う
+
+    df: 戦績データの DataFrame
+    path: ファイルのパス (差分の報告に使う)
+
+    返り値: 変換した DataFrame と差分のリスト
+    """
+    drifts = []
+    columns = {}
+    for column in BATTLE_COLUMNS:
+        if column.name in df.columns:
+            columns[column.name] = _cast(df[column.name], column, path, drifts)
+            continue
+        drifts.append(Drift(path, column.name, "missing", f"expected {column.dtype}"))
+        series = pd.Series(np.nan, index=df.index)
+        columns[column.name] = _cast(series, column._replace(nullable=True), path, [])
+    for name in df.columns:
+        if name not in columns:
+            drifts.append(Drift(path, name, "unexpected", f"read as {df[name].dtype}"))
+            columns[name] = df[name]
+    return pd.DataFrame(columns, index=df.index), drifts
+
+
+def read_csv(
+    path: str, engine: Optional[str] = None
+) -> tuple[pd.DataFrame, list[Drift]]:
+    """
+    戦績データの csv ファイルをスキーマの型で読み込む
+    圧縮したファイルは拡張子から形式を判定して展開する
+
+    path: ファイルのパス
+    engine: pd.read_csv のエンジン (None の場合は pyarrow があれば pyarrow)
+
+    返り値: 読み込んだ DataFrame と差分のリスト
+    """
+    engine = engine or ENGINE
+    if engine == "pyarrow":
+        df = _read_csv_with_pyarrow(path)
+    else:
+        df = pd.read_csv(path, engine=engine, dtype=_READ_DTYPES)
+    return apply_schema(df, path)
+
+
+def _read_csv_with_pyarrow(path: str) -> pd.DataFrame:
+    """
+    pyarrow で直接読み込む
+    (pd.read_csv の pyarrow エンジンは型の指定をカラムごとの astype で行い、
+    空の文字列を欠損値にする設定も渡せないため)
+    """
+    import pyarrow as pa
+    from pyarrow import csv
+
+    convert_options = csv.ConvertOptions(
+        column_types={x: pa.string() for x in _READ_DTYPES},
+        strings_can_be_null=True,
+    )
+    return csv.read_csv(path, convert_options=convert_options).to_pandas()
+
+
+def report(drifts: list[Drift]):
+    """
+    差分を表示する
+    """
+    for drift in drifts:
+        name = os.path.basename(drift.path)
+        print(f"schema drift in {name}: {drift.column} ({drift.kind}, {drift.detail})")
+
+
+def check_files(paths: list[str], engine: Optional[str] = None) -> pd.DataFrame:
+    """
+    戦績データの csv ファイルとスキーマの差分を調べる
+    e.g. check_files(list(map(a.get_details_path, u.date_range(date_from, date_to))))
+
+    返り値: ファイルごとの差分の DataFrame (差分がなければ空)
+    """
+    drifts = []
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        drifts.extend(read_csv(path, engine)[1])
+    return pd.DataFrame(drifts, columns=Drift._fields)
@@ -1,9 +1,13 @@
 import os
+import csv
 import json
 import time
 import re
+import threading
+import contextvars
 import datetime as dt
-from typing import Union, Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Union, Optional
 
 import requests
 import pandas as pd
@@ -12,8 +16,12 @@ from bs4 import BeautifulSoup
 import src.utils as u
 import src.statink as s
 import src.constants as c
+import src.instrument as ins
+import src.metrics as m
+import src.crawl as cr
 
 
+@ins.instrument
 def update_source_weapons():
     """
     ブキデータを取得して更新する
@@ -61,6 +69,7 @@ def update_source_weapons():
     weapon_type.to_csv(c.SOURCE_TYPE_PATH, index=False)
 
 
+@ins.instrument
 def update_source_rules():
     """
     ルールデータを取得して更新する
@@ -77,6 +86,7 @@ def update_source_rules():
     rule.to_csv(c.SOURCE_RULE_PATH, index=False)
 
 
+@ins.instrument
 def update_source_stages():
     """
     ステージデータを取得して更新する
@@ -93,6 +103,7 @@ def update_source_stages():
     stage.to_csv(c.SOURCE_STAGE_PATH, index=False)
 
 
+@ins.instrument
 def update_source_lobbies():
     """
     ロビーデータを取得して更新する
@@ -109,80 +120,269 @@ def update_source_lobbies():
     lobby.to_csv(c.SOURCE_LOBBY_PATH, index=False)
 
 
-def _download_image_from_statink(asset_type: str, key: str, dst_dir: str):
-    url = f"{s.BASE_URL}{s.ASSETS_PATH}/{asset_type}/{key}.png"
-    print(url)
-    u.download_file_to_dir(url, dst_dir)
+def _get_image_url(asset_type: str, key: str) -> str:
+    # manifest には接続先に関わらず stat.ink の URL を記録する
+    return f"{s.STATINK_URL}{s.ASSETS_PATH}/{asset_type}/{key}.png"
 
 
-def update_source_images(delay: int):
+def _load_image_manifest(path: str) -> dict[str, dict]:
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _create_rate_limiter(delay: float) -> Callable[[], None]:
+    """
+    呼び出しの間隔を delay 秒以上にする関数を作成する (スレッド間で共有する)
+    """
+    lock = threading.Lock()
+    next_time = [0.0]
+
+    def wait():
+        with lock:
+            now = time.monotonic()
+            start = max(now, next_time[0])
+            next_time[0] = start + delay
+        time.sleep(start - now)
+
+    return wait
+
+
+def _download_image(
+    session: requests.Session,
+    url: str,
+    dst_path: str,
+    entry: Optional[dict],
+) -> tuple[str, Optional[dict]]:
+    """
+    画像を取得して一時ファイルに書き込んでから置き換える
+    manifest の ETag があれば If-None-Match で確認し、変わっていなければ取得しない
+
+    entry: manifest のこの画像の項目 (url, etag, size)
+    返り値: 結果 ("downloaded", "not-modified", "failed") と新しい manifest の項目
+    """
+    headers = {}
+    if entry is not None and entry.get("etag") and os.path.exists(dst_path):
+        headers["If-None-Match"] = entry["etag"]
+    try:
+        r = m.get(s.get_request_url(url), "image", session=session, headers=headers)
+    except requests.RequestException as e:
+        print(f"{url}: {e}")
+        return "failed", entry
+    if r.status_code == 304:
+        return "not-modified", {**entry, "url": url}
+    if r.status_code != 200:
+        print(f"{url}: status {r.status_code}")
+        return "failed", entry
+
+    tmp_path = f"{dst_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(r.content)
+    os.replace(tmp_path, dst_path)
+    return "downloaded", {
+        "url": url,
+        "etag": r.headers.get("ETag"),
+        "size": len(r.content),
+    }
+
+
+@ins.instrument
+def update_source_images(delay: float = 0, workers: int = 8, refresh: bool = False):
     """
     stat.ink から画像を取得する
-    すでにファイルがある場合はスキップ
+    IMAGES_DIR/manifest.json に画像ごとの URL, ETag, サイズを記録し、
+    ファイルがあって URL とサイズが記録と同じ場合はスキップする
+    (ASSETS_PATH が変わった場合は ETag で確認して変わったものだけ取得する)
 
-    delay: 取得間隔（秒）
+    delay: リクエストを開始する間隔（秒, すべてのワーカーで共有する）
+    workers: 同時に取得する数
+    refresh: すべての画像を ETag で確認する
     """
     os.makedirs(c.IMAGES_DIR, exist_ok=True)
+    manifest_path = f"{c.IMAGES_DIR}/manifest.json"
+    manifest = _load_image_manifest(manifest_path)
+
     source_list = [
         ("main", c.SOURCE_MAIN_PATH),
         ("sub", c.SOURCE_SUB_PATH),
         ("special", c.SOURCE_SPECIAL_PATH),
     ]
-    for i, (asset_type, source_path) in enumerate(source_list):
-        df = pd.read_csv(source_path)
-        for j, row in df.iterrows():
-            key = row["Key"]
-            path = f"{c.IMAGES_DIR}/{key}.png"
-            if os.path.exists(path):
+    tasks = []
+    for asset_type, source_path in source_list:
+        for key in pd.read_csv(source_path)["Key"]:
+            filename = f"{key}.png"
+            path = f"{c.IMAGES_DIR}/{filename}"
+            url = _get_image_url(asset_type, key)
+            entry = manifest.get(filename)
+            is_fresh = (
+                entry is not None
+                and entry["url"] == url
+                and os.path.exists(path)
+                and os.path.getsize(path) == entry["size"]
+            )
+            if is_fresh and not refresh:
                 continue
-            if not (i == 0 and j == 0):
-                time.sleep(delay)
-            _download_image_from_statink(asset_type, key, c.IMAGES_DIR)
-
+            tasks.append((filename, url, path, entry))
+    print(f"update {len(tasks)} images")
+    if len(tasks) == 0:
+        return
 
-def update_user_list():
+    # requests.Session はスレッドセーフとされていないので、ワーカーごとに作成して接続を再利用する
+    local = threading.local()
+    sessions = []
+    wait = _create_rate_limiter(delay)
+
+    def download(url: str, path: str, entry: Optional[dict]):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+            sessions.append(local.session)
+        wait()
+        return _download_image(local.session, url, path, entry)
+
+    results = {}
+    try:
+        with m.run("images"), ThreadPoolExecutor(max_workers=workers) as executor:
+            # ワーカーのスレッドには m.run で設定した job が引き継がれないのでコピーして渡す
+            futures = {
+                executor.submit(
+                    contextvars.copy_context().run, download, url, path, entry
+                ): filename
+                for filename, url, path, entry in tasks
+            }
+            for future in as_completed(futures):
+                filename = futures[future]
+                result, entry = future.result()
+                results[result] = results.get(result, 0) + 1
+                if entry is not None:
+                    manifest[filename] = entry
+    finally:
+        for session in sessions:
+            session.close()
+
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(dict(sorted(manifest.items())), f, indent=2)
+    os.replace(tmp_path, manifest_path)
+    print(results)
+
+
+def _load_usernames(path: str = c.USER_DATA_PATH) -> set[str]:
     """
-    stat.ink の最新のバトルからユーザー名を抽出して USER_DATA_PATH へ保存する
-    csv ファイルがすでに存在する場合は重複がないようにマージする
+    保存済みのユーザー名を読み込む
+    ファイルがなければヘッダーだけのファイルを作成する
     """
-    # ファイルがなければ作成する
-    os.makedirs(c.DATA_DIR, exist_ok=True)
-    if not os.path.exists(c.USER_DATA_PATH):
-        f = open(c.USER_DATA_PATH, "w")
-        f.write("Username")
-        f.close()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if not os.path.exists(path):
+        with open(path, "w") as f:
+            f.write("Username\n")
+    # "NA" などのユーザー名を欠損値にしない
+    users = pd.read_csv(path, dtype=str, keep_default_na=False)
+    return set(users["Username"])
 
-    df = pd.read_csv(c.USER_DATA_PATH)
 
-    # 最新のバトルデータを stat.ink から取得する
+def _append_usernames(usernames: list[str], path: str = c.USER_DATA_PATH):
+    """
+    ユーザー名をファイルの末尾に追加する
+    """
+    with open(path, "r+", newline="") as f:
+        # 末尾に改行がなければ追加する
+        f.seek(0, os.SEEK_END)
+        if f.tell() > 0:
+            f.seek(f.tell() - 1)
+            if f.read(1) != "\n":
+                f.write("\n")
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerows([x] for x in usernames)
+
+
+def _get_latest_usernames() -> list[str]:
+    """
+    stat.ink の最新のバトルから投稿者のユーザー名を取得する
+    """
     url = f"{s.BASE_URL}/api/internal/latest-battles"
-    r = requests.get(url)
+    r = m.get(url, "latest_battles")
 
-    # バトルデータをパースしてリストに変換する
-    battles_dict = json.loads(r.content)
-    battles = battles_dict["battles"]
+    # バトルデータをパースして username を抽出する
+    with m.parse("latest_battles"):
+        battles = json.loads(r.content)["battles"]
+        user_urls = map(lambda x: x["user"]["url"], battles)
+        usernames = map(lambda x: re.search(r"/@(.*)", x).group(1), user_urls)
+        # username の重複を排除する (順序は保つ)
+        return list(dict.fromkeys(usernames))
 
-    # バトルデータから投稿者の username を抽出する関数を定義する
-    def extract_username(battle):
-        user_url = battle["user"]["url"]
-        username = re.search(r"https://stat.ink/@(.*)", user_url)
-        return username.group(1)
 
-    # バトルのリストを username のリストに変換する
-    usernames = list(map(extract_username, battles))
-    # username の重複を排除する
-    unique_usernames = list(set(usernames))
-
-    # username のリストから DataFrame を作成する
-    latest_df = pd.DataFrame({"Username": unique_usernames})
+@ins.instrument
+def update_user_list():
+    """
+    stat.ink の最新のバトルからユーザー名を抽出して USER_DATA_PATH へ保存する
+    csv ファイルがすでに存在する場合は新しいユーザー名だけを追加する
+    """
+    known_usernames = _load_usernames()
+    with m.run("user_list"):
+        usernames = _get_latest_usernames()
+    new_usernames = [x for x in usernames if x not in known_usernames]
+    _append_usernames(new_usernames)
+
+
+@ins.instrument
+def discover_users(
+    min_interval: float = 30,
+    max_interval: float = 600,
+    max_polls: Optional[int] = None,
+):
+    """
+    stat.ink の最新のバトルを繰り返し取得して新しいユーザー名を USER_DATA_PATH へ追加する
+    既知のユーザー名はメモリ上の集合で判定し、新しいユーザー名だけを追記する
+    Ctrl+C で終了する
 
-    # 既存の DataFrame と今回取得した DataFrame をマージした新しい DataFrame を作成する
-    merged_df = pd.concat([df, latest_df], ignore_index=True)
-    # username の重複を排除する
-    merged_df = merged_df.drop_duplicates()
+    取得間隔は前回の取得と投稿者がどれだけ重なったかで調整する
+    - 半分未満 (取りこぼしている可能性がある): 間隔を半分にする
+    - 9割を超える (投稿が少ない): 間隔を1.5倍にする
 
-    # csv ファイルを上書きする
-    merged_df.to_csv(c.USER_DATA_PATH, index=False)
+    min_interval: 取得間隔の下限（秒）
+    max_interval: 取得間隔の上限（秒）
+    max_polls: 取得回数の上限 (None の場合は無制限)
+    """
+    known_usernames = _load_usernames()
+    print(f"discover users ({len(known_usernames)} known)")
+    interval = min_interval
+    previous_usernames = set()
+    poll_num = 0
+    with m.run("user_discovery"):
+        try:
+            while max_polls is None or poll_num < max_polls:
+                if poll_num > 0:
+                    time.sleep(interval)
+                poll_num += 1
+                try:
+                    usernames = _get_latest_usernames()
+                except (requests.RequestException, KeyError, ValueError) as e:
+                    print(e)
+                    interval = min(interval * 2, max_interval)
+                    continue
+
+                new_usernames = [x for x in usernames if x not in known_usernames]
+                if len(new_usernames) > 0:
+                    _append_usernames(new_usernames)
+                    known_usernames.update(new_usernames)
+
+                if len(usernames) > 0:
+                    overlap = len(previous_usernames.intersection(usernames))
+                    overlap_rate = overlap / len(usernames)
+                    if overlap_rate < 0.5:
+                        interval = max(interval / 2, min_interval)
+                    elif overlap_rate > 0.9:
+                        interval = min(interval * 1.5, max_interval)
+                previous_usernames = set(usernames)
+
+                print(
+                    f"poll {poll_num}: {len(new_usernames)} new users "
+                    f"({len(known_usernames)} known), next in {interval:.0f} s"
+                )
+                m.write_textfile()
+        except KeyboardInterrupt:
+            pass
 
 
 def _create_user_battle_list_item(battle_row):
@@ -193,7 +393,7 @@ def _create_user_battle_list_item(battle_row):
 
     # Url
     battle_path = battle_row.find("a", text="Detail").get("href")
-    battle_url = f"{s.BASE_URL}{battle_path}"
+    battle_url = f"{s.STATINK_URL}{battle_path}"
 
     # Username
     username = re.search(r"/@(.+)/spl3", battle_url).group(1)
@@ -218,16 +418,17 @@ def _create_user_battle_list_item(battle_row):
 def _get_user_battles_in_page(page_url: str) -> tuple[pd.DataFrame, Union[str, None]]:
     # user battle list ページをリクエストする
     print(f"request to {page_url}")
-    r = requests.get(page_url)
-    soup = BeautifulSoup(r.text, "html.parser")
+    r = m.get(page_url, "battle_list")
+    with m.parse("battle_list"):
+        soup = BeautifulSoup(r.text, "html.parser")
 
-    # ページ内の user_battle_list を取得する
-    battle_rows = soup.find_all("tr", class_="battle-row")
-    user_battle_list_in_page = list(map(_create_user_battle_list_item, battle_rows))
-    user_battles_df = pd.DataFrame(user_battle_list_in_page)
+        # ページ内の user_battle_list を取得する
+        battle_rows = soup.find_all("tr", class_="battle-row")
+        user_battle_list_in_page = list(map(_create_user_battle_list_item, battle_rows))
+        user_battles_df = pd.DataFrame(user_battle_list_in_page)
 
-    # 次ページの ancher タグを取得する
-    next_link_tag = soup.select_one("ul.pagination > li.next > a")
+        # 次ページの ancher タグを取得する
+        next_link_tag = soup.select_one("ul.pagination > li.next > a")
 
     if next_link_tag is None:
         return user_battles_df, None
@@ -256,38 +457,39 @@ def _check_duplication(
 
 def _get_new_user_battles_from_url(
     page_url: str, battles_old: pd.DataFrame, delay: int
-) -> pd.DataFrame:
+) -> tuple[pd.DataFrame, int]:
     battles_new, next_link = _get_user_battles_in_page(page_url)
     has_duplication, battles_up_to_date = _check_duplication(battles_old, battles_new)
 
     # 重複した or 次ページリンクがない => 終了
     if has_duplication or (next_link is None):
-        return battles_up_to_date
+        return battles_up_to_date, 1
 
     time.sleep(delay)
 
-    battles_up_to_date_on_next = _get_new_user_battles_from_url(
+    battles_up_to_date_on_next, page_num = _get_new_user_battles_from_url(
         next_link, battles_old, delay
     )
     battles_up_to_date = pd.concat(
         [battles_up_to_date, battles_up_to_date_on_next], ignore_index=True
     )
-    return battles_up_to_date
+    return battles_up_to_date, page_num + 1
 
 
 def _get_new_user_battles(
     username: str, battles_old: pd.DataFrame, lobby: str, delay: int
-) -> pd.DataFrame:
+) -> tuple[pd.DataFrame, int]:
     page_url = f"{s.BASE_URL}/@{username}/spl3?f%5Blobby%5D={lobby}"
-    battles_up_to_date = _get_new_user_battles_from_url(page_url, battles_old, delay)
-    return battles_up_to_date
+    return _get_new_user_battles_from_url(page_url, battles_old, delay)
 
 
 def _update_user_battle_list(
     username: str, battle_list_path: str, lobby: str, delay: int
-):
+) -> tuple[pd.DataFrame, int]:
     """
     指定したユーザー名についてバトル一覧を取得し csv を更新する
+
+    返り値: 新しいバトルとリクエストしたページ数
     """
     if not os.path.exists(battle_list_path):
         f = open(battle_list_path, "w")
@@ -297,21 +499,31 @@ def _update_user_battle_list(
     battles = pd.read_csv(battle_list_path)
     battles["Datetime"] = pd.to_datetime(battles["Datetime"])
     user_battles = battles[battles["Username"] == username]
-    new_user_battles = _get_new_user_battles(username, user_battles, lobby, delay)
+    new_user_battles, page_num = _get_new_user_battles(
+        username, user_battles, lobby, delay
+    )
 
     if new_user_battles.empty:
-        return
+        return new_user_battles, page_num
 
     battles_merged = pd.concat([new_user_battles, battles], ignore_index=True)
     battles_dedup = battles_merged.drop_duplicates()
     battles_sorted = battles_dedup.sort_values("Datetime", ascending=False)
 
     battles_sorted.to_csv(battle_list_path, index=False)
+    return new_user_battles, page_num
 
 
-def update_battle_list(battle_list_path: str, lobby: str, delay: int):
+@ins.instrument
+def update_battle_list(
+    battle_list_path: str,
+    lobby: str,
+    delay: int,
+    use_schedule: bool = True,
+    budget: Optional[int] = None,
+):
     """
-    USER_DATA_PATH のすべてのユーザー名について
+    USER_DATA_PATH のユーザー名について
     指定されたバトルの一覧を取得し指定したパスへ csv として保存する
 
     battle_list_path: バトル一覧の csv のファイルパス
@@ -320,17 +532,47 @@ def update_battle_list(battle_list_path: str, lobby: str, delay: int):
         bankara_challenge: バンカラマッチ（チャレンジ）
         splatfest_challenge: フェスマッチ（チャレンジ）
     delay: 取得間隔（秒）
+    use_schedule: ユーザーごとの投稿頻度と最後に新しいバトルがあった日時から
+        取得するユーザーと順番を決める (crawl.select_users)
+        False の場合はすべてのユーザーを取得する
+    budget: 1回の実行でリクエストするページ数の上限 (None の場合は制限なし)
     """
     users = pd.read_csv(c.USER_DATA_PATH)
-    user_num = len(users.index)
-    print(f"update battle list for {user_num} users")
-
-    for i, user in users.iterrows():
-        username = user["Username"]
-        if i != 0:
-            time.sleep(delay)
-        print(f"({i+1}/{user_num}): @{username}")
-        _update_user_battle_list(username, battle_list_path, lobby, delay)
+    usernames = users["Username"].tolist()
+    user_num = len(usernames)
+
+    if use_schedule:
+        if os.path.exists(battle_list_path):
+            battles = pd.read_csv(battle_list_path)
+        else:
+            battles = pd.DataFrame(columns=["Datetime", "Username"])
+        state = cr.load_state(usernames, battles, lobby)
+        usernames = cr.select_users(state)
+    target_num = len(usernames)
+    print(f"update battle list for {target_num}/{user_num} users")
+
+    page_total = 0
+    new_total = 0
+    with m.run(f"battle_list_{lobby}"):
+        try:
+            for i, username in enumerate(usernames):
+                if budget is not None and page_total >= budget:
+                    print(f"request budget ({budget} pages) exhausted")
+                    break
+                if i != 0:
+                    time.sleep(delay)
+                print(f"({i+1}/{target_num}): @{username}")
+                new_user_battles, page_num = _update_user_battle_list(
+                    username, battle_list_path, lobby, delay
+                )
+                page_total += page_num
+                new_total += len(new_user_battles.index)
+                if use_schedule:
+                    cr.record_poll(state, username, new_user_battles)
+        finally:
+            if use_schedule:
+                cr.save_state(state, lobby)
+    print(f"{new_total} new battles with {page_total} requests")
 
 
 def _get_result(texts: list[str]) -> str:
@@ -607,8 +849,13 @@ def _get_teams_data(players_soup) -> dict:
 
 
 def _get_battle_detail(page_url: str):
-    r = requests.get(page_url)
-    soup = BeautifulSoup(r.text, "html.parser")
+    r = m.get(s.get_request_url(page_url), "battle_detail")
+    with m.parse("battle_detail"):
+        return _parse_battle_detail(page_url, r.text)
+
+
+def _parse_battle_detail(page_url: str, html: str) -> dict:
+    soup = BeautifulSoup(html, "html.parser")
 
     username = re.search(r"/@(.+)/spl3", page_url).group(1)
 
@@ -681,6 +928,7 @@ def _append_new_details(
     return details
 
 
+@ins.instrument
 def update_battle_details(battles: pd.DataFrame, details_filepath: str, delay: int):
     """
     バトル詳細を取得して csv ファイルに保存する
@@ -702,22 +950,23 @@ def update_battle_details(battles: pd.DataFrame, details_filepath: str, delay: i
     print(f"get battle details for {battle_num} battles")
 
     detail_list = []
-    for index, battle in battles_unfetched.reset_index().iterrows():
-        if index != 0:
-            time.sleep(delay)
+    with m.run("battle_details"):
+        for index, battle in battles_unfetched.reset_index().iterrows():
+            if index != 0:
+                time.sleep(delay)
 
-        if index % 50 == 0:
-            details = _append_new_details(details, detail_list, details_filepath)
-            detail_list = []
+            if index % 50 == 0:
+                details = _append_new_details(details, detail_list, details_filepath)
+                detail_list = []
 
-        page_url = battle["Url"]
+            page_url = battle["Url"]
 
-        print(f"({index+1}/{battle_num}) request to {page_url}")
-        try:
-            detail_list_item = _get_battle_detail(page_url)
-            detail_list.append(detail_list_item)
-        except Exception as e:
-            print(e)
-            continue
+            print(f"({index+1}/{battle_num}) request to {page_url}")
+            try:
+                detail_list_item = _get_battle_detail(page_url)
+                detail_list.append(detail_list_item)
+            except Exception as e:
+                print(e)
+                continue
 
     _append_new_details(details, detail_list, details_filepath)
@@ -1,20 +1,23 @@
 import os
 import re
 import time
-import requests
+from typing import Optional
 from bs4 import BeautifulSoup
 import src.statink as s
 import src.constants as c
 import src.utils as u
+import src.instrument as ins
+import src.metrics as m
 
 
 def _get_csv_file_paths(current_path: str, delay: int) -> list[str]:
     url = f"{s.CSV_BASE_URL}{current_path}"
     print(f"request to {current_path}")
-    r = requests.get(url)
-    soup = BeautifulSoup(r.content, "html.parser")
-    anchors = soup.find_all("a")
-    paths = list(map(lambda x: x.get("href"), anchors))
+    r = m.get(url, "csv_index")
+    with m.parse("csv_index"):
+        soup = BeautifulSoup(r.content, "html.parser")
+        anchors = soup.find_all("a")
+        paths = list(map(lambda x: x.get("href"), anchors))
     csv_paths = list(filter(lambda x: re.match(rf"{current_path}.+\.csv", x), paths))
     dir_paths = list(filter(lambda x: re.match(rf"{current_path}.+/", x), paths))
 
@@ -29,17 +32,64 @@ def _get_csv_file_paths(current_path: str, delay: int) -> list[str]:
 def _check_csv_exist(file_url: str) -> bool:
     filename = os.path.basename(file_url)
     filepath = f"{c.STATINK_CSV_DIR}/{filename}"
-    return os.path.exists(filepath) and os.path.getsize(filepath) > 0
+    # 圧縮して保存したファイルも含める
+    suffixes = ["", *u.COMPRESSION_SUFFIXES.values()]
+    return any(
+        os.path.exists(filepath + x) and os.path.getsize(filepath + x) > 0
+        for x in suffixes
+    )
 
 
-def update_csv_files(delay: int):
-    csv_paths = _get_csv_file_paths(s.RESULTS_CSV_ROOT_PATH, delay)
-    non_existing_files = list(filter(lambda x: not _check_csv_exist(x), csv_paths))
+@ins.instrument
+def update_csv_files(
+    delay: int, compression: Optional[str] = c.STATINK_CSV_COMPRESSION
+):
+    """
+    stat.ink の戦績データの csv ファイルのうち、まだ保存していないものをダウンロードする
 
-    file_num = len(non_existing_files)
+    delay: 取得間隔（秒）
+    compression: 保存するときの圧縮形式 ("gzip", "zstd" または None)
+    """
+    with m.run("statink_csv"):
+        csv_paths = _get_csv_file_paths(s.RESULTS_CSV_ROOT_PATH, delay)
+        non_existing_files = list(filter(lambda x: not _check_csv_exist(x), csv_paths))
 
-    for i, path in enumerate(non_existing_files):
-        time.sleep(delay)
-        url = s.CSV_BASE_URL + path
-        print(f"({i+1}/{file_num}) download {url}")
-        u.download_file_to_dir(url, c.STATINK_CSV_DIR)
+        file_num = len(non_existing_files)
+
+        for i, path in enumerate(non_existing_files):
+            time.sleep(delay)
+            url = s.CSV_BASE_URL + path
+            print(f"({i+1}/{file_num}) download {url}")
+            u.download_file_to_dir(url, c.STATINK_CSV_DIR)
+            filepath = f"{c.STATINK_CSV_DIR}/{os.path.basename(path)}"
+            if compression is not None and os.path.exists(filepath):
+                u.compress_file(filepath, compression)
+
+
+@ins.instrument
+def compress_csv_files(
+    compression: str = "gzip", csv_dir: str = c.STATINK_CSV_DIR
+) -> list[str]:
+    """
+    保存済みの圧縮していない戦績データの csv ファイルを圧縮する
+
+    compression: 圧縮形式 ("gzip" または "zstd")
+    csv_dir: csv ファイルのディレクトリ
+
+    返り値: 圧縮したファイルのパス
+    """
+    filenames = sorted(
+        x for x in os.listdir(csv_dir) if re.fullmatch(r"\d{4}-\d{2}-\d{2}\.csv", x)
+    )
+    compressed_paths = []
+    for i, filename in enumerate(filenames):
+        filepath = f"{csv_dir}/{filename}"
+        size = os.path.getsize(filepath)
+        compressed_path = u.compress_file(filepath, compression)
+        compressed_size = os.path.getsize(compressed_path)
+        print(
+            f"({i+1}/{len(filenames)}) compress {filename}: "
+            f"{size / 2**20:.1f} MiB => {compressed_size / 2**20:.1f} MiB"
+        )
+        compressed_paths.append(compressed_path)
+    return compressed_paths
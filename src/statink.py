@@ -1,4 +1,11 @@
-BASE_URL = "https://stat.ink"
+import os
+
+# データに保存する URL は接続先に関わらず stat.ink のものにする
+STATINK_URL = "https://stat.ink"
+STATINK_CSV_URL = "https://dl-stats.stat.ink"
+
+# 接続先 (環境変数 STATINK_BASE_URL, STATINK_CSV_BASE_URL または set_base_url で変更できる)
+BASE_URL = os.environ.get("STATINK_BASE_URL", STATINK_URL)
 ASSETS_PATH = "/assets/20221214-340/famyarzcxqzf7anl"
 
 API_BASE_PATH = "/api/v3"
@@ -7,5 +14,32 @@ API_RULE_URL = f"{BASE_URL}{API_BASE_PATH}/rule"
 API_STAGE_URL = f"{BASE_URL}{API_BASE_PATH}/stage"
 API_LOBBY_URL = f"{BASE_URL}{API_BASE_PATH}/lobby"
 
-CSV_BASE_URL = "https://dl-stats.stat.ink"
+CSV_BASE_URL = os.environ.get("STATINK_CSV_BASE_URL", STATINK_CSV_URL)
 RESULTS_CSV_ROOT_PATH = "/splatoon-3/battle-results-csv/"
+
+
+def set_base_url(base_url: str, csv_base_url: str = None):
+    """
+    接続先を変更する
+    e.g. set_base_url("http://localhost:8000") でリプレイサーバーに接続する
+
+    base_url: stat.ink の接続先
+    csv_base_url: dl-stats.stat.ink の接続先 (None の場合は base_url と同じ)
+    """
+    global BASE_URL, CSV_BASE_URL
+    global API_WEAPON_URL, API_RULE_URL, API_STAGE_URL, API_LOBBY_URL
+    BASE_URL = base_url.rstrip("/")
+    CSV_BASE_URL = (csv_base_url or base_url).rstrip("/")
+    API_WEAPON_URL = f"{BASE_URL}{API_BASE_PATH}/weapon"
+    API_RULE_URL = f"{BASE_URL}{API_BASE_PATH}/rule"
+    API_STAGE_URL = f"{BASE_URL}{API_BASE_PATH}/stage"
+    API_LOBBY_URL = f"{BASE_URL}{API_BASE_PATH}/lobby"
+
+
+def get_request_url(url: str) -> str:
+    """
+    データに保存された stat.ink の URL を接続先の URL に変換する
+    """
+    if url.startswith(STATINK_URL):
+        return f"{BASE_URL}{url[len(STATINK_URL):]}"
+    return url
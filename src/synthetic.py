@@ -0,0 +1,442 @@
+import os
+import uuid
+import datetime as dt
+import numpy as np
+import pandas as pd
+
+import src.constants as c
+import src.definitions as d
+import src.utils as u
+
+PLAYER_NAMES = ["A1", "A2", "A3", "A4", "B1", "B2", "B3", "B4"]
+
+# stat.ink の戦績データの csv のカラム
+STATINK_PLAYER_ITEMS = [
+    "weapon",
+    "kill-assist",
+    "kill",
+    "assist",
+    "death",
+    "special",
+    "inked",
+    "abilities",
+]
+STATINK_COLUMNS = [
+    "# season",
+    "period",
+    "game-ver",
+    "lobby",
+    "mode",
+    "stage",
+    "time",
+    "win",
+    "knockout",
+    "rank",
+    "x-power",
+    "our-inked",
+    "our-ink-percent",
+    "our-count",
+    "our-color",
+    "our-theme",
+    "their-inked",
+    "their-ink-percent",
+    "their-count",
+    "their-color",
+    "their-theme",
+] + [f"{p}-{item}" for p in PLAYER_NAMES for item in STATINK_PLAYER_ITEMS]
+
+# スクレイピングしたバトル詳細の csv のカラム (scraping._get_battle_detail)
+DETAIL_PLAYER_ITEMS = [
+    "Main Weapon",
+    "Sub Weapon",
+    "Special Weapon",
+    "Inked",
+    "Kill & Assist",
+    "Kill",
+    "Assist",
+    "Death",
+    "Specials",
+]
+DETAIL_COLUMNS = (
+    [
+        "Username",
+        "Url",
+        "Datetime",
+        "Rule",
+        "Lobby",
+        "Stage",
+        "Win",
+        "Progress",
+        "X Power Before",
+        "X Power After",
+        "Time",
+        "User Agent",
+        "User Agent Version",
+        "Game Version",
+        "Stats",
+        "A Color",
+    ]
+    + [f"A{i} {item}" for i in range(1, 5) for item in DETAIL_PLAYER_ITEMS]
+    + ["B Color"]
+    + [f"B{i} {item}" for i in range(1, 5) for item in DETAIL_PLAYER_ITEMS]
+)
+
+LOBBY_WEIGHTS = {
+    d.Lobby.REGULAR.value: 0.2,
+    d.Lobby.BANKARA_OPEN.value: 0.2,
+    d.Lobby.BANKARA_CHALLENGE.value: 0.25,
+    d.Lobby.XMATCH.value: 0.35,
+}
+RANKED_MODES = ["area", "yagura", "hoko", "asari"]
+RANKS = ["C-", "C", "C+", "B-", "B", "B+", "A-", "A", "A+", "S"] + [
+    f"S+ {x}" for x in range(51)
+]
+COLOR_PAIRS = [
+    ("#d2e62b", "#6e3ac6"),
+    ("#df6624", "#343bc4"),
+    ("#c0358c", "#1bbe6e"),
+    ("#ceb121", "#3f2fc4"),
+    ("#e06b31", "#1a9fc3"),
+]
+
+
+def _load_weapons() -> pd.DataFrame:
+    """
+    ブキ一覧に人気の偏りを付けた重みを加える
+    """
+    main = pd.read_csv(c.SOURCE_MAIN_PATH)
+    main = main[main["Key"] != "heroshooter_replica"].reset_index(drop=True)
+    rng = np.random.default_rng(0)
+    order = rng.permutation(len(main.index))
+    weight = 1 / (order + 1) ** 0.8
+    main["Weight"] = weight / weight.sum()
+    return main
+
+
+def _format_ability_value(value: float) -> str:
+    value = round(value, 1)
+    return str(int(value)) if value == int(value) else str(value)
+
+
+def create_abilities_pool(size: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    stat.ink の abilities 形式の文字列をランダムに作成する
+    メイン3つ (1.0) とサブ9つ (0.3) を組み合わせ、値の大きい順に並べる
+    e.g. {"swim_speed_up":1.3,"ink_saver_main":1,...,"stealth_jump":true}
+    """
+    standard = d.STANDARD_ABILITIES
+    popularity = 1 / (rng.permutation(len(standard)) + 1)
+    popularity = popularity / popularity.sum()
+    pool = []
+    for _ in range(size):
+        values = {}
+        exclusives = []
+        for part in ["head", "clothing", "shoes"]:
+            if rng.random() < 0.35:
+                exclusives.append(rng.choice(d.EXCLUSIVE_ABILITIES[part]))
+            else:
+                key = rng.choice(standard, p=popularity)
+                values[key] = values.get(key, 0) + 1.0
+        for key in rng.choice(standard, size=9, p=popularity):
+            values[key] = values.get(key, 0) + 0.3
+        items = sorted(values.items(), key=lambda x: (-x[1], x[0]))
+        body = [f'"{k}":{_format_ability_value(v)}' for k, v in items]
+        body += [f'"{k}":true' for k in exclusives]
+        pool.append("{" + ",".join(body) + "}")
+    return np.array(pool, dtype=object)
+
+
+def _create_schedule(
+    rng: np.random.Generator, stages: np.ndarray
+) -> dict[str, tuple[np.ndarray, np.ndarray]]:
+    """
+    2時間ごとのスケジュール (ロビーごとのモードとステージ2つ) を作成する
+    """
+    schedule = {}
+    for lobby in LOBBY_WEIGHTS:
+        if lobby == d.Lobby.REGULAR.value:
+            modes = np.full(12, "nawabari", dtype=object)
+        else:
+            modes = rng.choice(RANKED_MODES, size=12)
+        schedule[lobby] = (modes, rng.choice(stages, size=(12, 2)))
+    return schedule
+
+
+def _generate_players(
+    n: int,
+    time: np.ndarray,
+    won: np.ndarray,
+    weapons: pd.DataFrame,
+    rng: np.random.Generator,
+) -> dict[str, np.ndarray]:
+    """
+    1チーム分 (n 試合 x 1人) のプレイヤーの成績を作成する
+    """
+    scale = time / 300
+    weapon_index = rng.choice(len(weapons.index), size=n, p=weapons["Weight"])
+    kill = rng.poisson(6.9 * scale * np.where(won, 1.2, 0.8))
+    assist = rng.poisson(2.2 * scale)
+    death = rng.poisson(5.1 * scale * np.where(won, 0.8, 1.2))
+    special = rng.poisson(2.9 * scale)
+    inked = np.maximum(rng.normal(970, 350, size=n) * scale, 30).astype("int64")
+    return {
+        "weapon_index": weapon_index,
+        "kill-assist": kill + assist,
+        "kill": kill,
+        "assist": assist,
+        "death": death,
+        "special": special,
+        "inked": inked,
+    }
+
+
+def generate_statink_battles(
+    date: dt.date,
+    n: int,
+    rng: np.random.Generator,
+    game_ver: str = "2.0.1",
+    season: str = "Chill Season 2022",
+) -> pd.DataFrame:
+    """
+    stat.ink の戦績データの csv と同じレイアウトで n 試合分の戦績データを作成する
+    ブキは sources/main.csv のキーを人気の偏りを付けて使う
+
+    date: 日付 (period はこの日の 2 時間ごとの時刻)
+    n: 試合数
+    rng: 乱数生成器
+    """
+    weapons = _load_weapons()
+    stages = pd.read_csv(c.SOURCE_STAGE_PATH)["Key"].to_numpy()
+    abilities_pool = create_abilities_pool(500, np.random.default_rng(1))
+    schedule = _create_schedule(np.random.default_rng(date.toordinal()), stages)
+
+    lobbies = np.array(list(LOBBY_WEIGHTS), dtype=object)
+    lobby = rng.choice(lobbies, size=n, p=list(LOBBY_WEIGHTS.values()))
+    slot = rng.integers(12, size=n)
+    mode = np.empty(n, dtype=object)
+    stage = np.empty(n, dtype=object)
+    for key, (modes, slot_stages) in schedule.items():
+        mask = lobby == key
+        mode[mask] = modes[slot[mask]]
+        stage[mask] = slot_stages[slot[mask], rng.integers(2, size=mask.sum())]
+
+    start = dt.datetime.combine(date, dt.time(), tzinfo=dt.timezone.utc)
+    periods = np.array(
+        [(start + dt.timedelta(hours=2 * i)).isoformat() for i in range(12)],
+        dtype=object,
+    )
+    period = periods[slot]
+
+    # 試合時間とノックアウト
+    nawabari = mode == "nawabari"
+    knockout = ~nawabari & (rng.random(n) < 0.5)
+    time = np.where(
+        knockout,
+        rng.integers(40, 300, size=n),
+        300 + np.minimum(rng.exponential(30, size=n), 150).astype("int64"),
+    )
+    time = np.where(nawabari, 180, time)
+
+    alpha_won = rng.random(n) < 0.5
+    win = np.where(alpha_won, "alpha", "bravo")
+
+    battles = pd.DataFrame(index=range(n))
+    battles["# season"] = season
+    battles["period"] = period
+    battles["game-ver"] = game_ver
+    battles["lobby"] = lobby
+    battles["mode"] = mode
+    battles["stage"] = stage
+    battles["time"] = time
+    battles["win"] = win
+    battles["knockout"] = np.where(nawabari, "", np.where(knockout, "TRUE", "FALSE"))
+
+    bankara = np.isin(lobby, ["bankara_open", "bankara_challenge"])
+    battles["rank"] = np.where(bankara, rng.choice(RANKS, size=n), "")
+    xpower = np.round(np.clip(rng.normal(1900, 200, size=n), 500, 3500), 1)
+    battles["x-power"] = np.where(lobby == "xmatch", xpower, np.nan)
+
+    # ナワバリは塗り、ガチルールはカウント
+    our_percent = np.round(np.clip(rng.normal(46, 9, size=n), 5, 90), 1)
+    their_percent = np.round(np.clip(rng.normal(45, 9, size=n), 5, 90), 1)
+    our_count = np.where(knockout, 100, rng.integers(20, 100, size=n))
+    their_count = (rng.random(n) * our_count).astype("int64")
+    our_count, their_count = (
+        np.where(alpha_won, our_count, their_count),
+        np.where(alpha_won, their_count, our_count),
+    )
+    battles["our-inked"] = np.where(nawabari, (our_percent * 72).round(), np.nan)
+    battles["our-ink-percent"] = np.where(nawabari, our_percent, np.nan)
+    battles["our-count"] = np.where(nawabari, np.nan, our_count)
+    battles["our-color"] = ""
+    battles["our-theme"] = ""
+    battles["their-inked"] = np.where(nawabari, (their_percent * 72).round(), np.nan)
+    battles["their-ink-percent"] = np.where(nawabari, their_percent, np.nan)
+    battles["their-count"] = np.where(nawabari, np.nan, their_count)
+    battles["their-color"] = ""
+    battles["their-theme"] = ""
+
+    weapon_keys = weapons["Key"].to_numpy()
+    for player_name in PLAYER_NAMES:
+        won = alpha_won if player_name[0] == "A" else ~alpha_won
+        player = _generate_players(n, time, won, weapons, rng)
+        battles[f"{player_name}-weapon"] = weapon_keys[player["weapon_index"]]
+        for item in ["kill-assist", "kill", "assist", "death", "special", "inked"]:
+            battles[f"{player_name}-{item}"] = player[item]
+        abilities = abilities_pool[rng.integers(len(abilities_pool), size=n)]
+        has_abilities = rng.random(n) < 0.85
+        battles[f"{player_name}-abilities"] = np.where(has_abilities, abilities, "")
+
+    return battles[STATINK_COLUMNS]
+
+
+def write_statink_csv_files(
+    dst_dir: str,
+    date_from: dt.date,
+    date_to: dt.date,
+    battles_per_day: int,
+    seed: int = 0,
+    chunk_size: int = 100_000,
+    **kwargs,
+):
+    """
+    日付の期間について stat.ink 形式の戦績データの csv ファイル (YYYY-MM-DD.csv) を作成する
+    1日あたりの試合数が多くても chunk_size ずつ追記するのでメモリ使用量は一定
+
+    dst_dir: 保存先のディレクトリ (c.STATINK_CSV_DIR を上書きしないように注意する)
+    battles_per_day: 1日あたりの試合数
+    seed: 乱数のシード
+    kwargs: generate_statink_battles に渡す引数
+    """
+    os.makedirs(dst_dir, exist_ok=True)
+    for date in u.date_range(date_from, date_to):
+        rng = np.random.default_rng([seed, date.toordinal()])
+        path = f"{dst_dir}/{date}.csv"
+        print(f"write {battles_per_day} battles to {path}")
+        for i, start in enumerate(range(0, battles_per_day, chunk_size)):
+            n = min(chunk_size, battles_per_day - start)
+            battles = generate_statink_battles(date, n, rng, **kwargs)
+            battles.to_csv(
+                path, mode="w" if i == 0 else "a", header=i == 0, index=False
+            )
+
+
+def generate_battle_details(
+    date_from: dt.date,
+    date_to: dt.date,
+    n: int,
+    rng: np.random.Generator,
+    lobby: d.Lobby = d.Lobby.XMATCH,
+    user_num: int = 1000,
+    game_ver: str = "2.0.1",
+) -> pd.DataFrame:
+    """
+    スクレイピングしたバトル詳細 (scraping.update_battle_details) と同じ
+    レイアウトで n 試合分のバトル詳細を作成する
+    """
+    weapons = _load_weapons()
+    rules = RANKED_MODES if lobby != d.Lobby.REGULAR else ["nawabari"]
+    stages = pd.read_csv(c.SOURCE_STAGE_PATH)["Key"].to_numpy()
+
+    start = dt.datetime.combine(date_from, dt.time(), tzinfo=u.TZ_JST)
+    seconds = (date_to - date_from).days * 24 * 60 * 60
+    datetimes = pd.to_datetime(
+        start.timestamp() + rng.integers(seconds, size=n), unit="s", utc=True
+    ).tz_convert(u.TZ_JST)
+
+    usernames = np.array([f"user{x:05d}" for x in range(user_num)], dtype=object)
+    username = usernames[rng.integers(user_num, size=n)]
+    random_bytes = rng.bytes(16 * n)
+    battle_ids = [
+        str(uuid.UUID(bytes=random_bytes[i * 16 : (i + 1) * 16], version=4))
+        for i in range(n)
+    ]
+
+    rule = rng.choice(rules, size=n)
+    knockout = (rule != "nawabari") & (rng.random(n) < 0.5)
+    time = np.where(
+        knockout,
+        rng.integers(40, 300, size=n),
+        300 + np.minimum(rng.exponential(30, size=n), 150).astype("int64"),
+    )
+    time = np.where(rule == "nawabari", 180, time)
+    alpha_won = rng.random(n) < 0.5
+    xpower = np.round(np.clip(rng.normal(1900, 200, size=n), 500, 3500), 1)
+    has_xpower = lobby == d.Lobby.XMATCH
+
+    details = pd.DataFrame(index=range(n))
+    details["Username"] = username
+    details["Url"] = [
+        f"https://stat.ink/@{user}/spl3/{battle_id}"
+        for user, battle_id in zip(username, battle_ids)
+    ]
+    details["Datetime"] = datetimes.astype(str)
+    details["Rule"] = rule
+    details["Lobby"] = lobby.value
+    details["Stage"] = rng.choice(stages, size=n)
+    details["Win"] = np.where(alpha_won, "alpha", "bravo")
+    details["Progress"] = None
+    details["X Power Before"] = xpower if has_xpower else np.nan
+    details["X Power After"] = (
+        np.round(xpower + np.where(alpha_won, 10, -10), 1) if has_xpower else np.nan
+    )
+    details["Time"] = time
+    details["User Agent"] = "s3s"
+    details["User Agent Version"] = "0.2.1"
+    details["Game Version"] = f"v{game_ver}"
+    details["Stats"] = np.where(rng.random(n) < 0.95, "allow", "deny")
+
+    color_pairs = np.array(COLOR_PAIRS, dtype=object)[
+        rng.integers(len(COLOR_PAIRS), size=n)
+    ]
+    swap = rng.integers(2, size=n)
+    details["A Color"] = color_pairs[np.arange(n), swap]
+    details["B Color"] = color_pairs[np.arange(n), 1 - swap]
+
+    for player_name in PLAYER_NAMES:
+        won = alpha_won if player_name[0] == "A" else ~alpha_won
+        player = _generate_players(n, time, won, weapons, rng)
+        weapon = weapons.iloc[player["weapon_index"]]
+        details[f"{player_name} Main Weapon"] = weapon["Key"].to_numpy()
+        details[f"{player_name} Sub Weapon"] = weapon["Sub"].to_numpy()
+        details[f"{player_name} Special Weapon"] = weapon["Special"].to_numpy()
+        details[f"{player_name} Inked"] = player["inked"]
+        details[f"{player_name} Kill & Assist"] = player["kill-assist"]
+        details[f"{player_name} Kill"] = player["kill"]
+        details[f"{player_name} Assist"] = player["assist"]
+        details[f"{player_name} Death"] = player["death"]
+        details[f"{player_name} Specials"] = player["special"]
+
+    details = details.sort_values("Datetime", ascending=False)
+    return details[DETAIL_COLUMNS]
+
+
+def write_battle_details_file(
+    dst_dir: str,
+    date_from: dt.date,
+    date_to: dt.date,
+    battle_num: int,
+    lobby: d.Lobby = d.Lobby.XMATCH,
+    seed: int = 0,
+    chunk_size: int = 100_000,
+    **kwargs,
+) -> str:
+    """
+    バトル詳細の csv ファイル (details_<lobby>_<from>_<to>.csv) を作成する
+    ファイル名は date_to の前日までの期間を表す (e.g. details_xmatch_221201_221207.csv)
+
+    dst_dir: 保存先のディレクトリ
+    battle_num: 試合数
+    kwargs: generate_battle_details に渡す引数
+    """
+    os.makedirs(dst_dir, exist_ok=True)
+    date_last = date_to - dt.timedelta(days=1)
+    filename = f"details_{lobby.value}_{date_from:%y%m%d}_{date_last:%y%m%d}.csv"
+    path = f"{dst_dir}/{filename}"
+    print(f"write {battle_num} battle details to {path}")
+    rng = np.random.default_rng(seed)
+    for i, start in enumerate(range(0, battle_num, chunk_size)):
+        n = min(chunk_size, battle_num - start)
+        details = generate_battle_details(date_from, date_to, n, rng, lobby, **kwargs)
+        details.to_csv(path, mode="w" if i == 0 else "a", header=i == 0, index=False)
+    return path
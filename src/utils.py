@@ -1,9 +1,15 @@
 import os
+import gzip
+import shutil
 import datetime as dt
-import requests
+from typing import IO
+import src.metrics as m
 
 TZ_JST = dt.timezone(dt.timedelta(hours=9))
 
+# 圧縮形式ごとの拡張子 (pandas の compression の名前と同じ)
+COMPRESSION_SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+
 
 def date_range(start, stop, step=dt.timedelta(days=1)):
     current = start
@@ -17,7 +23,7 @@ def download_file(url: str, dst_path: str):
     url が指すファイルを指定したパスにダウンロードする
     """
     try:
-        r = requests.get(url)
+        r = m.get(url, "download")
         with open(dst_path, mode="wb") as f:
             f.write(r.content)
     except Exception as e:
@@ -33,6 +39,49 @@ def download_file_to_dir(url, dst_dir):
     download_file(url, os.path.join(dst_dir, os.path.basename(url)))
 
 
+def open_file(path: str) -> IO[bytes]:
+    """
+    ファイルをバイナリモードで開く
+    拡張子が .gz, .zst の場合は展開しながら読み込む
+    """
+    if path.endswith(COMPRESSION_SUFFIXES["gzip"]):
+        return gzip.open(path, "rb")
+    if path.endswith(COMPRESSION_SUFFIXES["zstd"]):
+        import zstandard
+
+        return zstandard.open(path, "rb")
+    return open(path, "rb")
+
+
+def compress_file(path: str, compression: str, level: int = 6) -> str:
+    """
+    ファイルを圧縮して元のファイルを削除する
+    zstd を使う場合は zstandard が必要
+
+    path: 圧縮するファイルのパス
+    compression: 圧縮形式 ("gzip" または "zstd")
+    level: 圧縮レベル
+
+    返り値: 圧縮したファイルのパス (元のパス + ".gz" または ".zst")
+    """
+    dst_path = path + COMPRESSION_SUFFIXES[compression]
+    tmp_path = f"{dst_path}.tmp"
+    with open(path, "rb") as src:
+        if compression == "gzip":
+            dst = gzip.open(tmp_path, "wb", compresslevel=level)
+        else:
+            import zstandard
+
+            dst = zstandard.open(
+                tmp_path, "wb", cctx=zstandard.ZstdCompressor(level=level, threads=-1)
+            )
+        with dst:
+            shutil.copyfileobj(src, dst, 2**20)
+    os.replace(tmp_path, dst_path)
+    os.remove(path)
+    return dst_path
+
+
 def color_code_to_rgb(code: str) -> tuple[int, int, int]:
     """
     カラーコードを RGB に変換する
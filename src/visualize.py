@@ -7,8 +7,10 @@ import pandas as pd
 
 import src.constants as c
 import src.japanize as j
+import src.instrument as ins
 
 
+@ins.instrument
 def get_translations():
     source_list = [
         c.SOURCE_MAIN_PATH,
@@ -24,6 +26,7 @@ def get_translations():
     return translation["Name"].to_dict()
 
 
+@ins.instrument
 def show_aggregated_heatmap(
     aggregated: pd.DataFrame,
     title: Optional[str] = None,
@@ -72,6 +75,7 @@ def show_aggregated_heatmap(
     plt.show()
 
 
+@ins.instrument
 def show_xpower_dist(details: pd.DataFrame):
     sns.set_theme()
 
@@ -6,9 +6,12 @@ import seaborn as sns
 import pandas as pd
 
 import src.constants as c
+import src.analytics2 as a
 import src.japanize as j
+import src.instrument as ins
 
 
+@ins.instrument
 def get_translations():
     source_list = [
         c.SOURCE_MAIN_PATH,
@@ -24,6 +27,7 @@ def get_translations():
     return translation["Name"].to_dict()
 
 
+@ins.instrument
 def show_aggregated_heatmap(
     aggregated: pd.DataFrame,
     title: Optional[str] = None,
@@ -78,6 +82,7 @@ def show_aggregated_heatmap(
     return plt, ax
 
 
+@ins.instrument
 def show_xpower_dist(details: pd.DataFrame):
     sns.set_theme()
 
@@ -87,20 +92,13 @@ def show_xpower_dist(details: pd.DataFrame):
     return plt, ax
 
 
+@ins.instrument
 def show_xpower_vs_weapon_usage(
     players: pd.DataFrame, mode: str, figsize: tuple[float, float] = (8, 6)
 ):
-    mode_players = players[players["mode"] == mode].copy()
-    weapon_order = mode_players["weapon"].value_counts().to_frame().index.to_list()
-    # トップブキを抽出する
-    top_weapons = weapon_order[:9]
-
-    # トップブキ以外を other で置き換える
-    mode_players["weapon-dummy"] = mode_players.apply(
-        lambda x: x["weapon"] if x["weapon"] in top_weapons else "other", axis=1
-    )
-
-    top_weapons.append("other")
+    # トップブキとその他のブキの使用率の分布を計算する
+    density = a.xpower_weapon_usage_density(players, mode, top_n=9, bw_adjust=2)
+    top_weapons = density.columns.to_list()
 
     translations = {**get_translations(), "other": "その他"}
     translated_top_weapons = list(map(lambda x: translations[x], top_weapons))
@@ -108,31 +106,85 @@ def show_xpower_vs_weapon_usage(
     sns.set_theme()
     j.japanize()
 
-    g = sns.displot(
-        data=mode_players,
-        x="x-power",
-        hue="weapon-dummy",
-        hue_order=top_weapons,
-        kind="kde",
-        multiple="fill",
-        bw_adjust=2,
+    f, ax = plt.subplots(figsize=figsize)
+    # 凡例の上から順に積み上がるように逆順に描画する
+    colors = sns.color_palette(n_colors=len(top_weapons))
+    ax.stackplot(
+        density.index,
+        density.to_numpy().T[::-1],
+        labels=translated_top_weapons[::-1],
+        colors=colors[::-1],
+        alpha=0.75,
+        linewidth=0,
     )
-    g.ax.set(
+    ax.set(
         title=f"Xパワーvsブキ使用率（{translations[mode]}）",
         xlabel="Xパワー",
         ylabel="ブキ使用率 [%]",
         xlim=(1400, 2600),
+        ylim=(0, 1),
     )
 
     # y軸のラベル表示を変更する
-    yticks = g.ax.get_yticks()
+    yticks = ax.get_yticks()
     yticklabels = list(map(lambda x: f"{round(x * 100)}", yticks))
-    g.ax.set(yticks=yticks, yticklabels=yticklabels)
+    ax.set(yticks=yticks, yticklabels=yticklabels)
+
+    handles, labels = ax.get_legend_handles_labels()
+    ax.legend(
+        handles[::-1],
+        labels[::-1],
+        loc="center left",
+        bbox_to_anchor=(1, 0.5),
+        frameon=False,
+    )
+    f.tight_layout()
+
+    return plt, ax
+
+
+@ins.instrument
+def show_time_series(
+    rolling: pd.DataFrame,
+    mode: str,
+    target: str = "usage-rate",
+    subjects: Optional[list[str]] = None,
+    top_n: int = 8,
+    title: Optional[str] = None,
+    figsize: tuple[float, float] = (10, 6),
+):
+    """
+    a.rolling_index_per_subject の結果を折れ線グラフで表示する
+
+    rolling: a.rolling_index_per_subject の結果
+    mode: 表示するモード
+    target: 表示する指標 ("usage-rate" or "win-rate")
+    subjects: 表示する対象 (None の場合は期間中の使用率が高い top_n 個)
+    """
+    subject = rolling.columns[2]
+    df = rolling[rolling["mode"] == mode]
+    if subjects is None:
+        usage = df.groupby(subject)["count"].sum().sort_values(ascending=False)
+        subjects = usage.index[:top_n].to_list()
+    df = df[df[subject].isin(subjects)]
+
+    translations = get_translations()
+    df = df.assign(name=df[subject].map(lambda x: translations.get(x, x)))
+    names = list(map(lambda x: translations.get(x, x), subjects))
+
+    sns.set_theme()
+    j.japanize()
 
-    legend = g.fig.legends[0]
-    legend.set_title("")
-    for i, t in enumerate(legend.texts):
-        t.set_text(translated_top_weapons[i])
-    g.fig.set_size_inches(figsize)
+    f, ax = plt.subplots(figsize=figsize)
+    sns.lineplot(data=df, x="date", y=target, hue="name", hue_order=names, ax=ax)
+    ylabel = {"usage-rate": "使用率 [%]", "win-rate": "勝率 [%]"}.get(target, target)
+    ax.set(
+        title=title or f"{translations.get(mode, mode)}",
+        xlabel="",
+        ylabel=ylabel,
+    )
+    ax.legend(loc="center left", bbox_to_anchor=(1, 0.5), frameon=False)
+    f.autofmt_xdate()
+    f.tight_layout()
 
-    return plt, g.ax
+    return plt, ax
@@ -0,0 +1,107 @@
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+
+import src.analytics2 as a
+import src.constants as c
+import src.definitions as d
+import src.synthetic as sy
+
+DATE = dt.date(2022, 12, 1)
+
+
+def _battles(n: int = 200) -> pd.DataFrame:
+    battles = sy.generate_statink_battles(DATE, n, np.random.default_rng(0))
+    battles.insert(2, "date", pd.to_datetime(str(DATE)))
+    return battles
+
+
+def _swap_teams(battles: pd.DataFrame) -> pd.DataFrame:
+    """
+    同じ試合を相手チームのプレイヤーが投稿したものを作る
+    チームを入れ替えて win を反転し、チーム内のプレイヤーの順序も変える
+    """
+    swapped = battles.copy()
+    order = [4, 1, 3, 2]
+    for team, other in [("A", "B"), ("B", "A")]:
+        for i, j in enumerate(order):
+            for col in battles.columns:
+                if col.startswith(f"{other}{j}-"):
+                    swapped[f"{team}{i+1}-{col[3:]}"] = battles[col]
+    swapped["win"] = battles["win"].map({"alpha": "bravo", "bravo": "alpha"})
+    return swapped
+
+
+def test_battle_fingerprint_same_for_swapped_teams():
+    battles = _battles()
+    fingerprint = a.battle_fingerprint(battles)
+    assert fingerprint.is_unique
+    assert fingerprint.equals(a.battle_fingerprint(_swap_teams(battles)))
+
+
+def test_battle_fingerprint_differs_by_result():
+    battles = _battles()
+    flipped = battles.copy()
+    flipped["win"] = battles["win"].map({"alpha": "bravo", "bravo": "alpha"})
+    fingerprint = a.battle_fingerprint(battles)
+    assert (fingerprint != a.battle_fingerprint(flipped)).all()
+
+
+def test_drop_duplicate_battles():
+    battles = _battles()
+    swapped = _swap_teams(battles.iloc[:50])
+    details = pd.concat([battles, swapped], ignore_index=True)
+    deduped = a.drop_duplicate_battles(details)
+    pd.testing.assert_frame_equal(deduped, battles)
+
+
+def test_parse_abilities():
+    abilities = pd.Series(
+        [
+            '{"swim_speed_up":1.3,"ink_saver_main":1,"run_speed_up":0.6,"stealth_jump":true}',
+            np.nan,
+            '{"swim_speed_up":0.3,"comeback":true,"ninja_squid":true}',
+        ],
+        index=[10, 11, 12],
+    )
+    parsed = a.parse_abilities(abilities)
+    assert list(parsed.index) == [10, 11, 12]
+    assert (parsed.dtypes == "uint8").all()
+    expected = {
+        "ability-swim_speed_up": [13, 0, 3],
+        "ability-ink_saver_main": [10, 0, 0],
+        "ability-run_speed_up": [6, 0, 0],
+        "ability-stealth_jump": [10, 0, 0],
+        "ability-comeback": [0, 0, 10],
+        "ability-ninja_squid": [0, 0, 10],
+    }
+    for col, values in expected.items():
+        assert parsed[col].tolist() == values
+    others = parsed.drop(columns=list(expected))
+    assert (others == 0).all().all()
+
+
+def test_aggregate_index_per_subjects(tmp_path, monkeypatch):
+    sy.write_statink_csv_files(str(tmp_path), DATE, DATE + dt.timedelta(days=1), 2000)
+    monkeypatch.setattr(c, "STATINK_CSV_DIR", str(tmp_path))
+    details = a.read_details_on(DATE, d.Lobby.BANKARA_CHALLENGE)
+    players = a.details_to_players(details)
+
+    subjects = ["weapon", "weapon-sub", "weapon-special"]
+    targets = ["usage-rate", "win-rate", "kill"]
+    results = a.aggregate_index_per_subjects(players, subjects, targets)
+    assert set(results) == {(s, t) for s in subjects for t in targets}
+    for (subject, target), df in results.items():
+        expected = a.aggregate_index_per_subject(players, subject, target)
+        pd.testing.assert_frame_equal(df, expected)
+
+    targets = ["usage-rate", "win-rate"]
+    results = a.aggregate_index_per_subjects(
+        players, subjects, targets, interval="wilson"
+    )
+    for (subject, target), df in results.items():
+        expected = a.aggregate_index_per_subject(
+            players, subject, target, interval="wilson"
+        )
+        pd.testing.assert_frame_equal(df, expected)